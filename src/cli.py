@@ -0,0 +1,476 @@
+import argparse
+from pathlib import Path
+from typing import Any
+
+from dotenv import load_dotenv
+
+from src.komponenten.referenzdokumente.referenzdokumente_models import (
+    Zusammenfassung,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.pdf_backends import (
+    PDF_BACKENDS,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.pdf_benchmark import (
+    benchmark_bericht,
+    pdf_backends_vergleichen,
+)
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_jobs import (
+    Jobqueue,
+    worker_pool_starten,
+)
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_lauf import (
+    SiliconSamplesLauf,
+    lade_personas,
+    lade_prompts,
+)
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_models import (
+    AUSFUEHRUNGSMODI,
+    SHARD_STRATEGIEN,
+    Ausfuehrung,
+    Referenzauswahl,
+    Shard,
+)
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_zusammenfuehren import (
+    shards_zusammenfuehren,
+)
+from src.shared.dateien import datei_lesen, erstelle_dateipfad
+from src.shared.llm_integrations.llm_gemini_testserver import GeminiTestserver
+from src.shared.llm_integrations.llm_kontext_cache import kontext_cache_aufraeumen
+from src.shared.llm_integrations.llm_nebenlaeufigkeit import (
+    nebenlaeufigkeitskennzahlen,
+)
+from src.shared.llm_integrations.llm_provider_standard import (
+    standard_llm_provider_handler,
+)
+from src.shared.logger import get_logger, setup_logging
+from src.shared.toml_config import TOMLConfig
+
+log = get_logger(__name__)
+
+
+def lade_app_config(config_datei: str = "ssg.toml") -> dict[str, Any]:
+    app_config = TOMLConfig(config_datei)
+    app_config.lade_komponenten()
+    return app_config.config
+
+
+def komponente_config(config: dict[str, Any], komponente_name: str) -> dict[str, Any]:
+    return config.get("komponente", {}).get(komponente_name, {})
+
+
+def parser_erstellen(config: dict[str, Any]) -> argparse.ArgumentParser:
+    ssg_config = komponente_config(config, "siliconsamplesgenerator")
+    studie_config = komponente_config(config, "studienkonfiguration")
+    referenzdokumente_config = komponente_config(config, "referenzdokumente")
+    jobs_config = ssg_config.get("jobs", {})
+
+    jobqueue_argumente = argparse.ArgumentParser(add_help=False)
+    jobqueue_argumente.add_argument(
+        "--jobqueue",
+        default=erstelle_dateipfad(
+            jobs_config.get("datei", "Silicon-Samples/jobs.sqlite"), dateiname=""
+        ),
+        help="SQLite-Datei der Jobqueue",
+    )
+    jobqueue_argumente.add_argument(
+        "--einreihen",
+        action="store_true",
+        help="Nur als Job einreihen, die Worker-Prozesse generieren",
+    )
+
+    shard_argumente = argparse.ArgumentParser(add_help=False)
+    shard_argumente.add_argument(
+        "--shard",
+        default=None,
+        help="Nur einen Teil des Laufs generieren, z. B. 2/4 für den zweiten von vier Shards",
+    )
+    shard_argumente.add_argument(
+        "--shard-strategie",
+        choices=SHARD_STRATEGIEN,
+        default="modulo",
+        help="Aufteilung der Wiederholungen auf die Shards",
+    )
+
+    parser = argparse.ArgumentParser(
+        prog="python -m ssg",
+        description="Silicon-Samples-Generator ohne Oberfläche",
+    )
+    befehle = parser.add_subparsers(dest="befehl", required=True)
+
+    run = befehle.add_parser(
+        "run",
+        help="Silicon Samples generieren",
+        parents=[jobqueue_argumente, shard_argumente],
+    )
+    run.add_argument(
+        "--study",
+        default=erstelle_dateipfad(
+            studie_config["speicherort"]["ordner"],
+            studie_config["speicherort"]["datei"],
+        ),
+        help="XML-Datei der Studienkonfiguration",
+    )
+    run.add_argument(
+        "--personas",
+        default=erstelle_dateipfad(
+            ssg_config["speicherort"]["personas"]["datei"], dateiname=""
+        ),
+        help="CSV-Datei mit den Personas",
+    )
+    run.add_argument(
+        "--ohne-personas",
+        action="store_true",
+        help="Silicon Samples ohne Persona-Kontext generieren",
+    )
+    run.add_argument(
+        "--zusammenfassungen",
+        default=None,
+        help="JSON-Datei mit Zusammenfassungen der Referenzdokumente",
+    )
+    run.add_argument(
+        "--prompts",
+        default=erstelle_dateipfad(
+            ssg_config["speicherort"]["prompts"]["ordner"], dateiname=""
+        ),
+        help="Ordner mit den Intro-Prompts",
+    )
+    run.add_argument(
+        "--ausgabe",
+        default=erstelle_dateipfad(
+            ssg_config["speicherort"]["siliconsamples"]["ordner"], dateiname=""
+        ),
+        help="Ordner, in dem die Silicon Samples gespeichert werden",
+    )
+    run.add_argument(
+        "--samples", type=int, default=1, help="Anzahl der Silicon Samples"
+    )
+    run.add_argument(
+        "--parallelitaet",
+        type=int,
+        default=ssg_config.get("generierung", {}).get("parallelitaet", 1),
+        help="Anzahl gleichzeitig generierter Silicon Samples",
+    )
+    run.add_argument(
+        "--referenzen-top-k",
+        type=int,
+        default=ssg_config.get("referenzauswahl", {}).get("top_k", 0),
+        help="Passende Abschnitte der Zusammenfassungen pro Frage, 0 = alle vollständig",
+    )
+    run.add_argument(
+        "--referenzen-token-budget",
+        type=int,
+        default=ssg_config.get("referenzauswahl", {}).get("token_budget", 0),
+        help="Höchstens so viele Tokens an Referenzen pro Frage, 0 = ohne Grenze",
+    )
+    run.add_argument(
+        "--ausfuehrung",
+        choices=AUSFUEHRUNGSMODI,
+        default=ssg_config.get("ausfuehrung", {}).get("modus", "direkt"),
+        help="direkt: einzelne Aufrufe, batch: Runden über die Batch-API des Providers, schritt: Befragte im Gleichschritt",
+    )
+    run.add_argument("--model", required=True, help="LLM-Modell")
+    run.add_argument(
+        "--lauf-id", default=None, help="Name des Lauf-Ordners, mit --shard Pflicht"
+    )
+
+    resume = befehle.add_parser(
+        "resume",
+        help="Abgebrochenen Lauf fortsetzen, fertige Silicon Samples bleiben",
+        parents=[jobqueue_argumente, shard_argumente],
+    )
+    resume.add_argument("--lauf-id", required=True, help="Name des Lauf-Ordners")
+    resume.add_argument(
+        "--ausgabe",
+        default=erstelle_dateipfad(
+            ssg_config["speicherort"]["siliconsamples"]["ordner"], dateiname=""
+        ),
+        help="Ordner, in dem die Silicon Samples gespeichert werden",
+    )
+    resume.add_argument(
+        "--parallelitaet",
+        type=int,
+        default=None,
+        help="Anzahl gleichzeitig generierter Silicon Samples (Standard: wie im Lauf)",
+    )
+
+    worker = befehle.add_parser(
+        "worker", help="Worker-Prozesse starten, die Jobs aus der Jobqueue generieren"
+    )
+    worker.add_argument(
+        "--jobqueue",
+        default=erstelle_dateipfad(
+            jobs_config.get("datei", "Silicon-Samples/jobs.sqlite"), dateiname=""
+        ),
+        help="SQLite-Datei der Jobqueue",
+    )
+    worker.add_argument(
+        "--prozesse",
+        type=int,
+        default=jobs_config.get("prozesse", 1),
+        help="Anzahl der Worker-Prozesse",
+    )
+    worker.add_argument(
+        "--parallelitaet",
+        type=int,
+        default=ssg_config.get("generierung", {}).get("parallelitaet", 1),
+        help="Anzahl gleichzeitig generierter Silicon Samples pro Prozess",
+    )
+    worker.add_argument(
+        "--bis-leer",
+        action="store_true",
+        help="Beenden, sobald keine offenen Aufgaben mehr vorhanden sind",
+    )
+
+    merge = befehle.add_parser(
+        "merge",
+        help="Ausgaben mehrerer Shards zusammenführen und das Laufmanifest schreiben",
+    )
+    merge.add_argument("--lauf-id", required=True, help="Name des Lauf-Ordners")
+    merge.add_argument(
+        "--ausgabe",
+        default=erstelle_dateipfad(
+            ssg_config["speicherort"]["siliconsamples"]["ordner"], dateiname=""
+        ),
+        help="Ordner, in dem der zusammengeführte Lauf gespeichert wird",
+    )
+    merge.add_argument(
+        "--quellen",
+        nargs="*",
+        default=[],
+        help="Lauf-Ordner oder Silicon-Samples-Ordner der einzelnen Shards",
+    )
+
+    pdf_benchmark = befehle.add_parser(
+        "pdf-benchmark",
+        help="PDF-Backends über dieselben PDFs vergleichen (Seiten pro Sekunde, Speicher)",
+    )
+    pdf_benchmark.add_argument(
+        "--ordner",
+        default=erstelle_dateipfad(
+            referenzdokumente_config["speicherort"]["pdfs"]["ordner"], dateiname=""
+        ),
+        help="Ordner mit den PDFs, die verglichen werden",
+    )
+    pdf_benchmark.add_argument(
+        "--backends",
+        nargs="*",
+        choices=list(PDF_BACKENDS),
+        default=None,
+        help="Zu vergleichende Backends (Standard: alle installierten)",
+    )
+    pdf_benchmark.add_argument(
+        "--ohne-tabellen",
+        action="store_true",
+        help="Nur Text extrahieren",
+    )
+
+    gemini_testserver = befehle.add_parser(
+        "gemini-testserver",
+        help="Lokalen Ersatz der Gemini-API starten, um den Kontext-Cache zu testen",
+    )
+    gemini_testserver.add_argument("--host", default="127.0.0.1")
+    gemini_testserver.add_argument("--port", type=int, default=8765)
+
+    return parser
+
+
+def shard_aus_argumenten(args: argparse.Namespace) -> Shard | None:
+    if args.shard is None:
+        return None
+    return Shard.aus_text(args.shard, strategie=args.shard_strategie)
+
+
+def intro_prompt_dateien(config: dict[str, Any]) -> dict[str, str]:
+    prompts_config = komponente_config(config, "siliconsamplesgenerator")[
+        "speicherort"
+    ]["prompts"]
+    return {
+        "fragen_intro_ohne_persona_mit_referenzen": prompts_config[
+            "datei_intro_ohne_persona_mit_referenzdokumenten"
+        ],
+        "fragen_intro_ohne_persona_ohne_referenzen": prompts_config[
+            "datei_intro_ohne_persona_ohne_referenzdokumente"
+        ],
+        "fragen_intro_mit_persona_mit_referenzen": prompts_config[
+            "datei_intro_mit_persona_mit_referenzdokumenten"
+        ],
+        "fragen_intro_mit_persona_ohne_referenzen": prompts_config[
+            "datei_intro_mit_persona_ohne_referenzdokumente"
+        ],
+    }
+
+
+def befehl_run(args: argparse.Namespace, config: dict[str, Any]) -> int:
+    llm_provider = standard_llm_provider_handler().hole_provider(model=args.model)
+
+    zusammenfassungen: list[Zusammenfassung] = []
+    if args.zusammenfassungen:
+        zusammenfassungen = datei_lesen(
+            Path(args.zusammenfassungen), json_datei=True, cls=Zusammenfassung
+        )
+
+    siliconsamples_lauf = SiliconSamplesLauf(
+        studienkonfiguration_datei=args.study,
+        zusammenfassungen=zusammenfassungen,
+        prompts=lade_prompts(args.prompts, intro_prompt_dateien(config)),
+        personas=None if args.ohne_personas else lade_personas(args.personas),
+        anzahl_siliconsamples=args.samples,
+        llm_provider=llm_provider,
+        siliconsamples_ordner=args.ausgabe,
+        parallelitaet=args.parallelitaet,
+        lauf_id=args.lauf_id,
+        shard=shard_aus_argumenten(args),
+        referenzauswahl=Referenzauswahl.from_dict(
+            {
+                **komponente_config(config, "siliconsamplesgenerator").get(
+                    "referenzauswahl", {}
+                ),
+                "top_k": args.referenzen_top_k,
+                "token_budget": args.referenzen_token_budget,
+            }
+        ),
+        ausfuehrung=Ausfuehrung.from_dict(
+            {
+                **komponente_config(config, "siliconsamplesgenerator").get(
+                    "ausfuehrung", {}
+                ),
+                "modus": args.ausfuehrung,
+            }
+        ),
+    )
+
+    if args.einreihen:
+        return lauf_einreihen(siliconsamples_lauf, args.jobqueue)
+    return lauf_ausfuehren(siliconsamples_lauf)
+
+
+def befehl_resume(args: argparse.Namespace) -> int:
+    siliconsamples_lauf = SiliconSamplesLauf.fortsetzen(
+        siliconsamples_ordner=args.ausgabe,
+        lauf_id=args.lauf_id,
+        llm_provider_handler=standard_llm_provider_handler(),
+        parallelitaet=args.parallelitaet,
+        shard=shard_aus_argumenten(args),
+    )
+
+    if args.einreihen:
+        return lauf_einreihen(siliconsamples_lauf, args.jobqueue)
+    return lauf_ausfuehren(siliconsamples_lauf)
+
+
+def befehl_worker(args: argparse.Namespace, config: dict[str, Any]) -> int:
+    jobs_config = komponente_config(config, "siliconsamplesgenerator").get("jobs", {})
+    worker_pool_starten(
+        jobqueue_datei=args.jobqueue,
+        prozesse=args.prozesse,
+        worker_optionen={
+            "parallelitaet": args.parallelitaet,
+            "heartbeat_sekunden": jobs_config.get("heartbeat_sekunden", 10),
+            "timeout_sekunden": jobs_config.get("timeout_sekunden", 120),
+            "max_versuche": jobs_config.get("max_versuche", 3),
+            "bis_leer": args.bis_leer,
+        },
+    )
+    return 0
+
+
+def befehl_merge(args: argparse.Namespace) -> int:
+    laufmanifest = shards_zusammenfuehren(
+        siliconsamples_ordner=args.ausgabe,
+        lauf_id=args.lauf_id,
+        quellen=args.quellen,
+    )
+    if laufmanifest.fehlend:
+        log.warning(f"Fehlende Wiederholungen: {laufmanifest.fehlend}")
+    if laufmanifest.doppelt:
+        log.warning(f"Doppelte Wiederholungen: {laufmanifest.doppelt}")
+    return 0 if laufmanifest.vollstaendig else 1
+
+
+def befehl_pdf_benchmark(args: argparse.Namespace) -> int:
+    dateien = sorted(Path(args.ordner).rglob("*.pdf"))
+    if not dateien:
+        log.error(f"Keine PDFs in {args.ordner}")
+        return 1
+
+    ergebnisse = pdf_backends_vergleichen(
+        dateien=dateien, backends=args.backends, tabellen=not args.ohne_tabellen
+    )
+    print(benchmark_bericht(ergebnisse))
+    return 0
+
+
+def befehl_gemini_testserver(args: argparse.Namespace) -> int:
+    testserver = GeminiTestserver(host=args.host, port=args.port)
+    print(f"Gemini-Testserver läuft auf {testserver.url} (base_url des Modells)")
+    try:
+        testserver.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        testserver.server.server_close()
+    return 0
+
+
+def lauf_einreihen(siliconsamples_lauf: SiliconSamplesLauf, jobqueue_datei) -> int:
+    siliconsamples_lauf.laufkonfiguration_speichern()
+    job_id = Jobqueue(jobqueue_datei).job_einreihen(
+        siliconsamples_ordner=siliconsamples_lauf.siliconsamples_ordner,
+        lauf_id=siliconsamples_lauf.lauf_id,
+        wiederholungen=siliconsamples_lauf.offene_wiederholungen(),
+    )
+    print(job_id)
+    return 0
+
+
+def lauf_ausfuehren(siliconsamples_lauf: SiliconSamplesLauf) -> int:
+    anzahl_gesamt = len(siliconsamples_lauf.wiederholungen())
+    anzahl_vorhanden = siliconsamples_lauf.anzahl_vorhanden()
+    if anzahl_vorhanden:
+        log.info(f"{anzahl_vorhanden} Silicon Samples bereits vorhanden")
+
+    anzahl_generiert = 0
+    try:
+        for wiederholung, _ in siliconsamples_lauf.generieren():
+            anzahl_generiert += 1
+            log.info(
+                f"Silicon Sample {wiederholung + 1} generiert ({anzahl_vorhanden + anzahl_generiert}/{anzahl_gesamt}, {siliconsamples_lauf.durchsatz(anzahl_generiert):.1f} pro Minute)"
+            )
+    finally:
+        kontext_cache_aufraeumen()
+
+    for kennzahlen in nebenlaeufigkeitskennzahlen():
+        log.info(kennzahlen.beschreibung())
+    log.info(
+        f"Lauf {siliconsamples_lauf.lauf_id} beendet: {anzahl_generiert} Silicon Samples generiert in {siliconsamples_lauf.lauf_ordner()}"
+    )
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    load_dotenv()
+    setup_logging()
+
+    config = lade_app_config()
+    parser = parser_erstellen(config)
+    args = parser.parse_args(argv)
+    # Ohne gemeinsame Lauf-ID schreibt jeder Rechner in einen eigenen Lauf
+    if args.befehl == "run" and args.shard is not None and args.lauf_id is None:
+        parser.error(
+            "--shard braucht eine --lauf-id, die auf allen Rechnern gleich ist"
+        )
+
+    if args.befehl == "run":
+        return befehl_run(args, config)
+    if args.befehl == "resume":
+        return befehl_resume(args)
+    if args.befehl == "worker":
+        return befehl_worker(args, config)
+    if args.befehl == "merge":
+        return befehl_merge(args)
+    if args.befehl == "pdf-benchmark":
+        return befehl_pdf_benchmark(args)
+    if args.befehl == "gemini-testserver":
+        return befehl_gemini_testserver(args)
+
+    return 1
@@ -14,6 +14,18 @@ from src.komponenten.referenzdokumente.referenzdokumente_api import Referenzdoku
 from src.komponenten.referenzdokumente.zusammenfassungsgenerator.zusammenfassungsgenerator import (
     Zusammenfassungsgenerator,
 )
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.lader_url import (
+    http_cache_konfigurieren,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.pdf_backends import (
+    PDF_BACKENDS,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.tabellenformat import (
+    Tabellenersparnis,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.zusammenfassungs_cache import (
+    ZusammenfassungsCache,
+)
 from src.shared.dateien import (
     datei_erstellungsdatum,
     datei_lesen,
@@ -22,7 +34,7 @@ from src.shared.dateien import (
     dateipfad_relativ,
     ordner_auslesen,
 )
-from src.shared.generator import Prompt
+from src.shared.generator import Prompt, format_number
 from src.shared.llm_integrations.llm_provider import LLMProvider
 
 api = ReferenzdokumenteAPI()
@@ -46,6 +58,9 @@ if f"{session_key}.fertig" not in st.session_state:
 if f"{session_key}.ergebnis" not in st.session_state:
     st.session_state[f"{session_key}.ergebnis"] = None
 
+if f"{session_key}.tabellenersparnis" not in st.session_state:
+    st.session_state[f"{session_key}.tabellenersparnis"] = None
+
 
 # Button Start
 def starten():
@@ -166,6 +181,21 @@ if prozess_fertig:
     # Nachricht anzeigen
     st.success(api.text("erfolgsmeldung"))
 
+    tabellenersparnis: Tabellenersparnis | None = st.session_state[
+        f"{session_key}.tabellenersparnis"
+    ]
+    if tabellenersparnis is not None and tabellenersparnis.tabellen:
+        st.info(
+            api.text("tabellen_ersparnis").format(
+                tabellen=tabellenersparnis.tabellen,
+                duplikate=tabellenersparnis.duplikate,
+                tokens_markdown=format_number(tabellenersparnis.tokens_markdown),
+                tokens_kompakt=format_number(tabellenersparnis.tokens_kompakt),
+                gespart=format_number(tabellenersparnis.gespart),
+                tabellenformat=api.tabellenformat,
+            )
+        )
+
     # Reset ohne Rerun
     reset()
 
@@ -200,6 +230,7 @@ with tab1:
                 "tabellen_verarbeiten": api.text(
                     "tabelle_tabellen_verarbeiten_option_1"
                 ),
+                "pdf_backend": api.pdf_backend,
             }
         )
 
@@ -222,6 +253,7 @@ with tab1:
                 "tabellen_verarbeiten": api.text(
                     "tabelle_tabellen_verarbeiten_option_1"
                 ),
+                "pdf_backend": None,
             }
         )
 
@@ -236,6 +268,7 @@ with tab1:
                 "tabellen_verarbeiten": api.text(
                     "tabelle_tabellen_verarbeiten_option_1"
                 ),
+                "pdf_backend": None,
             }
         )
 
@@ -272,6 +305,11 @@ with tab1:
                 ],
                 required=True,
             ),
+            "pdf_backend": st.column_config.SelectboxColumn(
+                api.text("tabelle_pdf_backend_title"),
+                help=api.text("tabelle_pdf_backend_beschreibung"),
+                options=list(PDF_BACKENDS),
+            ),
         },
         disabled=["art", "pfad", "erstellungsdatum"],
         hide_index=True,
@@ -328,6 +366,12 @@ with tab1:
             tabellen_extrahieren=tabellen_extrahieren,
             tabellen_zusammenfassen=tabellen_zusammenfassen,
             tabellen_zusammenfassen_mit_zahlen=tabellen_zusammenfassen_mit_zahlen,
+            pdf_backend=(
+                row["pdf_backend"] or api.pdf_backend
+                if row["art"] == api.text("tabelle_art_pdf")
+                else ""
+            ),
+            tabellenformat=api.tabellenformat,
         )
 
         if zusammenfassung_auswahl.soll_vorbereitet_werden():
@@ -368,6 +412,11 @@ with tab1:
             with st.spinner(api.text("spinner"), show_time=True):
                 fortschritt = st.progress(0)
 
+                http_cache_konfigurieren(
+                    dateipfad=api.http_cache_datei,
+                    frisch_sekunden=api.http_frisch_sekunden,
+                )
+
                 zusammenfassungsgenerator = Zusammenfassungsgenerator(
                     referenzdokumente_auswahl=referenzdokumente_auswahl,
                     prompt=Prompt(
@@ -380,6 +429,14 @@ with tab1:
                         prompt_data={},
                     ),
                     llm_provider=llm_provider,
+                    zusammenfassungs_cache=ZusammenfassungsCache(api.cache_ordner),
+                    parallelitaet=api.parallelitaet,
+                    extraktion_parallelitaet=api.extraktion_parallelitaet,
+                    warteschlange=api.warteschlange,
+                    tabellen_pro_anfrage=api.tabellen_pro_anfrage,
+                    text_max_tokens=api.text_max_tokens,
+                    text_ueberlappung_tokens=api.text_ueberlappung_tokens,
+                    csv_modus=api.csv_modus,
                 )
                 zusammenfassungen: list[Zusammenfassung] = (
                     zusammenfassungsgenerator.starten(streamlit_fortschitt=fortschritt)
@@ -395,6 +452,9 @@ with tab1:
                 datei_speichern(
                     dateipfad=zusammenfassungen_dateipfad, items=zusammenfassungen
                 )
+                st.session_state[f"{session_key}.tabellenersparnis"] = (
+                    zusammenfassungsgenerator.tabellenersparnis
+                )
 
                 fertig(zusammenfassungen_dateipfad)
 
@@ -1,7 +1,19 @@
 from dataclasses import asdict
 from pathlib import Path
 import pandas as pd
-from src.komponenten.referenzdokumente.referenzdokumente_models import Zusammenfassung
+from src.komponenten.referenzdokumente.referenzdokumente_models import (
+    Tabelle,
+    Zusammenfassung,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.lader_csv import (
+    STANDARD_CSV_MODUS,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.pdf_backends import (
+    STANDARD_PDF_BACKEND,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.tabellenformat import (
+    STANDARD_TABELLENFORMAT,
+)
 from src.shared.dateien import (
     datei_lesen,
     erstelle_dateipfad,
@@ -53,6 +65,38 @@ class ReferenzdokumenteAPI(KomponentenAPI):
             dateiname="",
         )
 
+        self.cache_ordner = erstelle_dateipfad(
+            ordnerpfad=self.config["speicherort"]["cache"]["ordner"], dateiname=""
+        )
+
+        self.http_cache_datei = erstelle_dateipfad(
+            ordnerpfad=self.config["speicherort"]["cache"]["ordner"],
+            dateiname=self.config["speicherort"]["cache"].get(
+                "datei_http", "webseiten.sqlite"
+            ),
+        )
+
+        self.pdf_backend = self.config.get("extraktion", {}).get(
+            "pdf_backend", STANDARD_PDF_BACKEND
+        )
+        self.http_frisch_sekunden = self.config.get("extraktion", {}).get(
+            "http_frisch_sekunden", 600
+        )
+        self.csv_modus = self.config.get("extraktion", {}).get(
+            "csv_modus", STANDARD_CSV_MODUS
+        )
+        self.tabellenformat = self.config.get("extraktion", {}).get(
+            "tabellenformat", STANDARD_TABELLENFORMAT
+        )
+
+        generierung = self.config.get("generierung", {})
+        self.parallelitaet = generierung.get("parallelitaet", 1)
+        self.extraktion_parallelitaet = generierung.get("extraktion_parallelitaet", 1)
+        self.warteschlange = generierung.get("warteschlange", 2)
+        self.tabellen_pro_anfrage = generierung.get("tabellen_pro_anfrage", 1)
+        self.text_max_tokens = generierung.get("text_max_tokens", 8000)
+        self.text_ueberlappung_tokens = generierung.get("text_ueberlappung_tokens", 200)
+
     def zusammenfassung(self, dateipfad) -> list[Zusammenfassung]:
         return datei_lesen(dateipfad=dateipfad, json_datei=True, cls=Zusammenfassung)
 
@@ -172,7 +216,13 @@ class ReferenzdokumenteAPI(KomponentenAPI):
                         st.markdown(self.text("keine_daten_extrahiert"))
                     else:
                         for tabelle_extrahiert in zusammenfassung.tabellen_extrahiert:
-                            st.markdown(tabelle_extrahiert)
+                            if isinstance(tabelle_extrahiert, Tabelle):
+                                st.dataframe(
+                                    pd.DataFrame(tabelle_extrahiert.zeilen),
+                                    hide_index=True,
+                                )
+                            else:
+                                st.markdown(tabelle_extrahiert)
 
                 with tab4:
                     if not zusammenfassung.tabellen_zusammengefasst:
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Annotated, Optional
+from typing import Annotated, Optional, TypedDict
 from langgraph.graph import MessagesState
 from langgraph.graph.message import add_messages
 from langchain_core.messages.utils import AnyMessage
@@ -35,6 +35,8 @@ class ZusammenfassungAuswahl:
     tabellen_extrahieren: bool
     tabellen_zusammenfassen: bool
     tabellen_zusammenfassen_mit_zahlen: bool
+    pdf_backend: str = ""  # leer = Standard-Backend
+    tabellenformat: str = ""  # Format der Tabellen im Prompt, leer = Standard
 
     def soll_vorbereitet_werden(self) -> bool:
         if self.text_zusammenfassen or self.tabellen_extrahieren:
@@ -51,6 +53,8 @@ class ZusammenfassungAuswahl:
             tabellen_zusammenfassen_mit_zahlen=data[
                 "tabellen_zusammenfassen_mit_zahlen"
             ],
+            pdf_backend=data.get("pdf_backend", ""),
+            tabellenformat=data.get("tabellenformat", ""),
         )
 
 
@@ -60,17 +64,70 @@ class ReferenzdokumentAuswahl:
     zusammenfassung_auswahl: ZusammenfassungAuswahl
 
 
+@dataclass(frozen=True)
+class Tabelle:
+    """Zellen als Text, erst beim Bau des Prompts in ein Format gebracht."""
+
+    zeilen: list[list[str]]
+    seite: int | None = None  # Seite im PDF
+
+    @classmethod
+    def from_dict(cls, data) -> Tabelle:
+        return cls(zeilen=data["zeilen"], seite=data.get("seite"))
+
+
+def tabellen_laden(tabellen: list) -> list[Tabelle | str]:
+    # Ältere Zusammenfassungen enthalten Tabellen als fertigen Markdown-Text
+    return [
+        Tabelle.from_dict(tabelle) if isinstance(tabelle, dict) else tabelle
+        for tabelle in tabellen
+    ]
+
+
+@dataclass(frozen=True)
+class Extraktion:
+    text: str
+    tabellen: list[Tabelle | str]  # str: bereits aufbereitet, z.B. CSV-Profil
+    # Laden oder Parsen gescheitert, das Ergebnis darf nicht in den Cache
+    fehlgeschlagen: bool = False
+
+
+class Tabellenergebnis(TypedDict):
+    indizes: list[int]  # Position der Tabellen in tabellen_extrahiert
+    zusammengefasst: list[str]
+    messages: list[list[AnyMessage]]  # ein Chatverlauf pro LLM-Anfrage
+
+
+class Textergebnis(TypedDict):
+    abschnitt: int
+    zusammengefasst: str
+    messages: list[AnyMessage]
+
+
+def ergebnisse_sammeln(alt: list | None, neu: list | None) -> list:
+    # Sammelt die Ergebnisse paralleler Knoten, None setzt zurück
+    if neu is None:
+        return []
+    return (alt or []) + neu
+
+
 class ReferenzdokumentState(MessagesState):
     referenzdokument: Referenzdokument
     zusammenfassung_auswahl: ZusammenfassungAuswahl
     aktuelles_referenzdokument: int
     anzahl_referenzdokumente: int
+    extrahiert: bool  # Extraktion lief schon vor dem Graphen
     text_extrahiert: str
     text_zusammengefasst: str
     text_zusammengefasst_messages: Annotated[list[AnyMessage], add_messages]
-    tabellen_extrahiert: list[str]
+    text_max_tokens: int  # längere Texte werden in Abschnitten zusammengefasst
+    text_ueberlappung_tokens: int
+    text_ergebnisse: Annotated[list[Textergebnis], ergebnisse_sammeln]
+    tabellen_extrahiert: list[Tabelle | str]
     tabellen_zusammengefasst: list[str]
     tabellen_zusammengefasst_messages: list[Annotated[list[AnyMessage], add_messages]]
+    tabellen_pro_anfrage: int  # > 1: kleine Tabellen gebündelt zusammenfassen
+    tabellen_ergebnisse: Annotated[list[Tabellenergebnis], ergebnisse_sammeln]
 
 
 @dataclass(frozen=True)
@@ -80,7 +137,7 @@ class Zusammenfassung:
     erstellungsdatum: str
     text_extrahiert: str
     text_zusammengefasst: str
-    tabellen_extrahiert: list[str]
+    tabellen_extrahiert: list[Tabelle | str]
     tabellen_zusammengefasst: list[str]
     prompt: Prompt
     llm: LLM
@@ -112,7 +169,7 @@ class Zusammenfassung:
             erstellungsdatum=data["erstellungsdatum"],
             text_extrahiert=data["text_extrahiert"],
             text_zusammengefasst=data["text_zusammengefasst"],
-            tabellen_extrahiert=list(data.get("tabellen_extrahiert", [])),
+            tabellen_extrahiert=tabellen_laden(data.get("tabellen_extrahiert", [])),
             tabellen_zusammengefasst=list(data.get("tabellen_zusammengefasst", [])),
             prompt=prompt,
             llm=llm,
@@ -1 +1 @@
-# __init__.py
\ No newline at end of file
+# __init__.py
@@ -1,22 +1,275 @@
+from __future__ import annotations
+from itertools import combinations
 import logging
+from typing import Iterator
 
+import numpy as np
 import pandas as pd
-import requests
+
+from src.komponenten.referenzdokumente.referenzdokumente_models import (
+    Extraktion,
+    Tabelle,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.tabellenformat import (
+    tabelle_aus_dataframe,
+)
+
+CSV_TRENNZEICHEN = ";"
+# Zeilen pro Block beim Lesen, bestimmt den Speicherbedarf statt der Dateigröße
+CSV_BLOCKZEILEN = 50_000
+
+# "profil": Kennzahlen je Spalte statt Zeilen, "tabelle": die ersten/letzten Zeilen
+CSV_MODI = ("profil", "tabelle")
+STANDARD_CSV_MODUS = "profil"
+
+TOP_KATEGORIEN = 8
+# Darüber gilt eine Spalte als Freitext/ID und wird nicht weiter gezählt
+MAX_KATEGORIEN = 1000
+KREUZTABELLEN_MAX_KATEGORIEN = 12
+MAX_KREUZTABELLEN = 3
+# Gleichverteilte Stichprobe für Quantile
+STICHPROBE_ZEILEN = 100_000
+QUANTILE = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def bloecke_lesen(
+    pfad: str, header: int | None = 0, blockzeilen: int = CSV_BLOCKZEILEN
+) -> Iterator[pd.DataFrame]:
+    with pd.read_csv(
+        pfad, sep=CSV_TRENNZEICHEN, header=header, chunksize=blockzeilen
+    ) as reader:
+        yield from reader
+
+
+def zeilen_lesen(pfad: str, zeilen, blockzeilen: int = CSV_BLOCKZEILEN) -> pd.DataFrame:
+    """Erste (zeilen >= 0) bzw. letzte (zeilen < 0) Zeilen, ohne die Datei ganz zu laden."""
+    if zeilen is not None and zeilen >= 0:
+        return pd.read_csv(pfad, sep=CSV_TRENNZEICHEN, header=None, nrows=zeilen)
+
+    teile: list[pd.DataFrame] = []
+    for block in bloecke_lesen(pfad, header=None, blockzeilen=blockzeilen):
+        teile.append(block)
+        if zeilen is not None:
+            teile = [pd.concat(teile).tail(abs(zeilen))]
+    return pd.concat(teile) if teile else pd.DataFrame()
+
+
+def zahl_formatieren(wert) -> str:
+    if pd.isna(wert):
+        return "–"
+    if abs(wert) >= 1e6 or 0 < abs(wert) < 1e-4:
+        return f"{wert:.3e}"
+    # Festkomma mit höchstens vier Nachkommastellen, 30000 bleibt 30000
+    text = f"{wert:.4f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+class CSVProfil:
+    """
+    Kennzahlen einer CSV, Block für Block berechnet: Verteilungen, häufigste
+    Kategorien, Quantile und Kreuztabellen. Der Bericht ist kurz genug für
+    den Prompt, egal wie groß die Datei ist.
+    """
+
+    def __init__(self, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+        self.zeilen = 0
+        self.spalten: list[str] = []
+        self.numerisch: list[str] = []
+        self.fehlend: pd.Series | None = None
+        self.summen: dict[str, float] = {}
+        self.minimum: dict[str, float] = {}
+        self.maximum: dict[str, float] = {}
+        self.anzahl: dict[str, int] = {}
+        self.kategorien: dict[str, pd.Series] = {}
+        self.hochkardinal: set[str] = set()
+        self.stichprobe: pd.DataFrame | None = None
+        self.kreuztabellen: dict[tuple[str, str], pd.DataFrame] = {}
+
+    def spalten_festlegen(self, block: pd.DataFrame):
+        self.spalten = [str(s) for s in block.columns]
+        self.numerisch = [
+            str(s)
+            for s in block.columns
+            if pd.api.types.is_numeric_dtype(block[s])
+            and not pd.api.types.is_bool_dtype(block[s])
+        ]
+        kategorial = [
+            s
+            for s in self.spalten
+            if s not in self.numerisch
+            and block[s].nunique(dropna=True) <= KREUZTABELLEN_MAX_KATEGORIEN
+        ]
+        self.kreuztabellen = {
+            paar: pd.DataFrame()
+            for paar in list(combinations(kategorial, 2))[:MAX_KREUZTABELLEN]
+        }
+
+    def hinzufuegen(self, block: pd.DataFrame):
+        block = block.rename(columns=str)
+        if not self.spalten:
+            self.spalten_festlegen(block)
+        self.zeilen += len(block)
+
+        fehlend = block.isna().sum()
+        self.fehlend = (
+            fehlend if self.fehlend is None else self.fehlend.add(fehlend, fill_value=0)
+        )
+
+        zahlen = block[self.numerisch].apply(pd.to_numeric, errors="coerce")
+        for spalte in self.numerisch:
+            werte = zahlen[spalte]
+            self.summen[spalte] = self.summen.get(spalte, 0.0) + werte.sum()
+            self.anzahl[spalte] = self.anzahl.get(spalte, 0) + int(werte.count())
+            self.minimum[spalte] = pd.Series(
+                [self.minimum.get(spalte), werte.min()], dtype=float
+            ).min()
+            self.maximum[spalte] = pd.Series(
+                [self.maximum.get(spalte), werte.max()], dtype=float
+            ).max()
+
+        # Bottom-k-Stichprobe: jede Zeile bekommt eine Zufallszahl, die kleinsten bleiben
+        if self.numerisch:
+            zahlen["_zufall"] = self.rng.random(len(zahlen))
+            self.stichprobe = (
+                zahlen
+                if self.stichprobe is None
+                else pd.concat([self.stichprobe, zahlen], ignore_index=True)
+            ).nsmallest(STICHPROBE_ZEILEN, "_zufall")
+
+        for spalte in self.spalten:
+            if spalte in self.numerisch or spalte in self.hochkardinal:
+                continue
+            zaehlung = block[spalte].astype("string").value_counts()
+            zaehlung = (
+                zaehlung
+                if spalte not in self.kategorien
+                else self.kategorien[spalte].add(zaehlung, fill_value=0)
+            )
+            if len(zaehlung) > MAX_KATEGORIEN:
+                self.hochkardinal.add(spalte)
+                self.kategorien.pop(spalte, None)
+            else:
+                self.kategorien[spalte] = zaehlung
+
+        for (a, b), bisher in self.kreuztabellen.items():
+            kreuztabelle = pd.crosstab(block[a], block[b])
+            self.kreuztabellen[(a, b)] = (
+                kreuztabelle if bisher.empty else bisher.add(kreuztabelle, fill_value=0)
+            )
+
+    def verteilung(self, spalte: str) -> str:
+        if spalte in self.numerisch:
+            if not self.anzahl.get(spalte):
+                return "keine Zahlen"
+            quantile = self.stichprobe[spalte].quantile(QUANTILE)
+            return ", ".join(
+                [
+                    f"min {zahl_formatieren(self.minimum[spalte])}",
+                    *(
+                        f"p{int(q * 100)} {zahl_formatieren(w)}"
+                        for q, w in quantile.items()
+                    ),
+                    f"max {zahl_formatieren(self.maximum[spalte])}",
+                    f"Mittel {zahl_formatieren(self.summen[spalte] / self.anzahl[spalte])}",
+                ]
+            )
+        if spalte in self.hochkardinal:
+            return f"mehr als {MAX_KATEGORIEN} verschiedene Werte (Freitext/ID)"
+        zaehlung = self.kategorien.get(spalte, pd.Series(dtype=float))
+        gesamt = zaehlung.sum() or 1
+        top = zaehlung.sort_values(ascending=False).head(TOP_KATEGORIEN)
+        rest = len(zaehlung) - len(top)
+        return ", ".join(f"{k} {v / gesamt:.1%}" for k, v in top.items()) + (
+            f", … ({rest} weitere)" if rest > 0 else ""
+        )
+
+    def bericht(self) -> str:
+        if not self.zeilen:
+            return ""
+        spalten = pd.DataFrame(
+            [
+                {
+                    "Spalte": spalte,
+                    "Typ": "numerisch" if spalte in self.numerisch else "kategorial",
+                    "Fehlend": f"{self.fehlend.get(spalte, 0) / self.zeilen:.1%}",
+                    "Verschiedene": (
+                        ""
+                        if spalte in self.numerisch
+                        else (
+                            f">{MAX_KATEGORIEN}"
+                            if spalte in self.hochkardinal
+                            else len(self.kategorien.get(spalte, []))
+                        )
+                    ),
+                    "Verteilung": self.verteilung(spalte),
+                }
+                for spalte in self.spalten
+            ]
+        )
+        teile = [
+            f"Profil einer CSV-Datei mit {self.zeilen} Zeilen und {len(self.spalten)} Spalten"
+            + (
+                f" (Quantile aus einer Stichprobe von {STICHPROBE_ZEILEN} Zeilen)"
+                if self.zeilen > STICHPROBE_ZEILEN and self.numerisch
+                else ""
+            ),
+            spalten.to_markdown(index=False),
+        ]
+        for (a, b), kreuztabelle in self.kreuztabellen.items():
+            if kreuztabelle.empty:
+                continue
+            # Zeilenprozente, damit Zusammenhänge direkt lesbar sind
+            anteile = kreuztabelle.div(kreuztabelle.sum(axis=1), axis=0)
+            teile.append(
+                f"Kreuztabelle {a} × {b} (Anteile je {a}):\n"
+                + anteile.map(lambda x: f"{x:.0%}").to_markdown()
+            )
+        return "\n\n".join(teile)
 
 
 class CSVLader:
 
+    def __init__(self, modus: str = STANDARD_CSV_MODUS):
+        if modus not in CSV_MODI:
+            logging.warning(
+                f"Unbekannter CSV-Modus {modus}, nutze {STANDARD_CSV_MODUS}"
+            )
+            modus = STANDARD_CSV_MODUS
+        self.modus = modus
+
+    def inhalt(self, pfad: str) -> bytes:
+        with open(pfad, "rb") as f:
+            return f.read()
+
+    def extrahiere(
+        self, pfad: str, text: bool = True, tabellen: bool = True, zeilen=None
+    ) -> Extraktion:
+        return Extraktion(
+            text=self.extrahiere_text(pfad) if text else "",
+            tabellen=self.extrahiere_tabellen(pfad, zeilen=zeilen) if tabellen else [],
+        )
+
     def extrahiere_text(self, pfad: str) -> str:
         text = ""
 
         return text
 
-    def extrahiere_tabellen(self, pfad: str, zeilen) -> list[str]:
-        tabellen: list[str] = []
-        try:
+    def profil(self, pfad: str) -> str:
+        profil = CSVProfil()
+        for block in bloecke_lesen(pfad):
+            profil.hinzufuegen(block)
+        return profil.bericht()
 
-            df = pd.read_csv(pfad, sep=";", header=None)
-            tabellen.append(df.to_markdown())
+    def extrahiere_tabellen(self, pfad: str, zeilen) -> list[Tabelle | str]:
+        tabellen: list[Tabelle | str] = []
+        try:
+            if self.modus == "profil":
+                bericht = self.profil(pfad)
+                if bericht:
+                    tabellen.append(bericht)
+            else:
+                tabellen.append(tabelle_aus_dataframe(zeilen_lesen(pfad, zeilen)))
 
         except ValueError as e:
             logging.warning("Keine Tabellen gefunden")
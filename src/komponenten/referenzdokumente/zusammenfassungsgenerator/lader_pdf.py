@@ -1,55 +1,166 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import replace
+from itertools import repeat
 import logging
-import pandas as pd
-import pdfplumber
+import multiprocessing
+import os
+import threading
+import time
+
+from src.komponenten.referenzdokumente.referenzdokumente_models import (
+    Extraktion,
+    Tabelle,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.pdf_backends import (
+    PDF_BACKENDS,
+    STANDARD_PDF_BACKEND,
+    Seitenergebnis,
+    pdf_backend_holen,
+)
+
+# Blöcke laufen im Prozesspool, lange PDFs verteilen sich so auf mehrere
+# Prozesse, kurze blockieren nicht den Hauptprozess
+SEITEN_PRO_BLOCK = 20
+MAX_PROZESSE = max(1, min(8, (os.cpu_count() or 1) - 1))
+
+
+def seiten_extrahieren(
+    backend_name: str, pfad: str, seiten: range, text: bool, tabellen: bool, zeilen
+) -> list[Seitenergebnis]:
+    """Extrahiert Text und Tabellen eines Seitenbereichs in einem Durchlauf."""
+    backend = PDF_BACKENDS[backend_name]
+    ergebnisse = backend.seiten_extrahieren(pfad, seiten, text, tabellen, zeilen)
+
+    if tabellen and not backend.kann_tabellen:
+        tabellen_ergebnisse = PDF_BACKENDS[STANDARD_PDF_BACKEND].seiten_extrahieren(
+            pfad, seiten, False, True, zeilen
+        )
+        ergebnisse = [
+            replace(e, tabellen=t.tabellen, dauer=e.dauer + t.dauer)
+            for e, t in zip(ergebnisse, tabellen_ergebnisse)
+        ]
+    return ergebnisse
+
+
+# Prozessweit, damit nicht jedes Dokument neue Prozesse startet
+_prozesspool: ProcessPoolExecutor | None = None
+_prozesspool_lock = threading.Lock()
+
+
+def prozesspool_holen() -> ProcessPoolExecutor:
+    global _prozesspool
+    with _prozesspool_lock:
+        if _prozesspool is None:
+            # spawn statt fork, weil Streamlit und die Event-Loops Threads laufen haben
+            _prozesspool = ProcessPoolExecutor(
+                max_workers=MAX_PROZESSE,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _prozesspool
+
+
+def prozesspool_verwerfen(prozesspool: ProcessPoolExecutor):
+    """Ein abgestürzter Prozess (Speicher, Segfault) macht den Pool unbrauchbar."""
+    global _prozesspool
+    with _prozesspool_lock:
+        if _prozesspool is prozesspool:
+            _prozesspool = None
+    prozesspool.shutdown(wait=False, cancel_futures=True)
 
 
 class PDFLader:
 
-    def extrahiere_text(self, pfad: str) -> str:
-        texte = []
+    def __init__(
+        self,
+        backend: str = STANDARD_PDF_BACKEND,
+        seiten_pro_block: int = SEITEN_PRO_BLOCK,
+        parallel: bool = True,
+    ):
+        self.backend = pdf_backend_holen(backend)
+        self.seiten_pro_block = seiten_pro_block
+        self.parallel = parallel and MAX_PROZESSE > 1
+
+    def inhalt(self, pfad: str) -> bytes:
+        with open(pfad, "rb") as f:
+            return f.read()
+
+    def extrahiere(
+        self, pfad: str, text: bool = True, tabellen: bool = True, zeilen=None
+    ) -> Extraktion:
+        start = time.perf_counter()
         try:
-            with pdfplumber.open(pfad) as pdf:
-                for page in pdf.pages:
-                    try:
-                        txt = page.extract_text() or ""
-                        if txt:
-                            texte.append(txt)
-                    except Exception:
-                        continue
+            anzahl_seiten = self.backend.seitenanzahl(pfad)
         except Exception as e:
             logging.warning(f"PDF-Parsing fehlgeschlagen: {pfad} ({e})")
+            return Extraktion(text="", tabellen=[], fehlgeschlagen=True)
 
-        text = "\n".join(texte)
-
-        return text
-
-    def extrahiere_tabellen(self, pfad: str, zeilen) -> list[str]:
-        tabellen: list[str] = []
+        bloecke = [
+            range(von, min(von + self.seiten_pro_block, anzahl_seiten))
+            for von in range(0, anzahl_seiten, self.seiten_pro_block)
+        ]
         try:
-            with pdfplumber.open(pfad) as pdf:
-                for page in pdf.pages:
-                    try:
-                        ts = page.extract_tables() or []
-                        for t in ts:
-                            if t and any(row for row in t):
-                                df = pd.DataFrame(t)
-                                # if df.shape[0] >= 2:
-                                #     df.columns = df.iloc[0].astype(str).values
-                                #     df = df.iloc[1:].reset_index(drop=True)
-
-                                if zeilen is None:
-                                    df_out = df
-                                elif zeilen >= 0:
-                                    df_out = df.head(zeilen)
-                                else:
-                                    df_out = df.tail(
-                                        abs(zeilen)
-                                    )  # negative Zahl -> letzte N Zeilen
-
-                                tabellen.append(df_out.to_markdown(index=False))
-                    except Exception:
-                        logging.warning(f"PDF-Parsing fehlgeschlagen: {pfad} ({e})")
-                        continue
+            seiten = self.bloecke_extrahieren(pfad, bloecke, text, tabellen, zeilen)
         except Exception as e:
             logging.warning(f"PDF-Parsing fehlgeschlagen: {pfad} ({e})")
-        return tabellen
+            return Extraktion(text="", tabellen=[], fehlgeschlagen=True)
+
+        self.zeiten_melden(pfad, seiten, time.perf_counter() - start)
+        return Extraktion(
+            text="\n".join(s.text for s in seiten if s.text),
+            tabellen=[t for s in seiten for t in s.tabellen],
+        )
+
+    def bloecke_extrahieren(
+        self, pfad: str, bloecke: list[range], text: bool, tabellen: bool, zeilen
+    ) -> list[Seitenergebnis]:
+        if not (self.parallel and bloecke):
+            return [
+                seite
+                for b in bloecke
+                for seite in seiten_extrahieren(
+                    self.backend.name, pfad, b, text, tabellen, zeilen
+                )
+            ]
+
+        # Nach einem Absturz einmal mit neuem Pool, nicht im Hauptprozess
+        for versuch in range(2):
+            prozesspool = prozesspool_holen()
+            try:
+                teile = prozesspool.map(
+                    seiten_extrahieren,
+                    repeat(self.backend.name),
+                    repeat(pfad),
+                    bloecke,
+                    repeat(text),
+                    repeat(tabellen),
+                    repeat(zeilen),
+                )
+                return [seite for teil in teile for seite in teil]
+            except BrokenProcessPool as e:
+                prozesspool_verwerfen(prozesspool)
+                if versuch > 0:
+                    raise
+                logging.warning(
+                    f"Prozesspool abgestürzt bei {pfad}, neuer Versuch ({e})"
+                )
+
+    def zeiten_melden(self, pfad: str, seiten: list[Seitenergebnis], dauer: float):
+        for s in seiten:
+            logging.debug(
+                f"{pfad}, Seite {s.seite + 1}: {s.dauer:.2f}s, {len(s.tabellen)} Tabellen"
+            )
+        langsamste = ", ".join(
+            f"S. {s.seite + 1} ({s.dauer:.1f}s)"
+            for s in sorted(seiten, key=lambda s: s.dauer, reverse=True)[:3]
+        )
+        logging.info(
+            f"PDF extrahiert ({self.backend.name}): {pfad}, {len(seiten)} Seiten in {dauer:.1f}s"
+            f" ({len(seiten) / max(dauer, 1e-6):.1f} Seiten/s), langsamste: {langsamste}"
+        )
+
+    def extrahiere_text(self, pfad: str) -> str:
+        return self.extrahiere(pfad, text=True, tabellen=False).text
+
+    def extrahiere_tabellen(self, pfad: str, zeilen) -> list[Tabelle]:
+        return self.extrahiere(pfad, text=False, tabellen=True, zeilen=zeilen).tabellen
@@ -1,49 +1,277 @@
+from __future__ import annotations
+import contextlib
+from dataclasses import dataclass, replace
+from io import StringIO
 import logging
+from pathlib import Path
+import re
+import sqlite3
+import threading
+import time
 
-from bs4 import BeautifulSoup
-import lxml
-import html5lib
+from lxml import etree
+import lxml.html
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from src.komponenten.referenzdokumente.referenzdokumente_models import (
+    Extraktion,
+    Tabelle,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.tabellenformat import (
+    tabelle_aus_dataframe,
+)
 
-class URLLader:
+USER_AGENT = "Weblader"
+TIMEOUT = 20
 
-    def extrahiere_text(self, url: str) -> str:
-        html = ""
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webseiten (
+    url TEXT PRIMARY KEY,
+    inhalt BLOB NOT NULL,
+    encoding TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    max_alter REAL,
+    abgerufen REAL NOT NULL
+);
+"""
+
+
+@dataclass(frozen=True)
+class Webseite:
+    url: str
+    inhalt: bytes
+    encoding: str | None
+    etag: str | None
+    last_modified: str | None
+    max_alter: float | None  # aus Cache-Control, sonst Standard des Caches
+    abgerufen: float
+
+    @property
+    def html(self) -> str:
+        return self.inhalt.decode(self.encoding or "utf-8", errors="replace")
+
+
+def max_alter_lesen(cache_control: str) -> float | None:
+    if "no-cache" in cache_control:
+        return 0.0
+    treffer = re.search(r"max-age=(\d+)", cache_control)
+    return float(treffer.group(1)) if treffer else None
+
+
+class HTTPCache:
+    """
+    Webseiten auf der Platte (SQLite). Innerhalb von `frisch_sekunden` (oder
+    max-age) wird nicht erneut geladen, danach mit ETag/Last-Modified
+    nachgefragt, sodass unveränderte Seiten als 304 ohne Inhalt zurückkommen.
+    """
+
+    def __init__(self, dateipfad, frisch_sekunden: float = 600):
+        self.dateipfad = Path(dateipfad)
+        self.dateipfad.parent.mkdir(parents=True, exist_ok=True)
+        self.frisch_sekunden = frisch_sekunden
+        self._lock = threading.Lock()
+        self._initialisiert = False
+
+    @contextlib.contextmanager
+    def verbinden(self):
+        verbindung = sqlite3.connect(self.dateipfad, timeout=30, isolation_level=None)
         try:
-            r = requests.get(url, headers={"User-Agent": "Weblader"}, timeout=20)
-            r.raise_for_status()
-            html = r.text
-        except Exception as e:
-            logging.warning(f"Web-Fetch fehlgeschlagen: {url} ({e})")
+            if not self._initialisiert:
+                with self._lock:
+                    if not self._initialisiert:
+                        verbindung.execute("PRAGMA journal_mode=WAL")
+                        verbindung.executescript(SCHEMA)
+                        self._initialisiert = True
+            yield verbindung
+        finally:
+            verbindung.close()
+
+    def ist_frisch(self, webseite: Webseite) -> bool:
+        max_alter = (
+            webseite.max_alter
+            if webseite.max_alter is not None
+            else self.frisch_sekunden
+        )
+        return time.time() - webseite.abgerufen < max_alter
+
+    def lesen(self, url: str) -> Webseite | None:
+        with self.verbinden() as verbindung:
+            zeile = verbindung.execute(
+                "SELECT url, inhalt, encoding, etag, last_modified, max_alter, abgerufen FROM webseiten WHERE url = ?",
+                (url,),
+            ).fetchone()
+        return Webseite(*zeile) if zeile is not None else None
+
+    def schreiben(self, webseite: Webseite):
+        with self.verbinden() as verbindung:
+            verbindung.execute(
+                "INSERT OR REPLACE INTO webseiten (url, inhalt, encoding, etag, last_modified, max_alter, abgerufen) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    webseite.url,
+                    webseite.inhalt,
+                    webseite.encoding,
+                    webseite.etag,
+                    webseite.last_modified,
+                    webseite.max_alter,
+                    webseite.abgerufen,
+                ),
+            )
+
+
+# Eine Session pro Thread (requests.Session ist nicht threadsicher); die Threads
+# von asyncio.to_thread leben weiter, ihre Verbindungen bleiben also offen
+_sitzungen = threading.local()
+
+
+def sitzung_holen() -> requests.Session:
+    sitzung = getattr(_sitzungen, "sitzung", None)
+    if sitzung is None:
+        sitzung = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=16,
+            max_retries=Retry(
+                total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504)
+            ),
+        )
+        sitzung.mount("http://", adapter)
+        sitzung.mount("https://", adapter)
+        sitzung.headers["User-Agent"] = USER_AGENT
+        _sitzungen.sitzung = sitzung
+    return sitzung
+
+
+def webseite_laden(url: str, http_cache: HTTPCache | None = None) -> Webseite:
+    gespeichert = http_cache.lesen(url) if http_cache is not None else None
+    if gespeichert is not None and http_cache.ist_frisch(gespeichert):
+        return gespeichert
+
+    headers = {}
+    if gespeichert is not None:
+        if gespeichert.etag:
+            headers["If-None-Match"] = gespeichert.etag
+        if gespeichert.last_modified:
+            headers["If-Modified-Since"] = gespeichert.last_modified
 
-        soup = BeautifulSoup(html, "lxml")
+    r = sitzung_holen().get(url, headers=headers, timeout=TIMEOUT)
+    cache_control = r.headers.get("Cache-Control", "")
 
-        texte = []
-        for tag in soup.find_all(["p", "li"]):
-            s = tag.get_text(separator=" ", strip=True)
-            if s and len(s.split()) >= 5:
-                texte.append(s)
-        text = "\n".join(texte)
+    if r.status_code == 304 and gespeichert is not None:
+        logging.debug(f"Web-Fetch: {url} unverändert (304)")
+        webseite = replace(
+            gespeichert,
+            abgerufen=time.time(),
+            max_alter=max_alter_lesen(cache_control),
+        )
+    else:
+        r.raise_for_status()
+        webseite = Webseite(
+            url=url,
+            inhalt=r.content,
+            # Ohne charset-Angabe setzt requests ISO-8859-1, dann lieber erkennen
+            encoding=(
+                r.encoding
+                if "charset" in r.headers.get("Content-Type", "").lower()
+                else r.apparent_encoding
+            ),
+            etag=r.headers.get("ETag"),
+            last_modified=r.headers.get("Last-Modified"),
+            max_alter=max_alter_lesen(cache_control),
+            abgerufen=time.time(),
+        )
 
-        return text
+    if http_cache is not None and "no-store" not in cache_control:
+        http_cache.schreiben(webseite)
+    return webseite
 
-    def extrahiere_tabellen(self, url: str, zeilen) -> list[str]:
-        tabellen: list[str] = []
+
+# Text wie bei itertext, aber ohne Inhalte von Skripten und Styles
+OHNE_SKRIPTE = etree.XPath(
+    ".//text()[not(ancestor::script or ancestor::style or ancestor::noscript)]"
+)
+
+
+def text_aus_html(html: str) -> str:
+    # lxml lehnt Unicode-Text mit Encoding-Deklaration ab
+    html = re.sub(r"^\s*<\?xml[^>]*\?>", "", html)
+    if not html.strip():
+        return ""
+    try:
+        dokument = lxml.html.fromstring(html)
+    except etree.ParserError:
+        # z.B. nur Kommentare, kein Element
+        return ""
+
+    texte = []
+    for element in dokument.iter("p", "li"):
+        s = " ".join(t.strip() for t in OHNE_SKRIPTE(element) if t.strip())
+        if s and len(s.split()) >= 5:
+            texte.append(s)
+    return "\n".join(texte)
+
+
+def tabellen_aus_html(html: str, zeilen) -> list[Tabelle]:
+    tabellen: list[Tabelle] = []
+    try:
+        dfs = pd.read_html(StringIO(html), header=None)  # erste Zeile = Header
+
+        for df in dfs:
+            # negative Zahl -> letzte N Zeilen
+            tabellen.append(tabelle_aus_dataframe(df, limit=zeilen))
+    except ValueError as e:
+        logging.warning("Keine Tabellen gefunden")
+
+    return tabellen
+
+
+# Prozessweit, wie die Caches der LLM-Aufrufe
+_http_cache: HTTPCache | None = None
+
+
+def http_cache_konfigurieren(dateipfad, frisch_sekunden: float = 600):
+    global _http_cache
+    if (
+        _http_cache is not None
+        and _http_cache.dateipfad == Path(dateipfad)
+        and _http_cache.frisch_sekunden == frisch_sekunden
+    ):
+        return
+    _http_cache = HTTPCache(dateipfad=dateipfad, frisch_sekunden=frisch_sekunden)
+
+
+def http_cache_holen() -> HTTPCache | None:
+    return _http_cache
+
+
+class URLLader:
+
+    def __init__(self, http_cache: HTTPCache | None = None):
+        self.http_cache = http_cache if http_cache is not None else http_cache_holen()
+
+    def inhalt(self, url: str) -> bytes:
+        return webseite_laden(url, self.http_cache).inhalt
+
+    def extrahiere(
+        self, url: str, text: bool = True, tabellen: bool = True, zeilen=None
+    ) -> Extraktion:
+        # Einmal laden, Text und Tabellen aus demselben HTML
         try:
-            dfs = pd.read_html(url, header=None)  # erste Zeile = Header
+            html = webseite_laden(url, self.http_cache).html
+        except Exception as e:
+            logging.warning(f"Web-Fetch fehlgeschlagen: {url} ({e})")
+            return Extraktion(text="", tabellen=[], fehlgeschlagen=True)
 
-            for df in dfs:
-                if zeilen is None:
-                    df_out = df
-                elif zeilen >= 0:
-                    df_out = df.head(zeilen)
-                else:
-                    df_out = df.tail(abs(zeilen))  # negative Zahl -> letzte N Zeilen
+        return Extraktion(
+            text=text_aus_html(html) if text else "",
+            tabellen=tabellen_aus_html(html, zeilen=zeilen) if tabellen else [],
+        )
 
-                tabellen.append(df_out.to_markdown(index=False))
-        except ValueError as e:
-            logging.warning("Keine Tabellen gefunden")
+    def extrahiere_text(self, url: str) -> str:
+        return self.extrahiere(url, text=True, tabellen=False).text
 
-        return tabellen
+    def extrahiere_tabellen(self, url: str, zeilen) -> list[Tabelle]:
+        return self.extrahiere(url, text=False, tabellen=True, zeilen=zeilen).tabellen
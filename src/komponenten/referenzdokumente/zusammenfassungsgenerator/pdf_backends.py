@@ -0,0 +1,234 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import importlib.util
+import logging
+import time
+from typing import Iterator
+
+from src.komponenten.referenzdokumente.referenzdokumente_models import Tabelle
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.tabellenformat import (
+    tabelle_erstellen,
+)
+
+STANDARD_PDF_BACKEND = "pdfplumber"
+
+
+@dataclass(frozen=True)
+class Seitenergebnis:
+    seite: int
+    text: str
+    tabellen: list[Tabelle]
+    dauer: float
+
+
+def hat_tabellenkandidaten(page) -> bool:
+    # Die Standardstrategie von pdfplumber bildet Zellen nur aus Linien in
+    # beiden Richtungen; ohne sie kann extract_tables nichts finden
+    return bool(page.horizontal_edges) and bool(page.vertical_edges)
+
+
+class PDFBackend:
+    """
+    Extrahiert einen Seitenbereich in einem Durchlauf. Backends ohne eigene
+    Tabellenerkennung (`kann_tabellen = False`) bekommen die Tabellen von
+    pdfplumber ergänzt.
+    """
+
+    name: str
+    modul: str
+    kann_tabellen: bool = False
+
+    def verfuegbar(self) -> bool:
+        return importlib.util.find_spec(self.modul) is not None
+
+    def seitenanzahl(self, pfad: str) -> int:
+        # pypdfium2 ist Abhängigkeit von pdfplumber und liest nur den Seitenbaum
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(pfad)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    def seiten_extrahieren(
+        self, pfad: str, seiten: range, text: bool, tabellen: bool, zeilen
+    ) -> list[Seitenergebnis]:
+        raise NotImplementedError
+
+    def messen(
+        self, seiten: range, extraktion: Iterator[tuple[str, list[Tabelle]]]
+    ) -> list[Seitenergebnis]:
+        """Nimmt die Dauer jeder Seite, während `extraktion` Seite für Seite liefert."""
+        ergebnisse: list[Seitenergebnis] = []
+        start = time.perf_counter()
+        for seite, (seitentext, seitentabellen) in zip(seiten, extraktion):
+            ende = time.perf_counter()
+            ergebnisse.append(
+                Seitenergebnis(
+                    seite=seite,
+                    text=seitentext,
+                    tabellen=seitentabellen,
+                    dauer=ende - start,
+                )
+            )
+            start = ende
+        return ergebnisse
+
+
+class PdfplumberBackend(PDFBackend):
+    """Genau, auch bei Tabellen, aber langsam bei langen Dokumenten."""
+
+    name = "pdfplumber"
+    modul = "pdfplumber"
+    kann_tabellen = True
+
+    def seiten_extrahieren(self, pfad, seiten, text, tabellen, zeilen):
+        import pdfplumber
+
+        def extraktion():
+            with pdfplumber.open(pfad, pages=[seite + 1 for seite in seiten]) as pdf:
+                for seite, page in zip(seiten, pdf.pages):
+                    seitentext = ""
+                    seitentabellen: list[Tabelle] = []
+
+                    if text:
+                        try:
+                            seitentext = page.extract_text() or ""
+                        except Exception as e:
+                            logging.warning(
+                                f"PDF-Parsing fehlgeschlagen: {pfad}, Seite {seite + 1} ({e})"
+                            )
+
+                    if tabellen:
+                        try:
+                            if hat_tabellenkandidaten(page):
+                                for t in page.extract_tables() or []:
+                                    if t and any(row for row in t):
+                                        seitentabellen.append(
+                                            tabelle_erstellen(
+                                                t, limit=zeilen, seite=seite + 1
+                                            )
+                                        )
+                        except Exception as e:
+                            logging.warning(
+                                f"PDF-Parsing fehlgeschlagen: {pfad}, Seite {seite + 1} ({e})"
+                            )
+
+                    # Objekte der Seite freigeben, sonst wächst der Speicher mit der Seitenzahl
+                    page.close()
+                    yield seitentext, seitentabellen
+
+        return self.messen(seiten, extraktion())
+
+
+class PdfminerBackend(PDFBackend):
+    """Reines Python, ohne Zeichenobjekte von pdfplumber; nur Text."""
+
+    name = "pdfminer"
+    modul = "pdfminer"
+
+    def seiten_extrahieren(self, pfad, seiten, text, tabellen, zeilen):
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+
+        def extraktion():
+            if not text:
+                yield from (("", []) for _ in seiten)
+                return
+            for layout in extract_pages(pfad, page_numbers=list(seiten)):
+                yield "".join(
+                    element.get_text()
+                    for element in layout
+                    if isinstance(element, LTTextContainer)
+                ).strip(), []
+
+        return self.messen(seiten, extraktion())
+
+
+class Pypdfium2Backend(PDFBackend):
+    """C-Bibliothek von Chromium, um ein Vielfaches schneller; nur Text."""
+
+    name = "pypdfium2"
+    modul = "pypdfium2"
+
+    def seiten_extrahieren(self, pfad, seiten, text, tabellen, zeilen):
+        import pypdfium2
+
+        def extraktion():
+            pdf = pypdfium2.PdfDocument(pfad)
+            try:
+                for seite in seiten:
+                    if not text:
+                        yield "", []
+                        continue
+                    page = pdf[seite]
+                    textpage = page.get_textpage()
+                    seitentext = textpage.get_text_bounded().replace("\r\n", "\n")
+                    textpage.close()
+                    page.close()
+                    yield seitentext, []
+            finally:
+                pdf.close()
+
+        return self.messen(seiten, extraktion())
+
+
+class PymupdfBackend(PDFBackend):
+    """C-Bibliothek MuPDF mit eigener Tabellenerkennung (optional, AGPL)."""
+
+    name = "pymupdf"
+    modul = "pymupdf"
+    kann_tabellen = True
+
+    def seiten_extrahieren(self, pfad, seiten, text, tabellen, zeilen):
+        import pymupdf
+
+        def extraktion():
+            with pymupdf.open(pfad) as pdf:
+                for seite in seiten:
+                    page = pdf[seite]
+                    seitentext = page.get_text() if text else ""
+                    seitentabellen: list[Tabelle] = []
+                    if tabellen:
+                        try:
+                            for t in page.find_tables().tables:
+                                zeilen_roh = t.extract()
+                                if zeilen_roh and any(row for row in zeilen_roh):
+                                    seitentabellen.append(
+                                        tabelle_erstellen(
+                                            zeilen_roh, limit=zeilen, seite=seite + 1
+                                        )
+                                    )
+                        except Exception as e:
+                            logging.warning(
+                                f"PDF-Parsing fehlgeschlagen: {pfad}, Seite {seite + 1} ({e})"
+                            )
+                    yield seitentext.strip(), seitentabellen
+
+        return self.messen(seiten, extraktion())
+
+
+PDF_BACKENDS: dict[str, PDFBackend] = {
+    backend.name: backend
+    for backend in (
+        PdfplumberBackend(),
+        PdfminerBackend(),
+        Pypdfium2Backend(),
+        PymupdfBackend(),
+    )
+}
+
+
+def pdf_backend_holen(name: str | None) -> PDFBackend:
+    """Unbekannte oder nicht installierte Backends fallen auf pdfplumber zurück."""
+    backend = PDF_BACKENDS.get(name or STANDARD_PDF_BACKEND)
+    if backend is None:
+        logging.warning(f"Unbekanntes PDF-Backend {name}, nutze {STANDARD_PDF_BACKEND}")
+        return PDF_BACKENDS[STANDARD_PDF_BACKEND]
+    if not backend.verfuegbar():
+        logging.warning(
+            f"PDF-Backend {name} ist nicht installiert, nutze {STANDARD_PDF_BACKEND}"
+        )
+        return PDF_BACKENDS[STANDARD_PDF_BACKEND]
+    return backend
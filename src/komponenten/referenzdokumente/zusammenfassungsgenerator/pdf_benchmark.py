@@ -0,0 +1,141 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+import multiprocessing
+from pathlib import Path
+import sys
+import time
+
+import pandas as pd
+
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.lader_pdf import (
+    seiten_extrahieren,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.pdf_backends import (
+    PDF_BACKENDS,
+)
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class Benchmarkergebnis:
+    backend: str
+    datei: str
+    seiten: int
+    sekunden: float
+    speicher_mb: float | None
+    zeichen: int
+    tabellen: int
+    fehler: str = ""
+
+
+def spitzenspeicher_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux meldet KiB, macOS Bytes
+    return maxrss / 1024 / 1024 if sys.platform == "darwin" else maxrss / 1024
+
+
+def backend_messen(
+    backend_name: str, pfad: str, tabellen: bool, zeilen
+) -> Benchmarkergebnis:
+    """Läuft in einem frischen Prozess, damit der Spitzenspeicher nur diesen Lauf zeigt."""
+    backend = PDF_BACKENDS[backend_name]
+    try:
+        anzahl_seiten = backend.seitenanzahl(pfad)
+        # Importe vor der Messung, damit sie nicht in Zeit und Speicher eingehen
+        backend.seiten_extrahieren(pfad, range(0), True, tabellen, zeilen)
+        speicher_vorher = spitzenspeicher_mb()
+
+        start = time.perf_counter()
+        seiten = seiten_extrahieren(
+            backend_name, pfad, range(anzahl_seiten), True, tabellen, zeilen
+        )
+        sekunden = time.perf_counter() - start
+
+        speicher_nachher = spitzenspeicher_mb()
+        return Benchmarkergebnis(
+            backend=backend_name,
+            datei=pfad,
+            seiten=len(seiten),
+            sekunden=sekunden,
+            speicher_mb=(
+                speicher_nachher - speicher_vorher
+                if speicher_vorher is not None
+                else None
+            ),
+            zeichen=sum(len(s.text) for s in seiten),
+            tabellen=sum(len(s.tabellen) for s in seiten),
+        )
+    except Exception as e:
+        return Benchmarkergebnis(
+            backend=backend_name,
+            datei=pfad,
+            seiten=0,
+            sekunden=0.0,
+            speicher_mb=None,
+            zeichen=0,
+            tabellen=0,
+            fehler=str(e),
+        )
+
+
+def pdf_backends_vergleichen(
+    dateien: list[Path],
+    backends: list[str] | None = None,
+    tabellen: bool = True,
+    zeilen=None,
+) -> list[Benchmarkergebnis]:
+    backends = backends or [
+        name for name, backend in PDF_BACKENDS.items() if backend.verfuegbar()
+    ]
+    ergebnisse: list[Benchmarkergebnis] = []
+    for backend_name in backends:
+        if backend_name not in PDF_BACKENDS:
+            raise ValueError(
+                f"Unbekanntes PDF-Backend {backend_name}, verfügbar: {', '.join(PDF_BACKENDS)}"
+            )
+        for datei in dateien:
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                ergebnis = pool.submit(
+                    backend_messen, backend_name, str(datei), tabellen, zeilen
+                ).result()
+            if ergebnis.fehler:
+                log.warning(
+                    f"{backend_name}: {datei} fehlgeschlagen ({ergebnis.fehler})"
+                )
+            else:
+                log.info(
+                    f"{backend_name}: {datei}, {ergebnis.seiten} Seiten in {ergebnis.sekunden:.1f}s"
+                )
+            ergebnisse.append(ergebnis)
+    return ergebnisse
+
+
+def benchmark_bericht(ergebnisse: list[Benchmarkergebnis]) -> str:
+    """Markdown-Tabelle mit Seiten pro Sekunde und Spitzenspeicher je Backend."""
+    df = pd.DataFrame([asdict(e) for e in ergebnisse if not e.fehler])
+    if df.empty:
+        return "Keine PDFs erfolgreich extrahiert."
+
+    bericht = df.groupby("backend", sort=False).agg(
+        dateien=("datei", "count"),
+        seiten=("seiten", "sum"),
+        sekunden=("sekunden", "sum"),
+        speicher_mb_max=("speicher_mb", "max"),
+        zeichen=("zeichen", "sum"),
+        tabellen=("tabellen", "sum"),
+    )
+    bericht.insert(3, "seiten_pro_sekunde", bericht["seiten"] / bericht["sekunden"])
+    fehler = [e for e in ergebnisse if e.fehler]
+    fusszeile = "".join(f"\n- {e.backend}: {e.datei} ({e.fehler})" for e in fehler)
+    return bericht.round(2).to_markdown() + (
+        f"\n\nFehlgeschlagen:{fusszeile}" if fehler else ""
+    )
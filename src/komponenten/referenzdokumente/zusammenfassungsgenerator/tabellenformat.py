@@ -0,0 +1,144 @@
+from __future__ import annotations
+import csv
+from dataclasses import dataclass
+from io import StringIO
+import re
+
+import pandas as pd
+
+from src.komponenten.referenzdokumente.referenzdokumente_models import Tabelle
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.textaufteilung import (
+    tokens_zaehlen,
+)
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+# csv/tsv: Trennzeichen ohne Auffüllen, kompakt: Zellen mit " | " ohne Rahmen
+# und Trennlinie, markdown: wie bisher (aufgefüllte Spalten, teuer bei breiten Tabellen)
+TABELLENFORMATE = ("csv", "tsv", "kompakt", "markdown")
+STANDARD_TABELLENFORMAT = "csv"
+
+# Ab diesem Anteil gleicher Zeilen gilt eine Tabelle als Duplikat (z.B.
+# Kopf- oder Fußtabellen, die auf jeder PDF-Seite wiederkehren)
+DUPLIKAT_SCHWELLE = 0.9
+
+
+def zelle_bereinigen(wert) -> str:
+    if wert is None or (isinstance(wert, float) and pd.isna(wert)):
+        return ""
+    return re.sub(r"\s+", " ", str(wert)).strip()
+
+
+def tabelle_erstellen(
+    zeilen: list[list], limit=None, seite: int | None = None
+) -> Tabelle:
+    """Bereinigt die Zellen; limit wie `zeilen` der Lader (erste N, negativ: letzte N)."""
+    if limit is not None:
+        zeilen = zeilen[:limit] if limit >= 0 else zeilen[limit:]
+    return Tabelle(
+        zeilen=[[zelle_bereinigen(wert) for wert in zeile] for zeile in zeilen],
+        seite=seite,
+    )
+
+
+def tabelle_aus_dataframe(df: pd.DataFrame, limit=None) -> Tabelle:
+    """Erkannte Spaltenköpfe werden zur ersten Zeile, limit gilt für die Daten."""
+    zeilen = df.values.tolist()
+    if limit is not None:
+        zeilen = zeilen[:limit] if limit >= 0 else zeilen[limit:]
+    if not isinstance(df.columns, pd.RangeIndex):
+        kopf = [
+            (
+                " / ".join(dict.fromkeys(str(teil) for teil in spalte))
+                if isinstance(spalte, tuple)
+                else spalte
+            )
+            for spalte in df.columns
+        ]
+        zeilen = [kopf] + zeilen
+    return tabelle_erstellen(zeilen)
+
+
+def tabelle_serialisieren(
+    tabelle: Tabelle | str, tabellenformat: str = STANDARD_TABELLENFORMAT
+) -> str:
+    if isinstance(tabelle, str):
+        return tabelle
+    tabellenformat = tabellenformat or STANDARD_TABELLENFORMAT
+
+    if tabellenformat == "markdown":
+        return pd.DataFrame(tabelle.zeilen).to_markdown(index=False)
+    if tabellenformat == "kompakt":
+        return "\n".join(" | ".join(zeile) for zeile in tabelle.zeilen)
+
+    ausgabe = StringIO()
+    csv.writer(
+        ausgabe, delimiter="\t" if tabellenformat == "tsv" else ",", lineterminator="\n"
+    ).writerows(tabelle.zeilen)
+    return ausgabe.getvalue().rstrip("\n")
+
+
+def tabellensignatur(tabelle: Tabelle | str) -> frozenset:
+    if isinstance(tabelle, str):
+        zeilen = tabelle.splitlines()
+    else:
+        zeilen = [" ".join(zeile) for zeile in tabelle.zeilen]
+    return frozenset(
+        normalisiert
+        for zeile in zeilen
+        if (normalisiert := re.sub(r"\W+", " ", zeile).strip().lower())
+    )
+
+
+def tabellen_deduplizieren(
+    tabellen: list[Tabelle | str], schwelle: float = DUPLIKAT_SCHWELLE
+) -> list[Tabelle | str]:
+    """Entfernt (nahezu) gleiche Tabellen, verglichen über den Anteil gleicher Zeilen."""
+    behalten: list[Tabelle | str] = []
+    signaturen: list[frozenset] = []
+    for tabelle in tabellen:
+        signatur = tabellensignatur(tabelle)
+        if any(
+            signatur and len(signatur & bekannt) / len(signatur | bekannt) >= schwelle
+            for bekannt in signaturen
+        ):
+            continue
+        behalten.append(tabelle)
+        signaturen.append(signatur)
+    return behalten
+
+
+@dataclass(frozen=True)
+class Tabellenersparnis:
+    tabellen: int
+    duplikate: int
+    tokens_markdown: int  # alle Tabellen wie bisher als Markdown
+    tokens_kompakt: int  # ohne Duplikate im gewählten Format
+
+    @property
+    def gespart(self) -> int:
+        return self.tokens_markdown - self.tokens_kompakt
+
+    def __add__(self, other: Tabellenersparnis) -> Tabellenersparnis:
+        return Tabellenersparnis(
+            tabellen=self.tabellen + other.tabellen,
+            duplikate=self.duplikate + other.duplikate,
+            tokens_markdown=self.tokens_markdown + other.tokens_markdown,
+            tokens_kompakt=self.tokens_kompakt + other.tokens_kompakt,
+        )
+
+
+def tabellenersparnis_berechnen(
+    vorher: list[Tabelle | str], nachher: list[Tabelle | str], tabellenformat: str
+) -> Tabellenersparnis:
+    return Tabellenersparnis(
+        tabellen=len(vorher),
+        duplikate=len(vorher) - len(nachher),
+        tokens_markdown=sum(
+            tokens_zaehlen(tabelle_serialisieren(t, "markdown")) for t in vorher
+        ),
+        tokens_kompakt=sum(
+            tokens_zaehlen(tabelle_serialisieren(t, tabellenformat)) for t in nachher
+        ),
+    )
@@ -0,0 +1,94 @@
+from __future__ import annotations
+import functools
+
+from src.shared.llm_integrations.llm_ratenbegrenzung import ZEICHEN_PRO_TOKEN
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+# tiktoken kommt mit langchain-openai; die Kodierung wird beim ersten Aufruf
+# geladen, ohne Netz bleibt es bei der Schätzung über Zeichen
+TIKTOKEN_KODIERUNG = "o200k_base"
+
+
+@functools.cache
+def tokenizer_holen():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(TIKTOKEN_KODIERUNG)
+    except Exception as e:
+        log.warning(
+            f"Tokenizer {TIKTOKEN_KODIERUNG} nicht verfügbar, Tokens werden geschätzt ({e})"
+        )
+        return None
+
+
+def tokens_zaehlen(text: str) -> int:
+    tokenizer = tokenizer_holen()
+    if tokenizer is None:
+        return -(-len(text) // ZEICHEN_PRO_TOKEN)
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def zeile_teilen(zeile: str, max_tokens: int) -> list[str]:
+    """Zu lange Zeilen (z.B. PDFs ohne Umbrüche) an Wortgrenzen teilen."""
+    teile: list[str] = []
+    aktuell: list[str] = []
+    tokens = 0
+    for wort in zeile.split(" "):
+        n = tokens_zaehlen(wort + " ")
+        if aktuell and tokens + n > max_tokens:
+            teile.append(" ".join(aktuell))
+            aktuell, tokens = [], 0
+        aktuell.append(wort)
+        tokens += n
+    if aktuell:
+        teile.append(" ".join(aktuell))
+    return teile
+
+
+def text_aufteilen(
+    text: str, max_tokens: int, ueberlappung_tokens: int = 0
+) -> list[str]:
+    """
+    Teilt den Text an Zeilengrenzen in Abschnitte von höchstens `max_tokens`.
+    Jeder Abschnitt beginnt mit den letzten Zeilen des vorigen (bis
+    `ueberlappung_tokens`), damit Zusammenhänge an den Grenzen erhalten bleiben.
+    """
+    if tokens_zaehlen(text) <= max_tokens:
+        return [text]
+
+    zeilen: list[tuple[str, int]] = []
+    for zeile in text.split("\n"):
+        n = tokens_zaehlen(zeile + "\n")
+        if n <= max_tokens:
+            zeilen.append((zeile, n))
+        else:
+            zeilen.extend(
+                (teil, tokens_zaehlen(teil + "\n"))
+                for teil in zeile_teilen(zeile, max_tokens)
+            )
+
+    abschnitte: list[str] = []
+    aktuell: list[tuple[str, int]] = []
+    tokens = 0
+    neu_seit_abschnitt = False
+    for zeile, n in zeilen:
+        if aktuell and tokens + n > max_tokens:
+            abschnitte.append("\n".join(z for z, _ in aktuell))
+            ueberlappung: list[tuple[str, int]] = []
+            ueberlappung_summe = 0
+            for z, zn in reversed(aktuell):
+                if ueberlappung_summe + zn > min(ueberlappung_tokens, max_tokens - n):
+                    break
+                ueberlappung.insert(0, (z, zn))
+                ueberlappung_summe += zn
+            aktuell, tokens = ueberlappung, ueberlappung_summe
+            neu_seit_abschnitt = False
+        aktuell.append((zeile, n))
+        tokens += n
+        neu_seit_abschnitt = True
+    if neu_seit_abschnitt:
+        abschnitte.append("\n".join(z for z, _ in aktuell))
+    return abschnitte
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+from dataclasses import asdict, replace
+import hashlib
+import json
+from pathlib import Path
+
+from src.komponenten.referenzdokumente.referenzdokumente_models import (
+    Referenzdokument,
+    Zusammenfassung,
+    ZusammenfassungAuswahl,
+)
+from src.shared.dateien import datei_lesen, datei_speichern
+from src.shared.generator import LLMTokenverbrauch, Prompt
+from src.shared.llm_integrations.llm_provider import LLMProvider
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+ZUSAMMENFASSUNGS_CACHE = "zusammenfassungs_cache"
+
+
+def verwendete_prompts(zusammenfassung_auswahl: ZusammenfassungAuswahl) -> list[str]:
+    """Namen der Prompts, die für diese Auswahl tatsächlich ans LLM gehen."""
+    prompts: list[str] = []
+    if zusammenfassung_auswahl.text_zusammenfassen:
+        prompts.append(
+            "text_zusammenfassen_mit_zahlen"
+            if zusammenfassung_auswahl.text_zusammenfassen_mit_zahlen
+            else "text_zusammenfassen_ohne_zahlen"
+        )
+    if (
+        zusammenfassung_auswahl.tabellen_extrahieren
+        and zusammenfassung_auswahl.tabellen_zusammenfassen
+    ):
+        prompts.append(
+            "tabellen_zusammenfassen_mit_zahlen"
+            if zusammenfassung_auswahl.tabellen_zusammenfassen_mit_zahlen
+            else "tabellen_zusammenfassen_ohne_zahlen"
+        )
+    return prompts
+
+
+def treffer_zusammenfassung(zusammenfassung: Zusammenfassung) -> Zusammenfassung:
+    """Kopie aus dem Cache, deren Verbrauch nur als eingespart verbucht wird."""
+
+    def eingespart(verbrauch, art: str) -> int:
+        details = verbrauch.get(f"{art}_token_details") or {}
+        return verbrauch.get(f"{art}_tokens", 0) + details.get(
+            ZUSAMMENFASSUNGS_CACHE, 0
+        )
+
+    tokenverbrauch = {
+        model: LLMTokenverbrauch.from_dict(
+            {
+                "input_token_details": {
+                    ZUSAMMENFASSUNGS_CACHE: eingespart(verbrauch, "input")
+                },
+                "output_token_details": {
+                    ZUSAMMENFASSUNGS_CACHE: eingespart(verbrauch, "output")
+                },
+            }
+        )
+        for model, verbrauch in zusammenfassung.llm.tokenverbrauch.items()
+    }
+    return replace(
+        zusammenfassung, llm=replace(zusammenfassung.llm, tokenverbrauch=tokenverbrauch)
+    )
+
+
+class ZusammenfassungsCache:
+    """
+    Zusammenfassungen je Referenzdokument, abgelegt unter einem Schlüssel aus
+    Inhalt des Dokuments (Datei-Bytes bzw. geladenes HTML), Auswahl, Prompts
+    und Modell. Ändert sich nichts davon, wird das Dokument nicht neu verarbeitet.
+    """
+
+    def __init__(self, ordner):
+        self.ordner = Path(ordner)
+
+    def schluessel(
+        self,
+        referenzdokument: Referenzdokument,
+        inhalt: bytes,
+        zusammenfassung_auswahl: ZusammenfassungAuswahl,
+        prompt: Prompt,
+        llm_provider: LLMProvider,
+        **extraktion,
+    ) -> str:
+        daten = {
+            "art": referenzdokument.art,
+            "inhalt": hashlib.sha256(inhalt).hexdigest(),
+            "zusammenfassung_auswahl": asdict(zusammenfassung_auswahl),
+            "prompts": {
+                name: prompt.prompts.get(name)
+                for name in verwendete_prompts(zusammenfassung_auswahl)
+            },
+            "model": llm_provider.aktives_model,
+            "parameter": llm_provider.parameter,
+            "extraktion": extraktion,
+        }
+        return hashlib.sha256(
+            json.dumps(daten, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def dateipfad(self, schluessel: str) -> Path:
+        return self.ordner / f"{schluessel}.json"
+
+    def laden(self, schluessel: str) -> Zusammenfassung | None:
+        dateipfad = self.dateipfad(schluessel)
+        if not dateipfad.is_file():
+            return None
+        try:
+            return datei_lesen(dateipfad, json_datei=True, cls=Zusammenfassung)
+        except (ValueError, KeyError) as e:
+            log.warning(f"Zusammenfassung im Cache unlesbar: {dateipfad} ({e})")
+            return None
+
+    def speichern(self, schluessel: str, zusammenfassung: Zusammenfassung):
+        datei_speichern(dateipfad=self.dateipfad(schluessel), items=zusammenfassung)
@@ -1,19 +1,27 @@
+import asyncio
+from dataclasses import replace
 import inspect
+import re
 from typing_extensions import Literal
-from langgraph.types import Command
+from langgraph.types import Command, Send
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import START, END
-from langgraph.checkpoint.memory import InMemorySaver
 from langgraph.graph.message import RemoveMessage, REMOVE_ALL_MESSAGES
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from langchain_core.callbacks import UsageMetadataCallbackHandler
 
 from src.komponenten.referenzdokumente.referenzdokumente_models import (
+    Extraktion,
     ReferenzdokumentState,
     Referenzdokument,
     ReferenzdokumentAuswahl,
+    Tabellenergebnis,
+    Textergebnis,
     Zusammenfassung,
     ZusammenfassungAuswahl,
 )
 from src.komponenten.referenzdokumente.zusammenfassungsgenerator.lader_csv import (
+    STANDARD_CSV_MODUS,
     CSVLader,
 )
 from src.komponenten.referenzdokumente.zusammenfassungsgenerator.lader_url import (
@@ -22,21 +30,99 @@ from src.komponenten.referenzdokumente.zusammenfassungsgenerator.lader_url impor
 from src.komponenten.referenzdokumente.zusammenfassungsgenerator.lader_pdf import (
     PDFLader,
 )
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.tabellenformat import (
+    Tabellenersparnis,
+    tabelle_serialisieren,
+    tabellen_deduplizieren,
+    tabellenersparnis_berechnen,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.textaufteilung import (
+    text_aufteilen,
+    tokens_zaehlen,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.zusammenfassungs_cache import (
+    ZusammenfassungsCache,
+    treffer_zusammenfassung,
+)
 from src.shared.generator import (
     LLM,
     LLMChatverlauf,
     LLMGenerator,
     Prompt,
-    hole_llm_instanz_aus_graph,
     hole_prompt_aus_graph,
     hole_tokenverbrauch_aus_graph,
+    llm_aufrufen_async,
     parse_llm_content,
+    synchron_ausfuehren,
 )
 from src.shared.llm_integrations.llm_provider import LLMProvider
 from src.shared.logger import get_logger
 
 log = get_logger(__name__)
 
+# Zeilen pro extrahierter Tabelle
+TABELLEN_ZEILEN = 20
+# Längere Texte werden in Abschnitten zusammengefasst und dann zusammengeführt
+TEXT_MAX_TOKENS = 8000
+TEXT_UEBERLAPPUNG_TOKENS = 200
+TEXT_ZUSAMMENFUEHREN_ANWEISUNG = (
+    "\n\nDie Nachricht enthält Zusammenfassungen aufeinanderfolgender Abschnitte "
+    "eines Dokuments. Führe sie zu einer einzigen Zusammenfassung des gesamten "
+    "Dokuments zusammen und lasse Wiederholungen an den Abschnittsgrenzen weg."
+)
+# Nur Tabellen bis zu dieser Gesamtlänge werden in einer Anfrage gebündelt
+TABELLEN_MAX_ZEICHEN = 6000
+TABELLEN_TRENNER = "=== Tabelle {nummer} ==="
+TABELLEN_TRENNER_MUSTER = re.compile(r"^\s*=== Tabelle (\d+) ===\s*$", re.MULTILINE)
+TABELLEN_BUENDEL_ANWEISUNG = (
+    "\n\nDie Nachricht enthält mehrere Tabellen, jede beginnt mit einer Zeile wie "
+    f"'{TABELLEN_TRENNER.format(nummer=1)}'. Fasse jede Tabelle einzeln zusammen "
+    "und beginne jede Zusammenfassung mit genau dieser Zeile der Tabelle."
+)
+
+
+def lader_fuer(
+    referenzdokument: Referenzdokument,
+    pdf_backend: str = "",
+    csv_modus: str = STANDARD_CSV_MODUS,
+):
+    if referenzdokument.art == "URL":
+        return URLLader()
+    if referenzdokument.art == "CSV":
+        return CSVLader(modus=csv_modus)
+    return PDFLader(backend=pdf_backend)
+
+
+# Prozessschritte pro Referenzdokument
+SCHRITTE = 6
+
+
+class Gesamtfortschritt:
+    """
+    Fortschritt aller gleichzeitig laufenden Referenzdokumente in einer Anzeige:
+    jedes Dokument meldet seinen Schritt, angezeigt wird der Anteil aller Schritte.
+    """
+
+    def __init__(self, streamlit_fortschritt, anzahl_referenzdokumente: int):
+        self.streamlit_fortschritt = streamlit_fortschritt
+        self.anzahl_referenzdokumente = max(1, anzahl_referenzdokumente)
+        self.schritte: dict[int, int] = {}
+
+    def melden(self, referenzdokument_nummer: int, prozessschritt: int, text: str):
+        self.schritte[referenzdokument_nummer] = max(
+            self.schritte.get(referenzdokument_nummer, 0), prozessschritt
+        )
+        prozent = sum(self.schritte.values()) / (
+            SCHRITTE * self.anzahl_referenzdokumente
+        )
+
+        # Ohne Streamlit (CLI, Worker) wird nur geloggt
+        if self.streamlit_fortschritt is None:
+            log.info(text)
+            return
+
+        self.streamlit_fortschritt.progress(min(prozent, 1.0), text=text)
+
 
 class Zusammenfassungsgenerator(LLMGenerator):
 
@@ -45,112 +131,308 @@ class Zusammenfassungsgenerator(LLMGenerator):
         referenzdokumente_auswahl: list[ReferenzdokumentAuswahl],
         prompt: Prompt,
         llm_provider: LLMProvider,
+        checkpointer: BaseCheckpointSaver | None = None,
+        zusammenfassungs_cache: ZusammenfassungsCache | None = None,
+        parallelitaet: int = 1,
+        extraktion_parallelitaet: int = 1,
+        warteschlange: int = 2,
+        tabellen_pro_anfrage: int = 1,
+        text_max_tokens: int = TEXT_MAX_TOKENS,
+        text_ueberlappung_tokens: int = TEXT_UEBERLAPPUNG_TOKENS,
+        csv_modus: str = STANDARD_CSV_MODUS,
     ):
         super().__init__(
             prompt=prompt,
             llm_provider=llm_provider,
             state_class=ReferenzdokumentState,
             thread_prefix="Zusammenfassungen",
+            checkpointer=checkpointer,
         )
 
         self.referenzdokumente_auswahl = referenzdokumente_auswahl
+        self.zusammenfassungs_cache = zusammenfassungs_cache
+        self.parallelitaet = max(1, parallelitaet)
+        self.extraktion_parallelitaet = max(1, extraktion_parallelitaet)
+        self.warteschlange = max(1, warteschlange)
+        self.tabellen_pro_anfrage = max(1, tabellen_pro_anfrage)
+        self.text_max_tokens = max(1, text_max_tokens)
+        self.text_ueberlappung_tokens = max(0, text_ueberlappung_tokens)
+        self.csv_modus = csv_modus
+        self.tabellenersparnis = Tabellenersparnis(
+            tabellen=0, duplikate=0, tokens_markdown=0, tokens_kompakt=0
+        )
 
         self.graph_bauen()
 
     def graph_bauen(self):
         self.graph.add_node(node_kontext)
         self.graph.add_node(node_historie_loeschen)
+        self.graph.add_node(node_extrahieren)
         self.graph.add_node(pruefe_text_zusammenfassen)
         self.graph.add_node(node_text_zusammenfassen)
-        self.graph.add_node(pruefe_tabellen_extrahieren)
-        self.graph.add_node(node_tabellen_extrahieren)
+        self.graph.add_node(node_text_zusammenfuehren)
         self.graph.add_node(pruefe_tabellen_zusammenfassen)
         self.graph.add_node(node_tabellen_zusammenfassen)
+        self.graph.add_node(node_tabellen_zusammenfuehren)
 
         self.graph.add_edge(START, "node_kontext")
         self.graph.add_edge("node_kontext", "node_historie_loeschen")
-        self.graph.add_edge("node_historie_loeschen", "pruefe_text_zusammenfassen")
-        self.graph.add_edge("node_text_zusammenfassen", "pruefe_tabellen_extrahieren")
+        self.graph.add_edge("node_historie_loeschen", "node_extrahieren")
+        self.graph.add_edge("node_extrahieren", "pruefe_text_zusammenfassen")
+        self.graph.add_edge("node_text_zusammenfassen", "node_text_zusammenfuehren")
+        self.graph.add_edge(
+            "node_text_zusammenfuehren", "pruefe_tabellen_zusammenfassen"
+        )
         self.graph.add_edge(
-            "node_tabellen_extrahieren", "pruefe_tabellen_zusammenfassen"
+            "node_tabellen_zusammenfassen", "node_tabellen_zusammenfuehren"
         )
-        self.graph.add_edge("node_tabellen_zusammenfassen", END)
+        self.graph.add_edge("node_tabellen_zusammenfuehren", END)
 
-        self.graph = self.graph.compile(checkpointer=InMemorySaver())
+        self.graph = self.graph.compile(checkpointer=self.checkpointer)
 
     def starten(self, streamlit_fortschitt) -> list[Zusammenfassung]:
+        return synchron_ausfuehren(
+            self.astarten(streamlit_fortschitt=streamlit_fortschitt)
+        )
 
-        zusammenfassungen: list[Zusammenfassung] = []
+    async def cache_schluessel_ermitteln(
+        self,
+        referenzdokument: Referenzdokument,
+        zusammenfassung_auswahl: ZusammenfassungAuswahl,
+    ) -> str | None:
+        if self.zusammenfassungs_cache is None:
+            return None
+        try:
+            inhalt = await asyncio.to_thread(
+                lader_fuer(referenzdokument).inhalt, referenzdokument.pfad
+            )
+        except Exception as e:
+            log.warning(
+                f"{referenzdokument.name}: Inhalt für den Cache nicht lesbar ({e})"
+            )
+            return None
+        return self.zusammenfassungs_cache.schluessel(
+            referenzdokument=referenzdokument,
+            inhalt=inhalt,
+            zusammenfassung_auswahl=zusammenfassung_auswahl,
+            prompt=self.prompt,
+            llm_provider=self.llm_provider,
+            tabellen_zeilen=TABELLEN_ZEILEN,
+            tabellen_pro_anfrage=self.tabellen_pro_anfrage,
+            text_max_tokens=self.text_max_tokens,
+            text_ueberlappung_tokens=self.text_ueberlappung_tokens,
+            csv_modus=self.csv_modus,
+        )
 
-        anzahl_referenzdokumente = len(self.referenzdokumente_auswahl)
-        for i, referenzdokumente_auswahl in enumerate(
-            self.referenzdokumente_auswahl, 1
-        ):
+    async def extrahieren(
+        self, referenzdokumente_auswahl: ReferenzdokumentAuswahl
+    ) -> Extraktion:
+        referenzdokument = referenzdokumente_auswahl.referenzdokument
+        zusammenfassung_auswahl = referenzdokumente_auswahl.zusammenfassung_auswahl
+        if not zusammenfassung_auswahl.soll_vorbereitet_werden():
+            return Extraktion(text="", tabellen=[])
+
+        lader = lader_fuer(
+            referenzdokument, zusammenfassung_auswahl.pdf_backend, self.csv_modus
+        )
 
-            referenzdokument: Referenzdokument = (
-                referenzdokumente_auswahl.referenzdokument
+        def extrahieren_und_aufbereiten() -> tuple[Extraktion, Tabellenersparnis]:
+            extraktion: Extraktion = lader.extrahiere(
+                referenzdokument.pfad,
+                text=zusammenfassung_auswahl.text_zusammenfassen,
+                tabellen=zusammenfassung_auswahl.tabellen_extrahieren,
+                zeilen=TABELLEN_ZEILEN,
             )
-            zusammenfassung_auswahl: ZusammenfassungAuswahl = (
-                referenzdokumente_auswahl.zusammenfassung_auswahl
+            tabellen = tabellen_deduplizieren(extraktion.tabellen)
+            return replace(extraktion, tabellen=tabellen), tabellenersparnis_berechnen(
+                extraktion.tabellen, tabellen, zusammenfassung_auswahl.tabellenformat
             )
 
-            state = ReferenzdokumentState(
-                referenzdokument=referenzdokument,
-                zusammenfassung_auswahl=zusammenfassung_auswahl,
-                aktuelles_referenzdokument=i,
-                anzahl_referenzdokumente=anzahl_referenzdokumente,
-                text_extrahiert="",
-                text_zusammengefasst="",
-                text_zusammengefasst_messages=[],
-                tabellen_extrahiert=[],
-                tabellen_zusammengefasst=[],
-                tabellen_zusammengefasst_messages=[],
+        # Blockiert (Netzwerk/CPU), daher außerhalb der Event-Loop; PDFs gehen
+        # von dort in den Prozesspool
+        extraktion, tabellenersparnis = await asyncio.to_thread(
+            extrahieren_und_aufbereiten
+        )
+        if tabellenersparnis.tabellen:
+            log.info(
+                f"{referenzdokument.name}: {tabellenersparnis.tabellen} Tabellen, {tabellenersparnis.duplikate} Duplikate entfernt,"
+                f" {tabellenersparnis.tokens_markdown} Tokens als Markdown, {tabellenersparnis.tokens_kompakt} kompakt"
             )
+        self.tabellenersparnis += tabellenersparnis
+        return extraktion
 
-            out = self.aufrufen(
-                state=state,
-                streamlit_fortschritt=streamlit_fortschitt,
-                run_name=f"Referenz {referenzdokument.name}",
-                reset_tokenverbrauch=True,  # Weil hier die Tokens pro Zusammenfassung gespeichert werden, muss nach jedem Lauf resettet werden
-            )
+    async def zusammenfassen(
+        self,
+        nummer: int,
+        referenzdokumente_auswahl: ReferenzdokumentAuswahl,
+        extraktion: Extraktion,
+        gesamtfortschritt: Gesamtfortschritt,
+    ) -> Zusammenfassung:
+        referenzdokument: Referenzdokument = referenzdokumente_auswahl.referenzdokument
+        zusammenfassung_auswahl: ZusammenfassungAuswahl = (
+            referenzdokumente_auswahl.zusammenfassung_auswahl
+        )
 
-            chatverlaeufe: list[LLMChatverlauf] = []
+        state = ReferenzdokumentState(
+            referenzdokument=referenzdokument,
+            zusammenfassung_auswahl=zusammenfassung_auswahl,
+            aktuelles_referenzdokument=nummer,
+            anzahl_referenzdokumente=gesamtfortschritt.anzahl_referenzdokumente,
+            extrahiert=True,
+            text_extrahiert=extraktion.text,
+            text_zusammengefasst="",
+            text_zusammengefasst_messages=[],
+            tabellen_extrahiert=extraktion.tabellen,
+            tabellen_zusammengefasst=[],
+            tabellen_zusammengefasst_messages=[],
+            tabellen_pro_anfrage=self.tabellen_pro_anfrage,
+            text_max_tokens=self.text_max_tokens,
+            text_ueberlappung_tokens=self.text_ueberlappung_tokens,
+        )
 
-            chatverlauf_text = out.get("text_zusammengefasst_messages", {})
-            if chatverlauf_text:
-                chatverlaeufe.append(
-                    LLMChatverlauf(
-                        name="text_zusammengefasst",
-                        chatverlauf=chatverlauf_text,
-                    )
+        # Eigener Thread und eigener Tokenzähler, weil mehrere Dokumente
+        # gleichzeitig laufen und die Tokens pro Zusammenfassung gespeichert werden
+        llm_callback = UsageMetadataCallbackHandler()
+        out = await self.aufrufen_async(
+            state=state,
+            streamlit_fortschritt=gesamtfortschritt,
+            run_name=f"Referenz {referenzdokument.name}",
+            thread_id=f"{self.thread_id()}-{nummer}",
+            llm_callback=llm_callback,
+        )
+
+        chatverlaeufe: list[LLMChatverlauf] = []
+
+        chatverlauf_text = out.get("text_zusammengefasst_messages", {})
+        if chatverlauf_text:
+            chatverlaeufe.append(
+                LLMChatverlauf(
+                    name="text_zusammengefasst",
+                    chatverlauf=chatverlauf_text,
                 )
+            )
+
+        chatverlaeufe_tabellen = out.get("tabellen_zusammengefasst_messages", [])
+        for chatverlauf_tabelle in chatverlaeufe_tabellen:
+            chatverlaeufe.append(
+                LLMChatverlauf(
+                    name="tabellen_zusammengefasst",
+                    chatverlauf=chatverlauf_tabelle,
+                )
+            )
+
+        return Zusammenfassung(
+            referenzdokument=referenzdokument,
+            zusammenfassung_auswahl=zusammenfassung_auswahl,
+            erstellungsdatum=self.startzeit_formatiert(),
+            text_extrahiert=out.get("text_extrahiert", ""),
+            text_zusammengefasst=out.get("text_zusammengefasst", ""),
+            tabellen_extrahiert=out.get("tabellen_extrahiert", []),
+            tabellen_zusammengefasst=out.get("tabellen_zusammengefasst", []),
+            prompt=self.prompt,
+            llm=LLM(
+                konfiguration=self.llm_config_holen(),
+                tokenverbrauch=self.llm_tokenverbrauch(llm_callback),
+                chatverlaeufe=chatverlaeufe,
+            ),
+        )
 
-            chatverlaeufe_tabellen = out.get("tabellen_zusammengefasst_messages", [])
-            for chatverlauf_tabelle in chatverlaeufe_tabellen:
-                chatverlaeufe.append(
-                    LLMChatverlauf(
-                        name="tabellen_zusammengefasst",
-                        chatverlauf=chatverlauf_tabelle,
+    async def astarten(self, streamlit_fortschitt) -> list[Zusammenfassung]:
+        """
+        Zwei Stufen: Extraktionen (Threads, PDFs im Prozesspool) füllen eine
+        begrenzte Warteschlange, aus der mehrere Zusammenfassungen gleichzeitig
+        ans LLM gehen. Die Ergebnisse stehen in der Reihenfolge der Auswahl.
+        """
+        anzahl_referenzdokumente = len(self.referenzdokumente_auswahl)
+        gesamtfortschritt = Gesamtfortschritt(
+            streamlit_fortschitt, anzahl_referenzdokumente
+        )
+        zusammenfassungen: list[Zusammenfassung | None] = [
+            None
+        ] * anzahl_referenzdokumente
+
+        # Begrenzt, damit die Extraktion den Zusammenfassungen nicht beliebig
+        # weit vorausläuft und alle Texte gleichzeitig im Speicher hält
+        warteschlange: asyncio.Queue = asyncio.Queue(maxsize=self.warteschlange)
+        extraktion_semaphore = asyncio.Semaphore(self.extraktion_parallelitaet)
+
+        async def vorbereiten(
+            nummer: int, referenzdokumente_auswahl: ReferenzdokumentAuswahl
+        ):
+            referenzdokument = referenzdokumente_auswahl.referenzdokument
+            zusammenfassung_auswahl = referenzdokumente_auswahl.zusammenfassung_auswahl
+
+            async with extraktion_semaphore:
+                # Unveränderte Dokumente nicht erneut extrahieren und zusammenfassen
+                cache_schluessel = await self.cache_schluessel_ermitteln(
+                    referenzdokument, zusammenfassung_auswahl
+                )
+                if cache_schluessel is not None:
+                    zusammenfassung = self.zusammenfassungs_cache.laden(
+                        cache_schluessel
                     )
+                    if zusammenfassung is not None:
+                        log.info(
+                            f"{referenzdokument.name}: unverändert, Zusammenfassung aus dem Cache übernommen"
+                        )
+                        zusammenfassungen[nummer - 1] = replace(
+                            treffer_zusammenfassung(zusammenfassung),
+                            referenzdokument=referenzdokument,
+                            zusammenfassung_auswahl=zusammenfassung_auswahl,
+                            prompt=self.prompt,
+                        )
+                        gesamtfortschritt.melden(
+                            nummer,
+                            SCHRITTE,
+                            f"{referenzdokument.name}: aus dem Cache übernommen",
+                        )
+                        return
+
+                gesamtfortschritt.melden(
+                    nummer, 2, f"{referenzdokument.name}: Text und Tabellen auslesen"
+                )
+                extraktion = await self.extrahieren(referenzdokumente_auswahl)
+                # Erst mit Platz in der Warteschlange wird die nächste Extraktion frei
+                await warteschlange.put(
+                    (nummer, referenzdokumente_auswahl, cache_schluessel, extraktion)
                 )
 
-            zusammenfassungen.append(
-                Zusammenfassung(
-                    referenzdokument=referenzdokument,
-                    zusammenfassung_auswahl=zusammenfassung_auswahl,
-                    erstellungsdatum=self.startzeit_formatiert(),
-                    text_extrahiert=out.get("text_extrahiert", ""),
-                    text_zusammengefasst=out.get("text_zusammengefasst", ""),
-                    tabellen_extrahiert=out.get("tabellen_extrahiert", []),
-                    tabellen_zusammengefasst=out.get("tabellen_zusammengefasst", []),
-                    prompt=self.prompt,
-                    llm=LLM(
-                        konfiguration=self.llm_config_holen(),
-                        tokenverbrauch=self.llm_tokenverbrauch(),
-                        chatverlaeufe=chatverlaeufe,
-                    ),
+        async def extraktionen():
+            async with asyncio.TaskGroup() as aufgaben:
+                for nummer, referenzdokumente_auswahl in enumerate(
+                    self.referenzdokumente_auswahl, 1
+                ):
+                    aufgaben.create_task(vorbereiten(nummer, referenzdokumente_auswahl))
+            for _ in range(self.parallelitaet):
+                await warteschlange.put(None)
+
+        async def zusammenfassungen_erstellen():
+            while (eintrag := await warteschlange.get()) is not None:
+                nummer, referenzdokumente_auswahl, cache_schluessel, extraktion = (
+                    eintrag
                 )
-            )
+                zusammenfassung = await self.zusammenfassen(
+                    nummer, referenzdokumente_auswahl, extraktion, gesamtfortschritt
+                )
+                # Ohne Inhalt bliebe eine leere Zusammenfassung bis zum Ablauf im Cache
+                if (
+                    cache_schluessel is not None
+                    and not extraktion.fehlgeschlagen
+                    and (extraktion.text or extraktion.tabellen)
+                ):
+                    self.zusammenfassungs_cache.speichern(
+                        cache_schluessel, zusammenfassung
+                    )
+                zusammenfassungen[nummer - 1] = zusammenfassung
+
+        log.info(
+            f"{anzahl_referenzdokumente} Referenzdokumente, {self.extraktion_parallelitaet} Extraktionen und {self.parallelitaet} Zusammenfassungen gleichzeitig"
+        )
+        # Scheitert ein Dokument, werden die übrigen Aufgaben abgebrochen
+        async with asyncio.TaskGroup() as aufgaben:
+            aufgaben.create_task(extraktionen())
+            for _ in range(self.parallelitaet):
+                aufgaben.create_task(zusammenfassungen_erstellen())
 
         return zusammenfassungen
 
@@ -158,19 +440,18 @@ class Zusammenfassungsgenerator(LLMGenerator):
 def fortschritt(prozessschritt: int, text: str, state, config):
     referenz: Referenzdokument = state["referenzdokument"]
     aktuelle_referenz: int = state["aktuelles_referenzdokument"]
-    anzahl_referenzen: int = state["anzahl_referenzdokumente"]
-
-    prozent_referenz = aktuelle_referenz / anzahl_referenzen
-    prozent_prozessschritt = prozent_referenz / 7 * prozessschritt
 
     tokenverbrauch = hole_tokenverbrauch_aus_graph(config)
-    fortschritt = (
+    gesamtfortschritt: Gesamtfortschritt | None = (
         (config or {}).get("configurable", {}).get("streamlit_fortschritt", None)
     )
-    fortschritt.progress(
-        prozent_prozessschritt,
-        text=f"{referenz.name}: {text} - {tokenverbrauch} Token verbraucht!",
-    )
+    fortschritt_text = f"{referenz.name}: {text} - {tokenverbrauch} Token verbraucht!"
+
+    if gesamtfortschritt is None:
+        log.info(fortschritt_text)
+        return
+
+    gesamtfortschritt.melden(aktuelle_referenz, prozessschritt, fortschritt_text)
 
 
 def node_kontext(state, config=None):
@@ -183,6 +464,8 @@ def node_historie_loeschen(state):
     result = {
         "text_zusammengefasst_messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES)],
         "tabellen_zusammengefasst_messages": [],
+        "text_ergebnisse": None,
+        "tabellen_ergebnisse": None,
     }
     log.debug(
         f"LangGraph Node {inspect.stack()[0][3]} beendet, Ergebnis: {str(result)}"
@@ -190,157 +473,383 @@ def node_historie_loeschen(state):
     return result
 
 
-def pruefe_text_zusammenfassen(
-    state, config=None
-) -> Command[Literal["node_text_zusammenfassen", "pruefe_tabellen_extrahieren"]]:
-    fortschritt(
-        2, "Überprüfen, ob Zusammenfassung aus Text erstellt werden soll", state, config
-    )
-    zusammenfassung_auswahl: ZusammenfassungAuswahl = state["zusammenfassung_auswahl"]
-    if zusammenfassung_auswahl.text_zusammenfassen:
-        return Command(goto="node_text_zusammenfassen")
-    return Command(goto="pruefe_tabellen_extrahieren")
-
-
-def node_text_zusammenfassen(state, config=None):
-    fortschritt(3, "Text auslesen", state, config)
+async def node_extrahieren(state, config=None):
+    fortschritt(2, "Text und Tabellen auslesen", state, config)
     referenzdokument: Referenzdokument = state["referenzdokument"]
     zusammenfassung_auswahl: ZusammenfassungAuswahl = state["zusammenfassung_auswahl"]
 
-    text_extrahiert: str = ""
-    zusammengefasst: str = ""
-    messages = []
+    # In der Pipeline von astarten schon vor dem Graphen extrahiert
+    if state.get("extrahiert") or not zusammenfassung_auswahl.soll_vorbereitet_werden():
+        return {}
 
-    if referenzdokument.art == "URL":
-        lader = URLLader()
-    elif referenzdokument.art == "CSV":
-        lader = CSVLader()
-    else:
-        lader = PDFLader()
+    lader = lader_fuer(referenzdokument, zusammenfassung_auswahl.pdf_backend)
 
-    text_extrahiert = lader.extrahiere_text(referenzdokument.pfad)
+    # Ein Durchlauf für Text und Tabellen; blockiert (Netzwerk/CPU), daher
+    # außerhalb der Event-Loop
+    extraktion: Extraktion = await asyncio.to_thread(
+        lader.extrahiere,
+        referenzdokument.pfad,
+        text=zusammenfassung_auswahl.text_zusammenfassen,
+        tabellen=zusammenfassung_auswahl.tabellen_extrahieren,
+        zeilen=TABELLEN_ZEILEN,
+    )
 
-    if text_extrahiert != "":
+    return {
+        "text_extrahiert": extraktion.text,
+        "tabellen_extrahiert": tabellen_deduplizieren(extraktion.tabellen),
+    }
 
-        ##### LLM zusammenfassen lassen
 
-        if zusammenfassung_auswahl.text_zusammenfassen_mit_zahlen:
-            fortschritt(
-                3, "Text von KI zusammenfassen lassen (mit Zahlen)", state, config
-            )
-            prompt_zusammenfassung = hole_prompt_aus_graph(
-                "text_zusammenfassen_mit_zahlen", config
-            )
-        else:
-            fortschritt(
-                3, "Text von KI zusammenfassen lassen (ohne Zahlen)", state, config
-            )
-            prompt_zusammenfassung = hole_prompt_aus_graph(
-                "text_zusammenfassen_ohne_zahlen", config
+def pruefe_text_zusammenfassen(state, config=None) -> Command[Literal["node_text_zusammenfassen", "pruefe_tabellen_zusammenfassen"]]:  # type: ignore
+    fortschritt(
+        3, "Überprüfen, ob Zusammenfassung aus Text erstellt werden soll", state, config
+    )
+    zusammenfassung_auswahl: ZusammenfassungAuswahl = state["zusammenfassung_auswahl"]
+    text_extrahiert: str = state.get("text_extrahiert", "")
+    if not (zusammenfassung_auswahl.text_zusammenfassen and text_extrahiert):
+        return Command(goto="pruefe_tabellen_zusammenfassen")
+
+    # Map: lange Texte in Abschnitten, die gleichzeitig zusammengefasst werden
+    abschnitte = text_aufteilen(
+        text_extrahiert,
+        max_tokens=state.get("text_max_tokens", TEXT_MAX_TOKENS),
+        ueberlappung_tokens=state.get(
+            "text_ueberlappung_tokens", TEXT_UEBERLAPPUNG_TOKENS
+        ),
+    )
+    if len(abschnitte) > 1:
+        log.info(
+            f"{state['referenzdokument'].name}: Text in {len(abschnitte)} Abschnitten zusammenfassen"
+        )
+    return Command(
+        goto=[
+            Send(
+                "node_text_zusammenfassen",
+                {
+                    "referenzdokument": state["referenzdokument"],
+                    "zusammenfassung_auswahl": zusammenfassung_auswahl,
+                    "aktuelles_referenzdokument": state["aktuelles_referenzdokument"],
+                    "abschnitt": abschnitt,
+                    "anzahl_abschnitte": len(abschnitte),
+                    "text": text,
+                },
             )
+            for abschnitt, text in enumerate(abschnitte, 1)
+        ]
+    )
 
-        messages.append(SystemMessage(content=prompt_zusammenfassung))
-        messages.append(HumanMessage(content=text_extrahiert))
 
-        antwort_message: AIMessage = hole_llm_instanz_aus_graph(config).invoke(messages)
-        messages.append(antwort_message)
+def text_prompt_holen(zusammenfassung_auswahl: ZusammenfassungAuswahl, config) -> str:
+    if zusammenfassung_auswahl.text_zusammenfassen_mit_zahlen:
+        return hole_prompt_aus_graph("text_zusammenfassen_mit_zahlen", config)
+    return hole_prompt_aus_graph("text_zusammenfassen_ohne_zahlen", config)
 
-        zusammengefasst = parse_llm_content(antwort_message, config)
 
-    return {
-        "text_extrahiert": text_extrahiert,
-        "text_zusammengefasst": zusammengefasst,
-        "text_zusammengefasst_messages": messages,
-    }
+async def text_llm_aufrufen(system: str, text: str, config) -> tuple[list, str]:
+    messages = [SystemMessage(content=system), HumanMessage(content=text)]
+    antwort_message: AIMessage = await llm_aufrufen_async(config, messages)
+    messages.append(antwort_message)
+    return messages, parse_llm_content(antwort_message, config)
 
 
-def pruefe_tabellen_extrahieren(state, config=None) -> Command[Literal["node_tabellen_extrahieren", END]]:  # type: ignore
-    fortschritt(4, "Überprüfen, ob Tabellen extrahiert werden sollen", state, config)
+async def node_text_zusammenfassen(state, config=None):
     zusammenfassung_auswahl: ZusammenfassungAuswahl = state["zusammenfassung_auswahl"]
-    if zusammenfassung_auswahl.tabellen_extrahieren:
-        return Command(goto="node_tabellen_extrahieren")
-    return Command(goto=END)
+    zahlen = "mit" if zusammenfassung_auswahl.text_zusammenfassen_mit_zahlen else "ohne"
+    abschnitt = (
+        f" (Abschnitt {state['abschnitt']}/{state['anzahl_abschnitte']})"
+        if state["anzahl_abschnitte"] > 1
+        else ""
+    )
+    fortschritt(
+        4,
+        f"Text von KI zusammenfassen lassen ({zahlen} Zahlen){abschnitt}",
+        state,
+        config,
+    )
 
+    messages, zusammengefasst = await text_llm_aufrufen(
+        text_prompt_holen(zusammenfassung_auswahl, config), state["text"], config
+    )
+    return {
+        "text_ergebnisse": [
+            Textergebnis(
+                abschnitt=state["abschnitt"],
+                zusammengefasst=zusammengefasst,
+                messages=messages,
+            )
+        ]
+    }
 
-def node_tabellen_extrahieren(state, config=None):
-    fortschritt(5, "Tabellen extrahieren", state, config)
-    referenzdokument: Referenzdokument = state["referenzdokument"]
 
-    tabellen_extrahiert: list[str] = []
-    if referenzdokument.art == "URL":
-        lader = URLLader()
-    elif referenzdokument.art == "CSV":
-        lader = CSVLader()
+async def node_text_zusammenfuehren(state, config=None):
+    """Reduce: führt die Zusammenfassungen der Abschnitte zu einer zusammen."""
+    zusammenfassung_auswahl: ZusammenfassungAuswahl = state["zusammenfassung_auswahl"]
+    text_ergebnisse: list[Textergebnis] = sorted(
+        state.get("text_ergebnisse", []), key=lambda e: e["abschnitt"]
+    )
+    messages = [m for e in text_ergebnisse for m in e["messages"]]
+    teile = [e["zusammengefasst"] for e in text_ergebnisse]
+
+    if len(teile) > 1:
+        fortschritt(
+            4,
+            f"{len(teile)} Teilzusammenfassungen von KI zusammenführen lassen",
+            state,
+            config,
+        )
+        system = (
+            text_prompt_holen(zusammenfassung_auswahl, config)
+            + TEXT_ZUSAMMENFUEHREN_ANWEISUNG
+        )
+        max_tokens = state.get("text_max_tokens", TEXT_MAX_TOKENS)
+
+        # Passen die Teile nicht in eine Anfrage, erst gruppenweise verdichten
+        while len(gruppen := teile_gruppieren(teile, max_tokens)) > 1:
+            if len(gruppen) == len(teile):
+                # Keine zwei Teile passen zusammen: paarweise verdichten, so
+                # sinkt die Anzahl sicher und jede Anfrage bleibt begrenzt
+                log.warning(
+                    f"{len(teile)} Teilzusammenfassungen sind zu lang für {max_tokens} Tokens, werden paarweise verdichtet"
+                )
+                gruppen = [teile[i : i + 2] for i in range(0, len(teile), 2)]
+            verdichtet = await asyncio.gather(
+                *(
+                    (
+                        text_llm_aufrufen(system, "\n\n".join(gruppe), config)
+                        if len(gruppe) > 1
+                        else einzeln(gruppe[0])
+                    )
+                    for gruppe in gruppen
+                )
+            )
+            messages.extend(
+                m for gruppe_messages, _ in verdichtet for m in gruppe_messages
+            )
+            teile = [z for _, z in verdichtet]
+
+        if len(teile) == 1:
+            zusammengefasst = teile[0]
+        else:
+            reduce_messages, zusammengefasst = await text_llm_aufrufen(
+                system, "\n\n".join(teile), config
+            )
+            messages.extend(reduce_messages)
     else:
-        lader = PDFLader()
+        zusammengefasst = teile[0] if teile else ""
 
-    tabellen_extrahiert = lader.extrahiere_tabellen(referenzdokument.pfad, zeilen=20)
+    return {
+        "text_zusammengefasst": zusammengefasst,
+        "text_zusammengefasst_messages": messages,
+    }
 
-    return {"tabellen_extrahiert": tabellen_extrahiert}
+
+async def einzeln(teil: str) -> tuple[list, str]:
+    # Ein Teil allein muss nicht erneut zusammengefasst werden
+    return [], teil
+
+
+def teile_gruppieren(teile: list[str], max_tokens: int) -> list[list[str]]:
+    gruppen: list[list[str]] = []
+    aktuell: list[str] = []
+    tokens = 0
+    for teil in teile:
+        n = tokens_zaehlen(teil)
+        if aktuell and tokens + n > max_tokens:
+            gruppen.append(aktuell)
+            aktuell, tokens = [], 0
+        aktuell.append(teil)
+        tokens += n
+    if aktuell:
+        gruppen.append(aktuell)
+    return gruppen
+
+
+def tabellen_buendeln(
+    tabellen: list[str], pro_anfrage: int, max_zeichen: int = TABELLEN_MAX_ZEICHEN
+) -> list[list[int]]:
+    """Indizes je LLM-Anfrage: bis zu `pro_anfrage` kleine Tabellen zusammen, große allein."""
+    buendel: list[list[int]] = []
+    aktuell: list[int] = []
+    zeichen = 0
+    for i, tabelle in enumerate(tabellen):
+        if aktuell and (
+            len(aktuell) >= pro_anfrage or zeichen + len(tabelle) > max_zeichen
+        ):
+            buendel.append(aktuell)
+            aktuell, zeichen = [], 0
+        aktuell.append(i)
+        zeichen += len(tabelle)
+    if aktuell:
+        buendel.append(aktuell)
+    return buendel
+
+
+def zusammenfassungen_trennen(antwort: str, anzahl: int) -> list[str] | None:
+    """Teilt die Antwort auf ein Bündel an den Trennern; None, wenn Tabellen fehlen."""
+    teile = TABELLEN_TRENNER_MUSTER.split(antwort)
+    zusammenfassungen = {
+        int(nummer): text.strip() for nummer, text in zip(teile[1::2], teile[2::2])
+    }
+    if sorted(zusammenfassungen) != list(range(1, anzahl + 1)):
+        return None
+    return [zusammenfassungen[nummer] for nummer in range(1, anzahl + 1)]
 
 
 def pruefe_tabellen_zusammenfassen(state, config=None) -> Command[Literal["node_tabellen_zusammenfassen", END]]:  # type: ignore
     fortschritt(
-        6,
+        5,
         "Überprüfen, ob Zusammenfassungen aus Tabellen erstellt werden sollen",
         state,
         config,
     )
     zusammenfassung_auswahl: ZusammenfassungAuswahl = state["zusammenfassung_auswahl"]
-    if zusammenfassung_auswahl.tabellen_zusammenfassen:
-        return Command(goto="node_tabellen_zusammenfassen")
-    return Command(goto=END)
-
+    # Erst hier in Text, im gewählten kompakten Format
+    tabellen: list[str] = [
+        tabelle_serialisieren(tabelle, zusammenfassung_auswahl.tabellenformat)
+        for tabelle in state.get("tabellen_extrahiert", [])
+    ]
+    if not (
+        zusammenfassung_auswahl.tabellen_extrahieren
+        and zusammenfassung_auswahl.tabellen_zusammenfassen
+        and tabellen
+    ):
+        return Command(goto=END)
+
+    # Fan-out: jede Anfrage ist ein eigener Knoten, die Knoten laufen
+    # gleichzeitig, begrenzt durch Ratenbegrenzung und Nebenläufigkeit des Providers
+    return Command(
+        goto=[
+            Send(
+                "node_tabellen_zusammenfassen",
+                {
+                    "referenzdokument": state["referenzdokument"],
+                    "zusammenfassung_auswahl": zusammenfassung_auswahl,
+                    "aktuelles_referenzdokument": state["aktuelles_referenzdokument"],
+                    "anzahl_tabellen": len(tabellen),
+                    "indizes": indizes,
+                    "tabellen": [tabellen[i] for i in indizes],
+                },
+            )
+            for indizes in tabellen_buendeln(
+                tabellen, state.get("tabellen_pro_anfrage", 1)
+            )
+        ]
+    )
 
-def node_tabellen_zusammenfassen(state, config=None):
-    fortschritt(7, "Tabellen zusammenfassen", state, config)
-    zusammenfassung_auswahl: ZusammenfassungAuswahl = state["zusammenfassung_auswahl"]
 
-    tabellen: list[str] = state.get("tabellen_extrahiert", [])
-    tabellen_zusammengefasst: list[str] = []
-    messages_liste: list[str] = []
+async def tabelle_zusammenfassen(
+    prompt_zusammenfassung: str, tabelle: str, config
+) -> tuple[list, str]:
+    messages = [
+        SystemMessage(content=prompt_zusammenfassung),
+        HumanMessage(content=tabelle),
+    ]
+    antwort_message: AIMessage = await llm_aufrufen_async(config, messages)
+    messages.append(antwort_message)
+    return messages, parse_llm_content(antwort_message, config)
 
-    anzahl_tabellen = len(tabellen)
 
-    for i, tabelle in enumerate(tabellen, 1):
+async def node_tabellen_zusammenfassen(state, config=None):
+    zusammenfassung_auswahl: ZusammenfassungAuswahl = state["zusammenfassung_auswahl"]
+    indizes: list[int] = state["indizes"]
+    tabellen: list[str] = state["tabellen"]
+
+    nummern = ", ".join(str(i + 1) for i in indizes)
+    if zusammenfassung_auswahl.tabellen_zusammenfassen_mit_zahlen:
+        fortschritt(
+            6,
+            f"Tabelle {nummern}/{state['anzahl_tabellen']} von KI zusammenfassen lassen (mit Zahlen)",
+            state,
+            config,
+        )
+        prompt_zusammenfassung = hole_prompt_aus_graph(
+            "tabellen_zusammenfassen_mit_zahlen", config
+        )
+    else:
+        fortschritt(
+            6,
+            f"Tabelle {nummern}/{state['anzahl_tabellen']} von KI zusammenfassen lassen (ohne Zahlen)",
+            state,
+            config,
+        )
+        prompt_zusammenfassung = hole_prompt_aus_graph(
+            "tabellen_zusammenfassen_ohne_zahlen", config
+        )
 
-        ##### LLM zusammenfassen lassen
+    if len(tabellen) == 1:
+        messages, zusammengefasst = await tabelle_zusammenfassen(
+            prompt_zusammenfassung, tabellen[0], config
+        )
+        return {
+            "tabellen_ergebnisse": [
+                Tabellenergebnis(
+                    indizes=indizes,
+                    zusammengefasst=[zusammengefasst],
+                    messages=[messages],
+                )
+            ]
+        }
 
-        messages = []
+    ##### Bündel: ein Systemprompt für mehrere kleine Tabellen
 
-        if zusammenfassung_auswahl.tabellen_zusammenfassen_mit_zahlen:
-            fortschritt(
-                7,
-                f"Tabelle {i}/{anzahl_tabellen} von KI zusammenfassen lassen (mit Zahlen)",
-                state,
-                config,
-            )
-            prompt_zusammenfassung = hole_prompt_aus_graph(
-                "tabellen_zusammenfassen_mit_zahlen", config
-            )
-        else:
-            fortschritt(
-                7,
-                f"Tabelle {i}/{anzahl_tabellen} von KI zusammenfassen lassen (ohne Zahlen)",
-                state,
-                config,
-            )
-            prompt_zusammenfassung = hole_prompt_aus_graph(
-                "tabellen_zusammenfassen_ohne_zahlen", config
+    messages = [
+        SystemMessage(content=prompt_zusammenfassung + TABELLEN_BUENDEL_ANWEISUNG),
+        HumanMessage(
+            content="\n\n".join(
+                f"{TABELLEN_TRENNER.format(nummer=nummer)}\n{tabelle}"
+                for nummer, tabelle in enumerate(tabellen, 1)
             )
+        ),
+    ]
+    antwort_message: AIMessage = await llm_aufrufen_async(config, messages)
+    messages.append(antwort_message)
 
-        messages.append(SystemMessage(content=prompt_zusammenfassung))
-        messages.append(HumanMessage(content=tabelle))
-
-        antwort_message: AIMessage = hole_llm_instanz_aus_graph(config).invoke(messages)
-        messages.append(antwort_message)
+    zusammengefasst = zusammenfassungen_trennen(
+        parse_llm_content(antwort_message, config), len(tabellen)
+    )
+    if zusammengefasst is not None:
+        return {
+            "tabellen_ergebnisse": [
+                Tabellenergebnis(
+                    indizes=indizes,
+                    zusammengefasst=zusammengefasst,
+                    messages=[messages],
+                )
+            ]
+        }
 
-        zusammengefasst = parse_llm_content(antwort_message, config)
+    # Antwort passt nicht zu den Trennern, dann jede Tabelle einzeln
+    log.warning(
+        f"Gebündelte Antwort für Tabellen {nummern} nicht trennbar, fasse einzeln zusammen"
+    )
+    einzeln = await asyncio.gather(
+        *(
+            tabelle_zusammenfassen(prompt_zusammenfassung, tabelle, config)
+            for tabelle in tabellen
+        )
+    )
+    return {
+        "tabellen_ergebnisse": [
+            Tabellenergebnis(
+                indizes=indizes,
+                zusammengefasst=[z for _, z in einzeln],
+                messages=[messages] + [m for m, _ in einzeln],
+            )
+        ]
+    }
 
-        messages_liste.append(messages)
-        tabellen_zusammengefasst.append(zusammengefasst)
 
+def node_tabellen_zusammenfuehren(state):
+    log.info(f"LangGraph Node {inspect.stack()[0][3]} gestartet")
+    # Die Knoten enden in beliebiger Reihenfolge, die Tabellen bleiben in ihrer
+    tabellen_ergebnisse: list[Tabellenergebnis] = sorted(
+        state.get("tabellen_ergebnisse", []), key=lambda e: e["indizes"][0]
+    )
     return {
-        "tabellen_zusammengefasst": tabellen_zusammengefasst,
-        "tabellen_zusammengefasst_messages": messages_liste,
+        "tabellen_zusammengefasst": [
+            z for e in tabellen_ergebnisse for z in e["zusammengefasst"]
+        ],
+        "tabellen_zusammengefasst_messages": [
+            m for e in tabellen_ergebnisse for m in e["messages"]
+        ],
     }
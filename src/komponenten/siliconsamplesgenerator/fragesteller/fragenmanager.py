@@ -24,13 +24,15 @@ log = get_logger(__name__)
 
 class Fragenmanager:
 
-    fragen: dict[str, Frage] = {}
-    antworten: dict[str, Antwort] = {}
-
-    def __init__(self, fragen: list[Frage]):
-        self.fragen = {f.id: f for f in fragen}
+    def __init__(self, fragen: list[Frage], zufall_seed: str | None = None):
+        # Zustand pro Instanz, damit parallele Befragte sich nicht gegenseitig überschreiben
+        self.fragen: dict[str, Frage] = {f.id: f for f in fragen}
+        self.antworten: dict[str, Antwort] = {}
         self._parent_themen_cache: dict[tuple, list[str]] = {}
 
+        # Mit Seed ist die Zufallsauswahl reproduzierbar, z.B. beim Fortsetzen eines Laufs
+        self._zufall = random.Random(zufall_seed)
+
     def reset_antworten(self):
         self.antworten.clear()
         self._parent_themen_cache.clear()
@@ -316,7 +318,7 @@ class Fragenmanager:
 
         # Shuffle “beibehalten”: sample(k=len) gibt eine zufällige Permutation
         permutation = (
-            random.Random().sample(relevante, k=len(relevante))
+            self._zufall.sample(relevante, k=len(relevante))
             if zufaellig
             else list(relevante)
         )
@@ -1,19 +1,29 @@
 import copy
 import inspect
+from typing import Callable
 from typing_extensions import Literal
 from langgraph.types import Command
 from langgraph.graph import START, END
-from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph.message import RemoveMessage, REMOVE_ALL_MESSAGES
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 
 from src.komponenten.referenzdokumente.referenzdokumente_models import (
     Zusammenfassung,
 )
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.tabellenformat import (
+    tabelle_serialisieren,
+)
 from src.komponenten.siliconsamplesgenerator.fragesteller.fragenmanager import (
     Fragenmanager,
 )
+from src.komponenten.siliconsamplesgenerator.fragesteller.referenzindex import (
+    Referenzindex,
+    anfrage_fuer_kontext,
+)
 from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_models import (
+    Referenzabschnitt,
+    Referenzauswahl,
     SiliconSampleState,
     StrukturierteFrage,
     SiliconSamples,
@@ -25,18 +35,38 @@ from src.shared.generator import (
     LLM,
     LLMChatverlauf,
     Prompt,
-    hole_llm_instanz_aus_graph,
+    hole_graph_daten,
     hole_prompt_aus_graph,
     hole_prompt_data_aus_graph,
+    llm_aufrufen_async,
     parse_llm_content,
+    synchron_ausfuehren,
 )
 
+from src.shared.llm_integrations.llm_batch import LLMRunden
 from src.shared.llm_integrations.llm_provider import LLMProvider
 from src.shared.logger import get_logger
 
 log = get_logger(__name__)
 
 
+class FragenintroCache:
+    """
+    Bausteine des Fragen-Intros: Intro je Prompt und Persona, Referenzteil je
+    Auswahl an Referenzabschnitten. Ein Lauf teilt den Cache mit allen
+    Befragten, damit gleiche Intros nicht für jeden Kontext neu gebaut werden.
+    """
+
+    def __init__(self):
+        self.bausteine: dict[tuple, str] = {}
+
+    def holen(self, schluessel: tuple, erzeugen: Callable[[], str]) -> str:
+        baustein = self.bausteine.get(schluessel)
+        if baustein is None:
+            baustein = self.bausteine[schluessel] = erzeugen()
+        return baustein
+
+
 class Fragesteller(LLMGenerator):
 
     def __init__(
@@ -45,16 +75,39 @@ class Fragesteller(LLMGenerator):
         zusammenfassungen: list[Zusammenfassung],
         prompt: Prompt,
         llm_provider: LLMProvider,
+        checkpointer: BaseCheckpointSaver | None = None,
+        befragten_id: str | None = None,
+        referenzindex: Referenzindex | None = None,
+        referenzauswahl: Referenzauswahl | None = None,
+        fragenintro_cache: FragenintroCache | None = None,
+        llm_runden: LLMRunden | None = None,
     ):
         super().__init__(
             prompt=prompt,
             llm_provider=llm_provider,
             state_class=SiliconSampleState,
             thread_prefix="Silicon Samples",
+            checkpointer=checkpointer,
         )
 
+        # Stabile ID des Befragten (z.B. Lauf und Wiederholung), damit die Befragung
+        # über den Checkpointer fortgesetzt werden kann
+        self.befragten_id = befragten_id
+        self.kontext_thread_ids: list[str] = []
+
         self.zusammenfassungen = zusammenfassungen
 
+        # Mit Index bekommt jeder Themenkontext nur die passenden Abschnitte
+        self.referenzauswahl = referenzauswahl or Referenzauswahl()
+        self.referenzindex = referenzindex if self.referenzauswahl.aktiv else None
+
+        self.graph_daten["fragenintro_cache"] = fragenintro_cache or FragenintroCache()
+        self.graph_daten["referenzen_zuerst"] = self.referenzauswahl.referenzen_zuerst
+        # Mit Kontext-Cache des Providers werden die Referenzen einmal hochgeladen
+        self.graph_daten["referenzen_als_kontext"] = llm_provider.kontext_cache_aktiv()
+        # Im Batch-Modus rücken alle Befragten gemeinsam in Runden vor
+        self.graph_daten["llm_runden"] = llm_runden
+
         self.fragen = fragen
 
         self.graph_bauen()
@@ -85,16 +138,39 @@ class Fragesteller(LLMGenerator):
 
         self.graph.add_edge("node_aktualisiere_letzten_kontext", END)
 
-        self.graph = self.graph.compile(checkpointer=InMemorySaver())
+        self.graph = self.graph.compile(checkpointer=self.checkpointer)
+
+    def kontext_thread_id(self, kontext_key: str) -> str | None:
+        # Ein Thread pro Themenkontext, abgeschlossene Kontexte werden nicht erneut befragt
+        if self.befragten_id is None:
+            return None
+        return f"{self.befragten_id}-{kontext_key}"
 
     def starten(self, streamlit_fortschritt):
+        return synchron_ausfuehren(
+            self.astarten(streamlit_fortschritt=streamlit_fortschritt)
+        )
+
+    def referenzabschnitte_suchen(
+        self, frage: StrukturierteFrage, kontext
+    ) -> list[Referenzabschnitt] | None:
+        if self.referenzindex is None:
+            return None
+        return self.referenzindex.suchen(
+            anfrage_fuer_kontext(frage, kontext),
+            top_k=self.referenzauswahl.top_k,
+            token_budget=self.referenzauswahl.token_budget,
+        )
+
+    async def astarten(self, streamlit_fortschritt):
         log.info("Starte Befragung, Fragenmanager instanzieren")
 
-        fragenmanager = Fragenmanager(fragen=self.fragen)
+        fragenmanager = Fragenmanager(fragen=self.fragen, zufall_seed=self.befragten_id)
 
         letzter_kontext_key = None
 
         chatverlaeufe: list[LLMChatverlauf] = []
+        referenzabschnitt_ids: dict[str, list[str]] = {}
 
         while True:
 
@@ -118,19 +194,36 @@ class Fragesteller(LLMGenerator):
                     log.info(f"Themenkontext fertig bearbeitet")
                     continue
 
+                referenzabschnitte = self.referenzabschnitte_suchen(
+                    strukturierte_frage, themenkontext
+                )
+                if referenzabschnitte is not None:
+                    referenzabschnitt_ids[kontext_key] = [
+                        a.id for a in referenzabschnitte
+                    ]
+                    log.info(
+                        f"Referenzabschnitte für {kontext_key}: {", ".join(referenzabschnitt_ids[kontext_key])}"
+                    )
+
                 state = SiliconSampleState(
                     frage=strukturierte_frage,
                     kontext=themenkontext,
                     kontextwechsel=False,
                     letzter_kontext_key=letzter_kontext_key,
                     zusammenfassungen=self.zusammenfassungen,
+                    referenzabschnitte=referenzabschnitte,
                 )
 
+                thread_id = self.kontext_thread_id(kontext_key)
+                if thread_id is not None:
+                    self.kontext_thread_ids.append(thread_id)
+
                 log.info(f"LLM-Prozess starten")
-                out = self.aufrufen(
+                out = await self.aufrufen_async(
                     state=state,
                     streamlit_fortschritt=streamlit_fortschritt,
                     run_name=f"Silicon Samples {kontext_key}",
+                    thread_id=thread_id,
                 )
                 log.info(f"LLM-Prozess beendet")
 
@@ -164,6 +257,7 @@ class Fragesteller(LLMGenerator):
                 tokenverbrauch=self.llm_tokenverbrauch(),
                 chatverlaeufe=chatverlaeufe,
             ),
+            referenzabschnitte=referenzabschnitt_ids,
         )
 
         # Reset für nächsten Stichproben-Lauf
@@ -215,74 +309,117 @@ def node_historie_loeschen(state):
     return result
 
 
+def referenzteil_bauen(
+    zusammenfassungen: list[Zusammenfassung],
+    referenzabschnitte: list[Referenzabschnitt] | None,
+) -> str:
+    if referenzabschnitte is not None:
+        # Nur die zum Themenkontext passenden Abschnitte aus dem Referenzindex
+        texte = [a.inhalt for a in referenzabschnitte if a.art == "text"]
+        tabellen = [a.inhalt for a in referenzabschnitte if a.art == "tabelle"]
+    else:
+        texte = [z.text_zusammengefasst for z in zusammenfassungen]
+
+        tabellen = []
+        for zusammenfassung in zusammenfassungen:
+            if not zusammenfassung.tabellen_zusammengefasst:
+                if not zusammenfassung.tabellen_extrahiert:
+                    continue
+                else:
+                    for tabelle_extrahiert in zusammenfassung.tabellen_extrahiert:
+                        tabellen.append(
+                            tabelle_serialisieren(
+                                tabelle_extrahiert,
+                                zusammenfassung.zusammenfassung_auswahl.tabellenformat,
+                            )
+                        )
+
+            else:
+                for tabelle_zusammengefasst in zusammenfassung.tabellen_zusammengefasst:
+                    tabellen.append(tabelle_zusammengefasst)
+
+    referenzteile: list[str] = []
+
+    if texte:
+        referenzteile.append("\nTexte:")
+        for wert in texte:
+            referenzteile.append(f"\n{wert}")
+
+    if tabellen:
+        referenzteile.append("\nTabellen:")
+        for wert in tabellen:
+            referenzteile.append(f"\n{wert}")
+
+    return "\n".join(referenzteile)
+
+
 def node_fragenintro_generieren(state, config=None):
     log.info(f"LangGraph Node {inspect.stack()[0][3]} gestartet")
     zusammenfassungen: list[Zusammenfassung] = state.get("zusammenfassungen", [])
+    referenzabschnitte: list[Referenzabschnitt] | None = state.get("referenzabschnitte")
 
-    fragenintro_teile: list[str] = []
+    fragenintro_cache: FragenintroCache = (
+        hole_graph_daten("fragenintro_cache", config) or FragenintroCache()
+    )
 
     personas_nutzen: bool = hole_prompt_data_aus_graph("personas_nutzen", config)
 
+    aktuelle_persona: dict[str, str] | None = None
     if personas_nutzen:
-        aktuelle_persona: dict[str, str] = hole_prompt_data_aus_graph(
-            "aktuelle_persona", config
-        )
+        aktuelle_persona = hole_prompt_data_aus_graph("aktuelle_persona", config)
         # {'index': 0, 'Geschlecht': 'weiblich/männlich', 'Altersgruppe': '15-24', 'Region': 'Nielsen 1', 'Urban': 'Ja/Nein'}
 
         if not zusammenfassungen:
-            prompt_intro = hole_prompt_aus_graph(
-                prompt_name="fragen_intro_mit_persona_ohne_referenzen",
-                config=config,
-                prompt_data=aktuelle_persona,
-            )
+            prompt_name = "fragen_intro_mit_persona_ohne_referenzen"
         else:
-            prompt_intro = hole_prompt_aus_graph(
-                "fragen_intro_mit_persona_mit_referenzen",
-                config=config,
-                prompt_data=aktuelle_persona,
-            )
+            prompt_name = "fragen_intro_mit_persona_mit_referenzen"
     else:
         if not zusammenfassungen:
-            prompt_intro = hole_prompt_aus_graph(
-                prompt_name="fragen_intro_ohne_persona_ohne_referenzen",
-                config=config,
-            )
+            prompt_name = "fragen_intro_ohne_persona_ohne_referenzen"
         else:
-            prompt_intro = hole_prompt_aus_graph(
-                "fragen_intro_ohne_persona_mit_referenzen",
-                config=config,
-            )
-
-    fragenintro_teile.append(prompt_intro)
-
-    texte = [z.text_zusammengefasst for z in zusammenfassungen]
-
-    tabellen = []
-    for zusammenfassung in zusammenfassungen:
-        if not zusammenfassung.tabellen_zusammengefasst:
-            if not zusammenfassung.tabellen_extrahiert:
-                continue
-            else:
-                for tabelle_extrahiert in zusammenfassung.tabellen_extrahiert:
-                    tabellen.append(tabelle_extrahiert)
-
-        else:
-            for tabelle_zusammengefasst in zusammenfassung.tabellen_zusammengefasst:
-                tabellen.append(tabelle_zusammengefasst)
+            prompt_name = "fragen_intro_ohne_persona_mit_referenzen"
+
+    prompt_intro = fragenintro_cache.holen(
+        (
+            "intro",
+            prompt_name,
+            tuple(aktuelle_persona.items()) if aktuelle_persona else None,
+        ),
+        lambda: hole_prompt_aus_graph(
+            prompt_name=prompt_name,
+            config=config,
+            prompt_data=aktuelle_persona or {},
+        ),
+    )
 
-    if texte:
-        fragenintro_teile.append("\nTexte:")
-        for wert in texte:
-            fragenintro_teile.append(f"\n{wert}")
+    referenzteil = fragenintro_cache.holen(
+        (
+            "referenzen",
+            (
+                tuple(a.id for a in referenzabschnitte)
+                if referenzabschnitte is not None
+                else None
+            ),
+        ),
+        lambda: referenzteil_bauen(zusammenfassungen, referenzabschnitte),
+    )
 
-    if tabellen:
-        fragenintro_teile.append("\nTabellen:")
-        for wert in tabellen:
-            fragenintro_teile.append(f"\n{wert}")
+    referenzkontext: str | None = None
+    if not referenzteil:
+        inhalt = prompt_intro
+    elif hole_graph_daten("referenzen_als_kontext", config):
+        # Referenzen gehen als Kontext an den Provider, die Historie hält nur das Intro
+        inhalt = prompt_intro
+        referenzkontext = referenzteil.lstrip()
+    elif hole_graph_daten("referenzen_zuerst", config):
+        # Für alle Personas gleicher Anfang, den der Provider als Präfix cachen kann
+        inhalt = f"{referenzteil.lstrip()}\n\n{prompt_intro}"
+    else:
+        inhalt = f"{prompt_intro}\n{referenzteil}"
 
-    fragenintro: SystemMessage = SystemMessage(content="\n".join(fragenintro_teile))
+    fragenintro: SystemMessage = SystemMessage(content=inhalt)
 
-    result = {"messages": fragenintro}
+    result = {"messages": fragenintro, "referenzkontext": referenzkontext}
     log.debug(
         f"LangGraph Node {inspect.stack()[0][3]} beendet, Ergebnis: {str(result)}"
     )
@@ -324,11 +461,13 @@ def node_frage_generieren(state):
     return result
 
 
-def node_frage_stellen(state, config):
+async def node_frage_stellen(state, config):
     log.info(f"LangGraph Node {inspect.stack()[0][3]} gestartet")
     # Historie aus State holen
     messages = state["messages"]
-    response: AIMessage = hole_llm_instanz_aus_graph(config).invoke(messages)
+    response: AIMessage = await llm_aufrufen_async(
+        config, messages, kontext=state.get("referenzkontext")
+    )
     result = {"messages": [response]}
     log.debug(
         f"LangGraph Node {inspect.stack()[0][3]} beendet, Ergebnis: {str(result)}"
@@ -0,0 +1,191 @@
+from __future__ import annotations
+from collections import Counter
+import re
+
+import numpy as np
+
+from src.komponenten.referenzdokumente.referenzdokumente_models import (
+    Zusammenfassung,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.tabellenformat import (
+    tabelle_serialisieren,
+)
+from src.komponenten.referenzdokumente.zusammenfassungsgenerator.textaufteilung import (
+    text_aufteilen,
+    tokens_zaehlen,
+)
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_models import (
+    Referenzabschnitt,
+    StrukturierteFrage,
+    ThemenKontext,
+)
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+# Übliche BM25-Parameter: Sättigung der Worthäufigkeit und Längennormierung
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Grobe Endungen, damit z.B. "Marke" und "Marken" auf denselben Stamm fallen
+ENDUNGEN = ("ern", "en", "er", "es", "e", "n", "s")
+
+
+def wortstamm(wort: str) -> str:
+    for endung in ENDUNGEN:
+        if len(wort) - len(endung) >= 4 and wort.endswith(endung):
+            return wort[: -len(endung)]
+    return wort
+
+
+def woerter(text: str) -> list[str]:
+    return [wortstamm(wort) for wort in re.findall(r"\w{2,}", text.lower())]
+
+
+def referenzabschnitte_bilden(
+    zusammenfassungen: list[Zusammenfassung], abschnitt_max_tokens: int
+) -> list[Referenzabschnitt]:
+    """Zerlegt Texte und Tabellen der Zusammenfassungen wie sie im Prompt stünden."""
+    abschnitte: list[Referenzabschnitt] = []
+
+    def hinzufuegen(kennung: str, quelle: str, art: str, inhalt: str):
+        for teil_nummer, teil in enumerate(
+            text_aufteilen(inhalt, abschnitt_max_tokens)
+        ):
+            if teil.strip():
+                abschnitte.append(
+                    Referenzabschnitt(
+                        id=f"{kennung}-{teil_nummer}",
+                        quelle=quelle,
+                        art=art,
+                        inhalt=teil,
+                        tokens=tokens_zaehlen(teil),
+                    )
+                )
+
+    for nummer, zusammenfassung in enumerate(zusammenfassungen):
+        quelle = zusammenfassung.referenzdokument.name
+        if zusammenfassung.text_zusammengefasst:
+            hinzufuegen(
+                f"{nummer}-text", quelle, "text", zusammenfassung.text_zusammengefasst
+            )
+
+        tabellen = zusammenfassung.tabellen_zusammengefasst or [
+            tabelle_serialisieren(
+                tabelle, zusammenfassung.zusammenfassung_auswahl.tabellenformat
+            )
+            for tabelle in zusammenfassung.tabellen_extrahiert or []
+        ]
+        for tabellen_nummer, tabelle in enumerate(tabellen):
+            hinzufuegen(
+                f"{nummer}-tabelle-{tabellen_nummer}", quelle, "tabelle", tabelle
+            )
+
+    return abschnitte
+
+
+def anfrage_fuer_kontext(frage: StrukturierteFrage, kontext: ThemenKontext) -> str:
+    """Fragetext und Themen des Kontexts, so wie sie im Prompt gestellt werden."""
+    teile = [kontext.text_gerendert, kontext.parent_thema_text or ""]
+    teile.extend(
+        k.child_thema_text or ""
+        for k in frage.themenkontexte
+        if k.text_gerendert == kontext.text_gerendert
+    )
+    return "\n".join(teile)
+
+
+class Referenzindex:
+    """
+    BM25 über die Abschnitte der Zusammenfassungen, einmal pro Lauf gebaut.
+
+    Die Gewichte liegen spaltenweise nach Wort sortiert (wie eine CSC-Matrix),
+    eine Anfrage summiert nur die Einträge ihrer Wörter.
+    """
+
+    def __init__(
+        self, zusammenfassungen: list[Zusammenfassung], abschnitt_max_tokens: int
+    ):
+        self.abschnitte = referenzabschnitte_bilden(
+            zusammenfassungen, abschnitt_max_tokens
+        )
+        self.vokabular: dict[str, int] = {}
+
+        abschnitt_indizes: list[int] = []
+        wort_indizes: list[int] = []
+        haeufigkeiten: list[int] = []
+        laengen = np.zeros(len(self.abschnitte))
+        for i, abschnitt in enumerate(self.abschnitte):
+            abschnitt_woerter = woerter(abschnitt.inhalt)
+            laengen[i] = len(abschnitt_woerter)
+            for wort, anzahl in Counter(abschnitt_woerter).items():
+                abschnitt_indizes.append(i)
+                wort_indizes.append(
+                    self.vokabular.setdefault(wort, len(self.vokabular))
+                )
+                haeufigkeiten.append(anzahl)
+
+        reihenfolge = np.argsort(np.array(wort_indizes, dtype=np.int64), kind="stable")
+        wort_indizes_sortiert = np.array(wort_indizes, dtype=np.int64)[reihenfolge]
+        self.abschnitt_indizes = np.array(abschnitt_indizes, dtype=np.int64)[
+            reihenfolge
+        ]
+        self.zeiger = np.searchsorted(
+            wort_indizes_sortiert, np.arange(len(self.vokabular) + 1)
+        )
+
+        anzahl = len(self.abschnitte)
+        dokumenthaeufigkeit = np.diff(self.zeiger)
+        idf = np.log1p(
+            (anzahl - dokumenthaeufigkeit + 0.5) / (dokumenthaeufigkeit + 0.5)
+        )
+        tf = np.array(haeufigkeiten, dtype=float)[reihenfolge]
+        normierung = BM25_K1 * (
+            1 - BM25_B + BM25_B * laengen / max(laengen.mean() if anzahl else 0, 1)
+        )
+        self.gewichte = (
+            idf[wort_indizes_sortiert]
+            * tf
+            * (BM25_K1 + 1)
+            / (tf + normierung[self.abschnitt_indizes])
+        )
+
+        log.info(
+            f"Referenzindex mit {anzahl} Abschnitten und {len(self.vokabular)} Wörtern gebaut"
+        )
+
+    def bewerten(self, anfrage: str) -> np.ndarray:
+        punkte = np.zeros(len(self.abschnitte))
+        for wort in set(woerter(anfrage)):
+            j = self.vokabular.get(wort)
+            if j is None:
+                continue
+            bereich = slice(self.zeiger[j], self.zeiger[j + 1])
+            # Jeder Abschnitt kommt pro Wort höchstens einmal vor
+            punkte[self.abschnitt_indizes[bereich]] += self.gewichte[bereich]
+        return punkte
+
+    def suchen(
+        self, anfrage: str, top_k: int, token_budget: int = 0
+    ) -> list[Referenzabschnitt]:
+        """
+        Die besten `top_k` Abschnitte, solange sie ins Token-Budget passen, in
+        der Reihenfolge der Zusammenfassungen. Ohne Treffer werden die ersten
+        Abschnitte genommen, damit die Frage nicht ganz ohne Referenzen bleibt.
+        """
+        punkte = self.bewerten(anfrage)
+        treffer = [i for i in np.argsort(-punkte, kind="stable") if punkte[i] > 0]
+        if not treffer:
+            treffer = list(range(len(self.abschnitte)))
+
+        ausgewaehlt: list[int] = []
+        tokens = 0
+        for i in treffer:
+            if len(ausgewaehlt) >= top_k:
+                break
+            if token_budget and tokens + self.abschnitte[i].tokens > token_budget:
+                continue
+            ausgewaehlt.append(i)
+            tokens += self.abschnitte[i].tokens
+
+        return [self.abschnitte[i] for i in sorted(ausgewaehlt)]
@@ -10,21 +10,23 @@ from src.komponenten.referenzdokumente.referenzdokumente_api import Referenzdoku
 from src.komponenten.referenzdokumente.referenzdokumente_models import (
     Zusammenfassung,
 )
-from src.komponenten.siliconsamplesgenerator.fragesteller.fragesteller import (
-    Fragesteller,
-)
 from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_api import (
     SiliconSamplesGeneratorAPI,
 )
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_jobs import (
+    worker_pool_im_hintergrund_starten,
+)
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_lauf import (
+    SiliconSamplesLauf,
+    personas_aus_dataframe,
+    unvollstaendige_laeufe,
+)
 from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_models import (
     SiliconSamples,
 )
 from src.komponenten.studienkonfiguration.studienkonfiguration_api import (
     StudienkonfigurationAPI,
 )
-from src.komponenten.studienkonfiguration.studienkonfigurationslader.studienkonfigurationslader import (
-    Studienkonfigurationslader,
-)
 from src.shared.dateien import (
     datei_lesen,
     datei_speichern,
@@ -33,10 +35,9 @@ from src.shared.dateien import (
     ordner_auslesen,
 )
 
-from src.shared.generator import Prompt, schicke_update_an_user
 from src.shared.llm_integrations.llm_provider import LLMProvider
 from src.shared.logger import get_logger
-from src.shared.status import Status
+from src.shared.status import Status, schicke_update_an_user
 
 log = get_logger(__name__)
 
@@ -46,6 +47,8 @@ config = api.config
 api_studienkonfiguration = StudienkonfigurationAPI()
 api_referenzdokumente = ReferenzdokumenteAPI()
 
+jobqueue = api.jobqueue()
+
 
 ##########
 ###
@@ -65,6 +68,9 @@ if f"{session_key}.fertig" not in st.session_state:
 if f"{session_key}.ergebnis" not in st.session_state:
     st.session_state[f"{session_key}.ergebnis"] = None
 
+if f"{session_key}.fortsetzen" not in st.session_state:
+    st.session_state[f"{session_key}.fortsetzen"] = None
+
 
 # Button Start
 def starten():
@@ -73,6 +79,12 @@ def starten():
     # Dann weiter mit rerun vom Button --> "if gestartet:" greift
 
 
+# Button Fortsetzen
+def fortsetzen(lauf_id: str):
+    starten()
+    st.session_state[f"{session_key}.fortsetzen"] = lauf_id
+
+
 # Button Abbruch
 def abbrechen():
     to_delete = [k for k in st.session_state.keys() if k.startswith(session_key + ".")]
@@ -86,6 +98,7 @@ def fertig(ergebnis: Any):
     st.session_state[f"{session_key}.gestartet"] = False
     st.session_state[f"{session_key}.fertig"] = True
     st.session_state[f"{session_key}.ergebnis"] = ergebnis
+    st.session_state[f"{session_key}.fortsetzen"] = None
     # Dann weiter mit manuellem Rerun
     st.rerun()
 
@@ -95,6 +108,7 @@ def reset():
     st.session_state[f"{session_key}.gestartet"] = False
     st.session_state[f"{session_key}.fertig"] = False
     st.session_state[f"{session_key}.ergebnis"] = None
+    st.session_state[f"{session_key}.fortsetzen"] = None
 
 
 # Status für Ergebnisanzeige
@@ -191,11 +205,8 @@ with st.sidebar:
 
 # Ergebnisse zeigen
 if prozess_fertig:
-    # Bisschen Spaß muss sein
-    st.balloons()
-
     # Nachricht anzeigen
-    st.success(api.text("erfolgsmeldung"))
+    st.success(api.text("job_eingereiht"))
 
     # Reset ohne Rerun
     reset()
@@ -212,9 +223,9 @@ tab1, tab2, tab3, tab4 = st.tabs(
 
 with tab2:
     df = pd.read_csv(personas_datei, sep=";")
+    prompt_data_personas = personas_aus_dataframe(df)
     df.index = df.index + 1
     table = st.dataframe(df)
-    prompt_data_personas = df.reset_index(names="index").to_dict("records")
 
 with tab3:
 
@@ -269,6 +280,14 @@ with tab1:
             placeholder="Anzahl angeben",
         )
 
+        parallelitaet = st.number_input(
+            api.text("parallelitaet"),
+            help=api.text("parallelitaet_beschreibung"),
+            value=api.parallelitaet,
+            min_value=1,
+            max_value=api.max_parallelitaet,
+        )
+
         personas_nutzen = st.toggle("Personas nutzen", value=True)
 
         llm_provider: LLMProvider = api.streamlit_llm_provider_auswahl()
@@ -295,6 +314,33 @@ with tab1:
                 width="stretch",
             )
 
+        # Läufe mit aktivem Job werden bereits von den Workern bearbeitet
+        laeufe_in_arbeit = {
+            job.lauf_id
+            for job in jobqueue.jobs()
+            if job.status in ("wartend", "laufend")
+        }
+        laeufe_offen = [
+            lauf_id
+            for lauf_id in unvollstaendige_laeufe(siliconsamples_ordner)
+            if lauf_id not in laeufe_in_arbeit
+        ]
+        if laeufe_offen:
+            with st.expander(api.text("fortsetzen_titel")):
+                lauf_fortsetzen = st.selectbox(
+                    api.text("fortsetzen_auswahl"),
+                    laeufe_offen,
+                    help=api.text("fortsetzen_beschreibung"),
+                )
+                st.button(
+                    api.text("fortsetzen_start_text"),
+                    on_click=fortsetzen,
+                    args=(lauf_fortsetzen,),
+                    icon=api.text("fortsetzen_start_icon"),
+                    disabled=st.session_state[f"{session_key}.gestartet"],
+                    width="stretch",
+                )
+
         if personas_nutzen:
             st.caption(
                 f"Es werden :blue-background[{wiederholungen} Silicon Samples mit Persona-Kontext] generiert. Die Personas werden aufsteigend iteriert. Wenn weniger Stichproben als Personas ausgewählt sind, werden nicht mit allen Personas Silicon Samples generiert. Wenn mehr Stichproben als Personas ausgewähl sind, werden die Personas wiederholt."
@@ -311,83 +357,89 @@ with tab1:
 
         if prozess_gestartet:
 
-            with st.spinner(api.text("spinner"), show_time=True):
-
-                fortschritt = st.progress(0)
-
-                startzeit = datetime.now()
-                startzeit_formatiert = startzeit.strftime("%Y_%m_%d-%H_%M_%S")
-
-                for aktuelle_wiederholung in range(0, wiederholungen):
-
-                    aktuelle_wiederholung_menschenfreundlich = aktuelle_wiederholung + 1
+            lauf_id_fortsetzen = st.session_state[f"{session_key}.fortsetzen"]
+            if lauf_id_fortsetzen:
+                # Eingaben stammen aus der Laufdatei
+                siliconsamples_lauf = SiliconSamplesLauf.fortsetzen(
+                    siliconsamples_ordner=siliconsamples_ordner,
+                    lauf_id=lauf_id_fortsetzen,
+                    llm_provider_handler=api.hole_llm_provider_handler(),
+                    parallelitaet=parallelitaet,
+                )
+            else:
+                siliconsamples_lauf = SiliconSamplesLauf(
+                    studienkonfiguration_datei=studienkonfiguration_datei,
+                    zusammenfassungen=zusammenfassungen,
+                    prompts={
+                        "fragen_intro_ohne_persona_mit_referenzen": prompt_intro_ohne_persona_mit_referenzdokumenten,
+                        "fragen_intro_ohne_persona_ohne_referenzen": prompt_intro_ohne_persona_ohne_referenzdokumente,
+                        "fragen_intro_mit_persona_mit_referenzen": prompt_intro_mit_persona_mit_referenzdokumenten,
+                        "fragen_intro_mit_persona_ohne_referenzen": prompt_intro_mit_persona_ohne_referenzdokumente,
+                    },
+                    personas=prompt_data_personas if personas_nutzen else None,
+                    anzahl_siliconsamples=wiederholungen,
+                    llm_provider=llm_provider,
+                    siliconsamples_ordner=siliconsamples_ordner,
+                    parallelitaet=parallelitaet,
+                    referenzauswahl=api.referenzauswahl,
+                    ausfuehrung=api.ausfuehrung,
+                )
+
+            # Generiert wird von den Worker-Prozessen, die Seite reiht nur ein
+            siliconsamples_lauf.laufkonfiguration_speichern()
+            job_id = jobqueue.job_einreihen(
+                siliconsamples_ordner=siliconsamples_lauf.siliconsamples_ordner,
+                lauf_id=siliconsamples_lauf.lauf_id,
+                wiederholungen=siliconsamples_lauf.offene_wiederholungen(),
+            )
 
-                    schicke_update_an_user(
-                        f"Silicon Sample {aktuelle_wiederholung_menschenfreundlich}/{wiederholungen} gestartet"
-                    )
+            schicke_update_an_user(
+                f"Job {job_id} für Lauf {siliconsamples_lauf.lauf_id} eingereiht"
+            )
 
-                    fortschritt.progress(
-                        (
-                            (aktuelle_wiederholung / wiederholungen)
-                            if aktuelle_wiederholung > 0
-                            else 0
-                        ),
-                        text=f"Aktuell generiertes Silicon Sample: {aktuelle_wiederholung_menschenfreundlich}",
+            fertig(ergebnis=None)
+
+        st.subheader(api.text("jobs_titel"))
+
+        @st.fragment(run_every=api.jobs_aktualisierung_sekunden)
+        def jobs_anzeigen():
+            jobs = jobqueue.jobs()
+            kapazitaet = jobqueue.aktive_worker(api.worker_timeout_sekunden)
+
+            if kapazitaet:
+                st.caption(api.text("worker_kapazitaet").format(kapazitaet=kapazitaet))
+            else:
+                st.warning(api.text("keine_worker"))
+                if st.button(
+                    api.text("worker_starten_text"),
+                    icon=api.text("worker_starten_icon"),
+                ):
+                    worker_pool_im_hintergrund_starten(
+                        jobqueue_datei=api.jobqueue_datei,
+                        prozesse=api.worker_prozesse,
+                        parallelitaet=parallelitaet,
                     )
 
-                    studienkonfigurationslader = Studienkonfigurationslader(
-                        studienkonfiguration_datei
-                    )
+            if not jobs:
+                st.write(api.text("keine_jobs"))
 
-                    fragesteller = Fragesteller(
-                        fragen=studienkonfigurationslader.fragen,
-                        zusammenfassungen=zusammenfassungen,
-                        prompt=Prompt(
-                            prompts={
-                                "fragen_intro_ohne_persona_mit_referenzen": prompt_intro_ohne_persona_mit_referenzdokumenten,
-                                "fragen_intro_ohne_persona_ohne_referenzen": prompt_intro_ohne_persona_ohne_referenzdokumente,
-                                "fragen_intro_mit_persona_mit_referenzen": prompt_intro_mit_persona_mit_referenzdokumenten,
-                                "fragen_intro_mit_persona_ohne_referenzen": prompt_intro_mit_persona_ohne_referenzdokumente,
-                            },
-                            prompt_data={
-                                "aktuelle_wiederholung": aktuelle_wiederholung,
-                                "personas_nutzen": personas_nutzen,
-                                "aktuelle_persona": (
-                                    api.hole_persona_fuer_wiederholung(
-                                        personas=prompt_data_personas,
-                                        wiederholung=aktuelle_wiederholung,
-                                    )
-                                    if personas_nutzen
-                                    else None
-                                ),
-                                "personas": (
-                                    prompt_data_personas if personas_nutzen else None
-                                ),
-                            },
+            for job in jobs:
+                with st.container(border=True):
+                    st.progress(
+                        (
+                            job.anzahl_fertig / job.anzahl_gesamt
+                            if job.anzahl_gesamt
+                            else 1.0
                         ),
-                        llm_provider=llm_provider,
+                        text=f"Lauf {job.lauf_id}: {job.status} ({job.anzahl_fertig}/{job.anzahl_gesamt}, {job.anzahl_laufend} laufend, {job.anzahl_fehler} Fehler)",
                     )
-
-                    siliconsamples = fragesteller.starten(
-                        streamlit_fortschritt=fortschritt
-                    )
-
-                    siliconsamples_dateiname = f"{api.komponenten_name}-{fragesteller.startzeit_formatiert()}-{aktuelle_wiederholung}.json"
-                    siliconsamples_dateipfad = (
-                        erstelle_dateipfad(
-                            ordnerpfad=siliconsamples_ordner,
-                            dateiname=startzeit_formatiert,
-                            mit_basepath=False,
+                    if job.status in ("wartend", "laufend"):
+                        st.button(
+                            api.text("job_abbrechen_text"),
+                            key=f"{session_key}.job_abbrechen.{job.id}",
+                            on_click=jobqueue.job_abbrechen,
+                            args=(job.id,),
+                            icon=api.text("job_abbrechen_icon"),
                         )
-                        / siliconsamples_dateiname
-                    )
-
-                    datei_speichern(
-                        dateipfad=siliconsamples_dateipfad, items=siliconsamples
-                    )
-
-                    schicke_update_an_user(
-                        f"Silicon Sample {aktuelle_wiederholung_menschenfreundlich}/{wiederholungen} generiert"
-                    )
 
-                fertig(ergebnis=None)
+        jobs_anzeigen()
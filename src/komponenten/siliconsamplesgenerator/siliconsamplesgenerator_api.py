@@ -1,7 +1,16 @@
 from typing import Any
 import pandas as pd
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_jobs import (
+    Jobqueue,
+)
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_lauf import (
+    DATEIPRAEFIX,
+    hole_persona_fuer_wiederholung,
+)
 from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_models import (
     Antwort,
+    Ausfuehrung,
+    Referenzauswahl,
     SiliconSamples,
 )
 from src.shared.dateien import (
@@ -11,6 +20,8 @@ from src.shared.dateien import (
     ordner_auslesen,
 )
 from src.shared.generator import (
+    cache_anteil,
+    cache_tokens_summieren,
     format_number,
     parse_chatverlauf,
     tokenverbrauch_summieren,
@@ -53,6 +64,32 @@ class SiliconSamplesGeneratorAPI(KomponentenAPI):
             dateiname="",
         )
 
+        self.parallelitaet: int = self.config.get("generierung", {}).get(
+            "parallelitaet", 1
+        )
+        self.max_parallelitaet: int = self.config.get("generierung", {}).get(
+            "max_parallelitaet", 256
+        )
+
+        self.referenzauswahl = Referenzauswahl.from_dict(
+            self.config.get("referenzauswahl", {})
+        )
+        self.ausfuehrung = Ausfuehrung.from_dict(self.config.get("ausfuehrung", {}))
+
+        jobs_config = self.config.get("jobs", {})
+        self.jobqueue_datei = erstelle_dateipfad(
+            ordnerpfad=jobs_config.get("datei", "Silicon-Samples/jobs.sqlite"),
+            dateiname="",
+        )
+        self.worker_prozesse: int = jobs_config.get("prozesse", 1)
+        self.worker_timeout_sekunden: float = jobs_config.get("timeout_sekunden", 120)
+        self.jobs_aktualisierung_sekunden: float = jobs_config.get(
+            "aktualisierung_sekunden", 2
+        )
+
+    def jobqueue(self) -> Jobqueue:
+        return Jobqueue(self.jobqueue_datei)
+
     def siliconsamples(self, dateipfad) -> SiliconSamples:
         return datei_lesen(dateipfad=dateipfad, json_datei=True, cls=SiliconSamples)
 
@@ -61,7 +98,11 @@ class SiliconSamplesGeneratorAPI(KomponentenAPI):
     ):
         siliconsamples: SiliconSamples = None
 
-        siliconsamples_dateien = ordner_auslesen(siliconsamples_ordner, "*.json")
+        siliconsamples_dateien = [
+            datei
+            for datei in ordner_auslesen(siliconsamples_ordner, "*.json")
+            if datei.name.startswith(f"{DATEIPRAEFIX}-")
+        ]
 
         if siliconsamples_dateien:
 
@@ -109,6 +150,16 @@ class SiliconSamplesGeneratorAPI(KomponentenAPI):
         persona_nutzen = prompt_data.get("personas_nutzen", False)
         col2.metric(self.text("persona"), persona_nutzen, border=True, width="content")
 
+        col3.metric(
+            self.text("cache_tokens"),
+            format_number(cache_tokens_summieren(siliconsamples.llm.tokenverbrauch)),
+            f"{cache_anteil(siliconsamples.llm.tokenverbrauch):.0%}",
+            delta_color="off",
+            help=self.text("cache_tokens_beschreibung"),
+            border=True,
+            width="content",
+        )
+
         if persona_nutzen:
             persona = prompt_data.get("aktuelle_persona", {})
 
@@ -159,6 +210,10 @@ class SiliconSamplesGeneratorAPI(KomponentenAPI):
             with st.expander(self.text("antworten")):
                 st.write(siliconsamples.antworten)
 
+            if siliconsamples.referenzabschnitte:
+                with st.expander(self.text("referenzabschnitte")):
+                    st.write(siliconsamples.referenzabschnitte)
+
             if persona_nutzen:
                 with st.expander(self.text("persona_details")):
                     st.write(persona)
@@ -274,8 +329,6 @@ class SiliconSamplesGeneratorAPI(KomponentenAPI):
     def hole_persona_fuer_wiederholung(
         self, personas: list[dict[str, Any]], wiederholung: int
     ):
-        persona: dict[str, Any] = None
-        if personas:
-            persona_index = wiederholung % len(personas)
-            persona = personas[persona_index]
-        return persona
+        return hole_persona_fuer_wiederholung(
+            personas=personas, wiederholung=wiederholung
+        )
@@ -0,0 +1,500 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_lauf import (
+    SiliconSamplesLauf,
+    checkpointer_oeffnen,
+)
+from src.shared.llm_integrations.llm_kontext_cache import kontext_cache_aufraeumen
+from src.shared.llm_integrations.llm_provider import LLMProviderHandler
+from src.shared.llm_integrations.llm_provider_standard import (
+    standard_llm_provider_handler,
+)
+from src.shared.logger import get_logger, setup_logging
+
+log = get_logger(__name__)
+
+# Status einer Aufgabe (= ein Silicon Sample eines Jobs)
+OFFEN = "offen"
+LAUFEND = "laufend"
+FERTIG = "fertig"
+FEHLER = "fehler"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    siliconsamples_ordner TEXT NOT NULL,
+    lauf_id TEXT NOT NULL,
+    erstellt REAL NOT NULL,
+    abgebrochen INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS aufgaben (
+    job_id TEXT NOT NULL REFERENCES jobs(id),
+    wiederholung INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    heartbeat REAL,
+    versuche INTEGER NOT NULL DEFAULT 0,
+    fehler TEXT,
+    PRIMARY KEY (job_id, wiederholung)
+);
+CREATE INDEX IF NOT EXISTS aufgaben_status ON aufgaben(status, heartbeat);
+CREATE TABLE IF NOT EXISTS worker (
+    id TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    parallelitaet INTEGER NOT NULL,
+    heartbeat REAL NOT NULL
+);
+"""
+
+
+@dataclass(frozen=True)
+class Job:
+    id: str
+    siliconsamples_ordner: str
+    lauf_id: str
+    erstellt: float
+    abgebrochen: bool
+    anzahl_gesamt: int
+    anzahl_fertig: int
+    anzahl_laufend: int
+    anzahl_fehler: int
+
+    @property
+    def status(self) -> str:
+        if self.abgebrochen:
+            return "abgebrochen"
+        if self.anzahl_fertig == self.anzahl_gesamt:
+            return FERTIG
+        if self.anzahl_fertig + self.anzahl_fehler == self.anzahl_gesamt:
+            return FEHLER
+        if self.anzahl_laufend or self.anzahl_fertig:
+            return LAUFEND
+        return "wartend"
+
+    @classmethod
+    def from_dict(cls, data) -> Job:
+        return cls(
+            id=data["id"],
+            siliconsamples_ordner=data["siliconsamples_ordner"],
+            lauf_id=data["lauf_id"],
+            erstellt=data["erstellt"],
+            abgebrochen=bool(data.get("abgebrochen", 0)),
+            anzahl_gesamt=data.get("anzahl_gesamt", 0),
+            anzahl_fertig=data.get("anzahl_fertig", 0) or 0,
+            anzahl_laufend=data.get("anzahl_laufend", 0) or 0,
+            anzahl_fehler=data.get("anzahl_fehler", 0) or 0,
+        )
+
+
+@dataclass(frozen=True)
+class Aufgabe:
+    job_id: str
+    siliconsamples_ordner: str
+    lauf_id: str
+    wiederholung: int
+
+
+class Jobqueue:
+    """
+    Persistente Warteschlange für Generierungsjobs in einer SQLite-Datei.
+    Die Oberfläche reiht Jobs ein, Worker-Prozesse holen sich einzelne
+    Silicon Samples als Aufgaben ab.
+    """
+
+    def __init__(self, dateipfad):
+        self.dateipfad = Path(dateipfad)
+        self.dateipfad.parent.mkdir(parents=True, exist_ok=True)
+        with self.verbinden() as verbindung:
+            verbindung.execute("PRAGMA journal_mode=WAL")
+            verbindung.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def verbinden(self):
+        # Autocommit: jede Anweisung ist für sich atomar
+        verbindung = sqlite3.connect(self.dateipfad, timeout=30, isolation_level=None)
+        verbindung.row_factory = sqlite3.Row
+        try:
+            yield verbindung
+        finally:
+            verbindung.close()
+
+    def job_einreihen(
+        self, siliconsamples_ordner, lauf_id: str, wiederholungen: list[int]
+    ) -> str:
+        job_id = uuid.uuid4().hex[:12]
+        with self.verbinden() as verbindung:
+            verbindung.execute("BEGIN IMMEDIATE")
+            verbindung.execute(
+                "INSERT INTO jobs (id, siliconsamples_ordner, lauf_id, erstellt) VALUES (?, ?, ?, ?)",
+                (job_id, str(siliconsamples_ordner), lauf_id, time.time()),
+            )
+            verbindung.executemany(
+                "INSERT INTO aufgaben (job_id, wiederholung, status) VALUES (?, ?, ?)",
+                [(job_id, wiederholung, OFFEN) for wiederholung in wiederholungen],
+            )
+            verbindung.execute("COMMIT")
+        log.info(
+            f"Job {job_id} für Lauf {lauf_id} eingereiht: {len(wiederholungen)} Silicon Samples"
+        )
+        return job_id
+
+    def job_abbrechen(self, job_id: str):
+        with self.verbinden() as verbindung:
+            verbindung.execute(
+                "UPDATE jobs SET abgebrochen = 1 WHERE id = ?", (job_id,)
+            )
+        log.info(f"Job {job_id} abgebrochen")
+
+    def jobs(self, limit: int = 50) -> list[Job]:
+        with self.verbinden() as verbindung:
+            zeilen = verbindung.execute(
+                """
+                SELECT j.*,
+                    COUNT(a.wiederholung) AS anzahl_gesamt,
+                    SUM(a.status = 'fertig') AS anzahl_fertig,
+                    SUM(a.status = 'laufend') AS anzahl_laufend,
+                    SUM(a.status = 'fehler') AS anzahl_fehler
+                FROM jobs j LEFT JOIN aufgaben a ON a.job_id = j.id
+                GROUP BY j.id ORDER BY j.erstellt DESC LIMIT ?
+                """,
+                (limit,),
+            ).fetchall()
+        return [Job.from_dict(dict(zeile)) for zeile in zeilen]
+
+    def aufgabe_holen(
+        self, worker_id: str, timeout_sekunden: float
+    ) -> Optional[Aufgabe]:
+        """
+        Reserviert die nächste offene Aufgabe. Laufende Aufgaben, deren Worker
+        sich nicht mehr gemeldet hat, werden neu vergeben.
+        """
+        jetzt = time.time()
+        with self.verbinden() as verbindung:
+            zeile = verbindung.execute(
+                """
+                UPDATE aufgaben
+                SET status = 'laufend', worker = ?, heartbeat = ?, versuche = versuche + 1
+                WHERE rowid = (
+                    SELECT a.rowid FROM aufgaben a JOIN jobs j ON j.id = a.job_id
+                    WHERE j.abgebrochen = 0
+                    AND (a.status = 'offen' OR (a.status = 'laufend' AND a.heartbeat < ?))
+                    ORDER BY j.erstellt, a.wiederholung LIMIT 1
+                )
+                RETURNING job_id, wiederholung
+                """,
+                (worker_id, jetzt, jetzt - timeout_sekunden),
+            ).fetchone()
+            if zeile is None:
+                return None
+            job = verbindung.execute(
+                "SELECT siliconsamples_ordner, lauf_id FROM jobs WHERE id = ?",
+                (zeile["job_id"],),
+            ).fetchone()
+        return Aufgabe(
+            job_id=zeile["job_id"],
+            siliconsamples_ordner=job["siliconsamples_ordner"],
+            lauf_id=job["lauf_id"],
+            wiederholung=zeile["wiederholung"],
+        )
+
+    def aufgabe_fertig(self, aufgabe: Aufgabe):
+        self._aufgabe_setzen(aufgabe, status=FERTIG, fehler=None)
+
+    def aufgabe_fehlgeschlagen(self, aufgabe: Aufgabe, fehler: str, max_versuche: int):
+        with self.verbinden() as verbindung:
+            verbindung.execute(
+                """
+                UPDATE aufgaben SET status = CASE WHEN versuche >= ? THEN 'fehler' ELSE 'offen' END,
+                    worker = NULL, fehler = ?
+                WHERE job_id = ? AND wiederholung = ?
+                """,
+                (max_versuche, fehler, aufgabe.job_id, aufgabe.wiederholung),
+            )
+
+    def aufgabe_freigeben(self, aufgabe: Aufgabe):
+        self._aufgabe_setzen(aufgabe, status=OFFEN, fehler=None)
+
+    def _aufgabe_setzen(self, aufgabe: Aufgabe, status: str, fehler: Optional[str]):
+        with self.verbinden() as verbindung:
+            verbindung.execute(
+                "UPDATE aufgaben SET status = ?, worker = NULL, fehler = ? WHERE job_id = ? AND wiederholung = ?",
+                (status, fehler, aufgabe.job_id, aufgabe.wiederholung),
+            )
+
+    def heartbeat(self, worker_id: str, parallelitaet: int) -> set[tuple[str, int]]:
+        """Meldet den Worker als aktiv und liefert seine Aufgaben aus abgebrochenen Jobs."""
+        jetzt = time.time()
+        with self.verbinden() as verbindung:
+            verbindung.execute(
+                "INSERT OR REPLACE INTO worker (id, host, pid, parallelitaet, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                (worker_id, socket.gethostname(), os.getpid(), parallelitaet, jetzt),
+            )
+            verbindung.execute(
+                "UPDATE aufgaben SET heartbeat = ? WHERE worker = ? AND status = 'laufend'",
+                (jetzt, worker_id),
+            )
+            zeilen = verbindung.execute(
+                """
+                SELECT a.job_id, a.wiederholung FROM aufgaben a JOIN jobs j ON j.id = a.job_id
+                WHERE a.worker = ? AND a.status = 'laufend' AND j.abgebrochen = 1
+                """,
+                (worker_id,),
+            ).fetchall()
+        return {(zeile["job_id"], zeile["wiederholung"]) for zeile in zeilen}
+
+    def worker_abmelden(self, worker_id: str):
+        with self.verbinden() as verbindung:
+            verbindung.execute("DELETE FROM worker WHERE id = ?", (worker_id,))
+
+    def aktive_worker(self, timeout_sekunden: float) -> int:
+        """Anzahl der gleichzeitig bearbeitbaren Silicon Samples aller aktiven Worker."""
+        with self.verbinden() as verbindung:
+            zeile = verbindung.execute(
+                "SELECT COALESCE(SUM(parallelitaet), 0) AS summe FROM worker WHERE heartbeat >= ?",
+                (time.time() - timeout_sekunden,),
+            ).fetchone()
+        return zeile["summe"]
+
+    def anzahl_offen(self) -> int:
+        with self.verbinden() as verbindung:
+            zeile = verbindung.execute("""
+                SELECT COUNT(*) AS anzahl FROM aufgaben a JOIN jobs j ON j.id = a.job_id
+                WHERE j.abgebrochen = 0 AND a.status IN ('offen', 'laufend')
+                """).fetchone()
+        return zeile["anzahl"]
+
+
+class Worker:
+    """
+    Bearbeitet Aufgaben aus der Jobqueue, bis zu `parallelitaet` gleichzeitig.
+    Läufe und ihre Checkpointer werden pro Worker nur einmal geöffnet.
+    """
+
+    def __init__(
+        self,
+        jobqueue: Jobqueue,
+        llm_provider_handler: LLMProviderHandler,
+        parallelitaet: int = 1,
+        heartbeat_sekunden: float = 10,
+        timeout_sekunden: float = 60,
+        max_versuche: int = 3,
+        leerlauf_sekunden: float = 2,
+        bis_leer: bool = False,
+    ):
+        self.jobqueue = jobqueue
+        self.llm_provider_handler = llm_provider_handler
+        self.parallelitaet = max(1, parallelitaet)
+        self.heartbeat_sekunden = heartbeat_sekunden
+        self.timeout_sekunden = timeout_sekunden
+        self.max_versuche = max_versuche
+        self.leerlauf_sekunden = leerlauf_sekunden
+        self.bis_leer = bis_leer
+
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+        self.laeufe: dict[tuple[str, str], SiliconSamplesLauf] = {}
+        self.checkpointer: dict[tuple[str, str], BaseCheckpointSaver] = {}
+        self.aktive: dict[tuple[str, int], asyncio.Task] = {}
+
+    def starten(self):
+        asyncio.run(self.astarten())
+
+    async def astarten(self):
+        log.info(
+            f"Worker {self.worker_id} gestartet ({self.parallelitaet} gleichzeitig)"
+        )
+        self.jobqueue.heartbeat(self.worker_id, self.parallelitaet)
+
+        self.laeufe_lock = asyncio.Lock()
+
+        async with contextlib.AsyncExitStack() as checkpointer_stack:
+            self.checkpointer_stack = checkpointer_stack
+            heartbeat = asyncio.create_task(self.heartbeat_senden())
+            try:
+                await asyncio.gather(
+                    *(self.aufgaben_bearbeiten() for _ in range(self.parallelitaet))
+                )
+            finally:
+                heartbeat.cancel()
+                for siliconsamples_lauf in self.laeufe.values():
+                    if siliconsamples_lauf.llm_runden is not None:
+                        await siliconsamples_lauf.llm_runden.schliessen()
+                self.jobqueue.worker_abmelden(self.worker_id)
+                # Worker-Prozesse enden ohne atexit, Kontext-Caches hier löschen
+                kontext_cache_aufraeumen()
+                log.info(f"Worker {self.worker_id} beendet")
+
+    async def heartbeat_senden(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_sekunden)
+            abgebrochen = await asyncio.to_thread(
+                self.jobqueue.heartbeat, self.worker_id, self.parallelitaet
+            )
+            for kennzahlen in self.llm_provider_handler.kennzahlen():
+                log.info(f"Worker {self.worker_id}: {kennzahlen.beschreibung()}")
+            for schluessel in abgebrochen:
+                generierung = self.aktive.get(schluessel)
+                if generierung is not None:
+                    log.info(
+                        f"Job {schluessel[0]} abgebrochen, Silicon Sample {schluessel[1]} wird beendet"
+                    )
+                    generierung.cancel()
+
+    async def lauf_holen(self, aufgabe: Aufgabe):
+        schluessel = (aufgabe.siliconsamples_ordner, aufgabe.lauf_id)
+        async with self.laeufe_lock:
+            if schluessel in self.laeufe:
+                return self.laeufe[schluessel], self.checkpointer[schluessel]
+
+            siliconsamples_lauf = SiliconSamplesLauf.fortsetzen(
+                siliconsamples_ordner=aufgabe.siliconsamples_ordner,
+                lauf_id=aufgabe.lauf_id,
+                llm_provider_handler=self.llm_provider_handler,
+            )
+            self.checkpointer[schluessel] = (
+                await self.checkpointer_stack.enter_async_context(
+                    checkpointer_oeffnen(siliconsamples_lauf.checkpoint_dateipfad())
+                )
+            )
+            self.laeufe[schluessel] = siliconsamples_lauf
+        return self.laeufe[schluessel], self.checkpointer[schluessel]
+
+    async def aufgaben_bearbeiten(self):
+        while True:
+            aufgabe = await asyncio.to_thread(
+                self.jobqueue.aufgabe_holen, self.worker_id, self.timeout_sekunden
+            )
+            if aufgabe is None:
+                if self.bis_leer and not self.aktive:
+                    return
+                await asyncio.sleep(self.leerlauf_sekunden)
+                continue
+
+            await self.aufgabe_bearbeiten(aufgabe)
+
+    async def aufgabe_bearbeiten(self, aufgabe: Aufgabe):
+        schluessel = (aufgabe.job_id, aufgabe.wiederholung)
+        try:
+            siliconsamples_lauf, checkpointer = await self.lauf_holen(aufgabe)
+
+            # Ein anderer Worker kann das Silicon Sample bereits gespeichert haben
+            if siliconsamples_lauf.siliconsamples_dateipfad(
+                aufgabe.wiederholung
+            ).is_file():
+                self.jobqueue.aufgabe_fertig(aufgabe)
+                return
+
+            generierung = asyncio.create_task(
+                siliconsamples_lauf.siliconsample_generieren(
+                    aufgabe.wiederholung, checkpointer
+                )
+            )
+            self.aktive[schluessel] = generierung
+            await generierung
+
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # Worker wird beendet, ein anderer Worker übernimmt die Aufgabe
+                self.jobqueue.aufgabe_freigeben(aufgabe)
+                raise
+            # Nur die Generierung wurde abgebrochen (Job abgebrochen)
+            self.jobqueue.aufgabe_freigeben(aufgabe)
+
+        except Exception as e:
+            log.exception(
+                f"Silicon Sample {aufgabe.wiederholung} aus Job {aufgabe.job_id} fehlgeschlagen"
+            )
+            self.jobqueue.aufgabe_fehlgeschlagen(
+                aufgabe, fehler=repr(e), max_versuche=self.max_versuche
+            )
+
+        else:
+            self.jobqueue.aufgabe_fertig(aufgabe)
+            log.info(
+                f"Silicon Sample {aufgabe.wiederholung} aus Job {aufgabe.job_id} generiert"
+            )
+
+        finally:
+            self.aktive.pop(schluessel, None)
+
+
+def worker_prozess(jobqueue_datei: str, worker_optionen: dict):
+    # Läuft in einem eigenen Prozess, Umgebung und Logging neu aufsetzen
+    load_dotenv()
+    setup_logging()
+
+    worker = Worker(
+        jobqueue=Jobqueue(jobqueue_datei),
+        llm_provider_handler=standard_llm_provider_handler(),
+        **worker_optionen,
+    )
+    try:
+        worker.starten()
+    except KeyboardInterrupt:
+        pass
+
+
+def worker_pool_starten(jobqueue_datei, prozesse: int, worker_optionen: dict):
+    """Startet `prozesse` Worker-Prozesse und wartet, bis alle beendet sind."""
+    kontext = multiprocessing.get_context("spawn")
+    pool = [
+        kontext.Process(
+            target=worker_prozess,
+            args=(str(jobqueue_datei), worker_optionen),
+            name=f"ssg-worker-{nummer}",
+        )
+        for nummer in range(max(1, prozesse))
+    ]
+    for prozess in pool:
+        prozess.start()
+    log.info(f"{len(pool)} Worker-Prozesse gestartet")
+
+    try:
+        for prozess in pool:
+            prozess.join()
+    except KeyboardInterrupt:
+        log.info("Worker-Prozesse werden beendet")
+        for prozess in pool:
+            prozess.join(timeout=30)
+            if prozess.is_alive():
+                prozess.terminate()
+
+
+def worker_pool_im_hintergrund_starten(
+    jobqueue_datei, prozesse: int, parallelitaet: int
+):
+    """Startet den Worker-Pool losgelöst von der Streamlit-Session über das CLI."""
+    subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "ssg",
+            "worker",
+            "--jobqueue",
+            str(jobqueue_datei),
+            "--prozesse",
+            str(prozesse),
+            "--parallelitaet",
+            str(parallelitaet),
+        ],
+        start_new_session=True,
+    )
+    log.info(f"{prozesse} Worker-Prozesse im Hintergrund gestartet")
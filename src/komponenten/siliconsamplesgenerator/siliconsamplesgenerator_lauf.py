@@ -0,0 +1,485 @@
+from __future__ import annotations
+import asyncio
+import contextlib
+from datetime import datetime
+from functools import cached_property
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator
+
+import aiosqlite
+from langchain_core.messages.ai import add_usage
+import pandas as pd
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from src.komponenten.referenzdokumente.referenzdokumente_models import (
+    Referenzdokument,
+    Tabelle,
+    Zusammenfassung,
+    ZusammenfassungAuswahl,
+)
+from src.komponenten.siliconsamplesgenerator.fragesteller.fragesteller import (
+    FragenintroCache,
+    Fragesteller,
+)
+from src.komponenten.siliconsamplesgenerator.fragesteller.referenzindex import (
+    Referenzindex,
+)
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_models import (
+    Ausfuehrung,
+    Laufkonfiguration,
+    Referenzabschnitt,
+    Referenzauswahl,
+    Shard,
+    Shardbericht,
+    SiliconSamples,
+    StrukturierteFrage,
+    ThemenKontext,
+)
+from src.komponenten.studienkonfiguration.studienkonfigurationslader.models import (
+    Frage,
+    Option,
+    Thema,
+)
+from src.komponenten.studienkonfiguration.studienkonfigurationslader.studienkonfigurationslader import (
+    Studienkonfigurationslader,
+)
+from src.shared.dateien import datei_lesen, datei_speichern, erstelle_dateipfad
+from src.shared.generator import (
+    LLM,
+    LLMChatverlauf,
+    LLMTokenverbrauch,
+    Prompt,
+    cache_anteil,
+    cache_tokens_summieren,
+    format_number,
+    synchron_iterieren,
+)
+from src.shared.llm_integrations.llm_batch import (
+    Batchspeicher,
+    LLMBatchausfuehrung,
+    LLMSchrittausfuehrung,
+    LLMRunden,
+)
+from src.shared.llm_integrations.llm_provider import LLMProvider, LLMProviderHandler
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+# Schlüssel der Intro-Prompts, wie sie der Fragesteller erwartet
+PROMPT_NAMEN = [
+    "fragen_intro_ohne_persona_mit_referenzen",
+    "fragen_intro_ohne_persona_ohne_referenzen",
+    "fragen_intro_mit_persona_mit_referenzen",
+    "fragen_intro_mit_persona_ohne_referenzen",
+]
+
+DATEIPRAEFIX = "siliconsamplesgenerator"
+
+# Liegen im Lauf-Ordner neben den Silicon Samples
+LAUFDATEI = "lauf.json"
+CHECKPOINTDATEI = "checkpoints.sqlite"
+BATCHDATEI = "batches.sqlite"
+MANIFESTDATEI = "manifest.json"
+
+# Eigene Typen im Graph-State, die aus den Checkpoints gelesen werden dürfen
+CHECKPOINT_TYPEN = [
+    (typ.__module__, typ.__name__)
+    for typ in (
+        StrukturierteFrage,
+        ThemenKontext,
+        Frage,
+        Option,
+        Thema,
+        Zusammenfassung,
+        Referenzdokument,
+        ZusammenfassungAuswahl,
+        Tabelle,
+        Referenzabschnitt,
+        Prompt,
+        LLM,
+        LLMChatverlauf,
+        LLMTokenverbrauch,
+    )
+]
+
+
+def lade_personas(personas_datei) -> list[dict[str, Any]]:
+    return personas_aus_dataframe(pd.read_csv(personas_datei, sep=";"))
+
+
+def personas_aus_dataframe(df: pd.DataFrame) -> list[dict[str, Any]]:
+    # Personas werden ab 1 durchnummeriert, wie in der Oberfläche angezeigt
+    df = df.copy()
+    df.index = df.index + 1
+    return df.reset_index(names="index").to_dict("records")
+
+
+def hole_persona_fuer_wiederholung(
+    personas: list[dict[str, Any]], wiederholung: int
+) -> dict[str, Any]:
+    persona: dict[str, Any] = None
+    if personas:
+        persona_index = wiederholung % len(personas)
+        persona = personas[persona_index]
+    return persona
+
+
+def lade_prompts(prompts_ordner, prompt_dateien: dict[str, str]) -> dict[str, str]:
+    """Liest die Intro-Prompts, prompt_dateien bildet Prompt-Name -> Dateiname ab."""
+    return {
+        prompt_name: datei_lesen(
+            erstelle_dateipfad(
+                ordnerpfad=prompts_ordner, dateiname=dateiname, mit_basepath=False
+            )
+        )
+        for prompt_name, dateiname in prompt_dateien.items()
+    }
+
+
+@contextlib.asynccontextmanager
+async def checkpointer_oeffnen(dateipfad) -> AsyncIterator[AsyncSqliteSaver]:
+    # Mehrere Worker-Prozesse können auf dieselbe Datei zugreifen
+    async with aiosqlite.connect(str(dateipfad), timeout=30) as verbindung:
+        yield AsyncSqliteSaver(
+            verbindung,
+            serde=JsonPlusSerializer(allowed_msgpack_modules=CHECKPOINT_TYPEN),
+        )
+
+
+def unvollstaendige_laeufe(siliconsamples_ordner) -> list[str]:
+    """Lauf-IDs im Ordner, bei denen noch Silicon Samples fehlen."""
+    lauf_ids: list[str] = []
+    for laufdatei in sorted(Path(siliconsamples_ordner).glob(f"*/{LAUFDATEI}")):
+        laufkonfiguration: Laufkonfiguration = datei_lesen(
+            laufdatei, json_datei=True, cls=Laufkonfiguration
+        )
+        anzahl_vorhanden = len(
+            list(
+                laufdatei.parent.glob(
+                    f"{DATEIPRAEFIX}-{laufkonfiguration.lauf_id}-*.json"
+                )
+            )
+        )
+        if anzahl_vorhanden < laufkonfiguration.anzahl_siliconsamples:
+            lauf_ids.append(laufkonfiguration.lauf_id)
+    return lauf_ids
+
+
+class SiliconSamplesLauf:
+    """
+    Generiert mehrere Silicon Samples ohne Streamlit, z.B. für die Oberfläche,
+    das CLI oder Skripte. Jedes Silicon Sample wird als eigene Datei gespeichert.
+
+    Der Lauf ist fortsetzbar: Die Eingaben liegen in der Laufdatei, fertige
+    Silicon Samples werden übersprungen und halb befragte Silicon Samples setzen
+    über den Checkpointer am letzten abgeschlossenen Schritt wieder an.
+    """
+
+    def __init__(
+        self,
+        studienkonfiguration_datei,
+        zusammenfassungen: list[Zusammenfassung],
+        prompts: dict[str, str],
+        personas: list[dict[str, Any]] | None,
+        anzahl_siliconsamples: int,
+        llm_provider: LLMProvider,
+        siliconsamples_ordner,
+        parallelitaet: int = 1,
+        lauf_id: str | None = None,
+        shard: Shard | None = None,
+        referenzauswahl: Referenzauswahl | None = None,
+        ausfuehrung: Ausfuehrung | None = None,
+    ):
+        self.studienkonfiguration_datei = studienkonfiguration_datei
+        self.zusammenfassungen = zusammenfassungen
+        self.prompts = prompts
+        self.personas = personas
+        self.anzahl_siliconsamples = anzahl_siliconsamples
+        self.llm_provider = llm_provider
+        self.siliconsamples_ordner = siliconsamples_ordner
+        self.parallelitaet = max(1, parallelitaet)
+        self.shard = shard
+        self.referenzauswahl = referenzauswahl or Referenzauswahl()
+        self.ausfuehrung = ausfuehrung or Ausfuehrung()
+
+        self.startzeit = datetime.now()
+        self.lauf_id = lauf_id or self.startzeit.strftime("%Y_%m_%d-%H_%M_%S")
+
+        # Die Fragen sind unveränderlich und werden nur einmal pro Lauf geladen
+        self.fragen = Studienkonfigurationslader(studienkonfiguration_datei).fragen
+
+        self.fragenintro_cache = FragenintroCache()
+        # Verbrauch der in diesem Prozess generierten Silicon Samples
+        self.tokenverbrauch: dict[str, LLMTokenverbrauch] = {}
+
+    @classmethod
+    def fortsetzen(
+        cls,
+        siliconsamples_ordner,
+        lauf_id: str,
+        llm_provider_handler: LLMProviderHandler,
+        parallelitaet: int | None = None,
+        shard: Shard | None = None,
+    ) -> SiliconSamplesLauf:
+        """Lädt einen abgebrochenen Lauf mit den ursprünglichen Eingaben."""
+        laufdatei = erstelle_dateipfad(
+            ordnerpfad=Path(siliconsamples_ordner) / lauf_id,
+            dateiname=LAUFDATEI,
+            mit_basepath=False,
+        )
+        laufkonfiguration: Laufkonfiguration = datei_lesen(
+            laufdatei, json_datei=True, cls=Laufkonfiguration
+        )
+        return cls(
+            studienkonfiguration_datei=laufkonfiguration.studienkonfiguration_datei,
+            zusammenfassungen=laufkonfiguration.zusammenfassungen,
+            prompts=laufkonfiguration.prompts,
+            personas=laufkonfiguration.personas,
+            anzahl_siliconsamples=laufkonfiguration.anzahl_siliconsamples,
+            llm_provider=llm_provider_handler.hole_provider(
+                model=laufkonfiguration.model
+            ),
+            siliconsamples_ordner=siliconsamples_ordner,
+            parallelitaet=parallelitaet or laufkonfiguration.parallelitaet,
+            lauf_id=laufkonfiguration.lauf_id,
+            shard=shard,
+            referenzauswahl=laufkonfiguration.referenzauswahl,
+            ausfuehrung=laufkonfiguration.ausfuehrung,
+        )
+
+    @property
+    def personas_nutzen(self) -> bool:
+        return self.personas is not None
+
+    def lauf_ordner(self) -> Path:
+        return erstelle_dateipfad(
+            ordnerpfad=self.siliconsamples_ordner,
+            dateiname=self.lauf_id,
+            mit_basepath=False,
+        )
+
+    def siliconsamples_dateipfad(self, wiederholung: int) -> Path:
+        return self.lauf_ordner() / f"{DATEIPRAEFIX}-{self.lauf_id}-{wiederholung}.json"
+
+    def laufkonfiguration(self) -> Laufkonfiguration:
+        return Laufkonfiguration(
+            lauf_id=self.lauf_id,
+            studienkonfiguration_datei=str(self.studienkonfiguration_datei),
+            zusammenfassungen=self.zusammenfassungen,
+            prompts=self.prompts,
+            personas=self.personas,
+            anzahl_siliconsamples=self.anzahl_siliconsamples,
+            model=self.llm_provider.aktives_model,
+            parallelitaet=self.parallelitaet,
+            referenzauswahl=self.referenzauswahl,
+            ausfuehrung=self.ausfuehrung,
+        )
+
+    def laufkonfiguration_speichern(self):
+        # Beim Fortsetzen bleibt die ursprüngliche Laufdatei erhalten
+        laufdatei = self.lauf_ordner() / LAUFDATEI
+        if not laufdatei.is_file():
+            datei_speichern(dateipfad=laufdatei, items=self.laufkonfiguration())
+
+    def checkpoint_dateipfad(self) -> Path:
+        # Pro Shard eine eigene Datei, damit Rechner sich keine SQLite-Datei teilen
+        if self.shard is None:
+            return self.lauf_ordner() / CHECKPOINTDATEI
+        return self.lauf_ordner() / f"checkpoints-{self.shard.name}.sqlite"
+
+    def batch_dateipfad(self) -> Path:
+        if self.shard is None:
+            return self.lauf_ordner() / BATCHDATEI
+        return self.lauf_ordner() / f"batches-{self.shard.name}.sqlite"
+
+    def wiederholungen(self) -> list[int]:
+        """Wiederholungen dieses Laufs bzw. des Shards."""
+        if self.shard is None:
+            return list(range(0, self.anzahl_siliconsamples))
+        anzahl_personas = len(self.personas) if self.personas_nutzen else 0
+        return [
+            wiederholung
+            for wiederholung in range(0, self.anzahl_siliconsamples)
+            if self.shard.enthaelt(
+                wiederholung, self.anzahl_siliconsamples, anzahl_personas
+            )
+        ]
+
+    def offene_wiederholungen(self) -> list[int]:
+        return [
+            wiederholung
+            for wiederholung in self.wiederholungen()
+            if not self.siliconsamples_dateipfad(wiederholung).is_file()
+        ]
+
+    def anzahl_vorhanden(self) -> int:
+        return len(self.wiederholungen()) - len(self.offene_wiederholungen())
+
+    def shardbericht_speichern(self):
+        zugeteilt = self.wiederholungen()
+        offen = set(self.offene_wiederholungen())
+        datei_speichern(
+            dateipfad=self.lauf_ordner() / f"{self.shard.name}.json",
+            items=Shardbericht(
+                lauf_id=self.lauf_id,
+                shard=self.shard,
+                zugeteilt=zugeteilt,
+                fertig=[w for w in zugeteilt if w not in offen],
+            ),
+        )
+
+    @cached_property
+    def referenzindex(self) -> Referenzindex | None:
+        # Einmal pro Lauf, alle Befragten suchen im selben Index
+        if not self.referenzauswahl.aktiv or not self.zusammenfassungen:
+            return None
+        return Referenzindex(
+            self.zusammenfassungen,
+            abschnitt_max_tokens=self.referenzauswahl.abschnitt_max_tokens,
+        )
+
+    @cached_property
+    def llm_runden(self) -> LLMRunden | None:
+        """Im Batch- und Schritt-Modus teilen sich alle Befragten des Prozesses die Runden."""
+        if self.ausfuehrung.modus == "schritt":
+            return LLMRunden(
+                LLMSchrittausfuehrung(
+                    self.llm_provider,
+                    max_gleichzeitig=self.ausfuehrung.max_gleichzeitig,
+                )
+            )
+        if self.ausfuehrung.modus != "batch":
+            return None
+        return LLMRunden(
+            LLMBatchausfuehrung(
+                self.llm_provider,
+                Batchspeicher(self.batch_dateipfad()),
+                abfrage_sekunden=self.ausfuehrung.abfrage_sekunden,
+            )
+        )
+
+    def fragesteller_erstellen(
+        self, wiederholung: int, checkpointer: BaseCheckpointSaver | None = None
+    ) -> Fragesteller:
+        return Fragesteller(
+            fragen=self.fragen,
+            zusammenfassungen=self.zusammenfassungen,
+            prompt=Prompt(
+                prompts=self.prompts,
+                prompt_data={
+                    "aktuelle_wiederholung": wiederholung,
+                    "personas_nutzen": self.personas_nutzen,
+                    "aktuelle_persona": (
+                        hole_persona_fuer_wiederholung(
+                            personas=self.personas, wiederholung=wiederholung
+                        )
+                        if self.personas_nutzen
+                        else None
+                    ),
+                    "personas": self.personas,
+                },
+            ),
+            llm_provider=self.llm_provider,
+            checkpointer=checkpointer,
+            befragten_id=f"{self.lauf_id}-{wiederholung}",
+            referenzindex=self.referenzindex,
+            referenzauswahl=self.referenzauswahl,
+            fragenintro_cache=self.fragenintro_cache,
+            llm_runden=self.llm_runden,
+        )
+
+    async def siliconsample_generieren(
+        self, wiederholung: int, checkpointer: BaseCheckpointSaver | None = None
+    ) -> SiliconSamples:
+        fragesteller = self.fragesteller_erstellen(wiederholung, checkpointer)
+        async with (
+            self.llm_runden.teilnehmen()
+            if self.llm_runden is not None
+            else contextlib.nullcontext()
+        ):
+            siliconsamples = await fragesteller.astarten(streamlit_fortschritt=None)
+
+        datei_speichern(
+            dateipfad=self.siliconsamples_dateipfad(wiederholung),
+            items=siliconsamples,
+        )
+
+        for model, verbrauch in siliconsamples.llm.tokenverbrauch.items():
+            self.tokenverbrauch[model] = add_usage(
+                self.tokenverbrauch.get(model), verbrauch
+            )
+
+        # Das Silicon Sample ist gespeichert, die Checkpoints werden nicht mehr gebraucht
+        if checkpointer is not None:
+            for thread_id in fragesteller.kontext_thread_ids:
+                await checkpointer.adelete_thread(thread_id)
+
+        return siliconsamples
+
+    async def agenerieren(self) -> AsyncIterator[tuple[int, SiliconSamples]]:
+        """
+        Liefert (Wiederholung, Silicon Sample), sobald ein Sample fertig ist.
+        Bereits gespeicherte Silicon Samples werden übersprungen.
+        """
+        offene_wiederholungen = self.offene_wiederholungen()
+        lauf_name = (
+            f"{self.lauf_id} ({self.shard.name})" if self.shard else self.lauf_id
+        )
+        log.info(
+            f"Lauf {lauf_name}: {len(offene_wiederholungen)} von {len(self.wiederholungen())} Silicon Samples offen, {self.parallelitaet} gleichzeitig ({self.ausfuehrung.modus})"
+        )
+
+        self.laufkonfiguration_speichern()
+
+        async with checkpointer_oeffnen(self.checkpoint_dateipfad()) as checkpointer:
+
+            semaphore = asyncio.Semaphore(self.parallelitaet)
+
+            async def mit_semaphore(wiederholung: int):
+                async with semaphore:
+                    return wiederholung, await self.siliconsample_generieren(
+                        wiederholung, checkpointer
+                    )
+
+            aufgaben = [
+                asyncio.create_task(mit_semaphore(wiederholung))
+                for wiederholung in offene_wiederholungen
+            ]
+
+            try:
+                for aufgabe in asyncio.as_completed(aufgaben):
+                    yield await aufgabe
+            finally:
+                # Bei Abbruch durch den Aufrufer keine verwaisten Befragten zurücklassen
+                for aufgabe in aufgaben:
+                    aufgabe.cancel()
+                await asyncio.gather(*aufgaben, return_exceptions=True)
+                if self.llm_runden is not None:
+                    await self.llm_runden.schliessen()
+
+                # Für das Zusammenführen festhalten, was dieser Shard geliefert hat
+                if self.shard is not None:
+                    self.shardbericht_speichern()
+
+                if self.tokenverbrauch:
+                    log.info(self.prompt_cache_beschreibung())
+
+    def generieren(self) -> Iterator[tuple[int, SiliconSamples]]:
+        return synchron_iterieren(self.agenerieren())
+
+    def prompt_cache_beschreibung(self) -> str:
+        input_tokens = sum(
+            v.get("input_tokens", 0) for v in self.tokenverbrauch.values()
+        )
+        return (
+            f"Lauf {self.lauf_id}: {format_number(cache_tokens_summieren(self.tokenverbrauch))} "
+            f"von {format_number(input_tokens)} Input-Tokens aus dem Prompt-Cache "
+            f"({cache_anteil(self.tokenverbrauch):.0%})"
+        )
+
+    def durchsatz(self, anzahl_fertig: int) -> float:
+        """Silicon Samples pro Minute seit Start des Laufs."""
+        sekunden = (datetime.now() - self.startzeit).total_seconds()
+        return anzahl_fertig / sekunden * 60 if sekunden > 0 else 0.0
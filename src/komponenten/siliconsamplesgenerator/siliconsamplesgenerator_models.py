@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional, Tuple
 from langgraph.graph import MessagesState
 from src.komponenten.referenzdokumente.referenzdokumente_models import (
@@ -103,6 +103,80 @@ class StrukturierteFrage:
     rohe_frage: Frage
 
 
+@dataclass(frozen=True)
+class Referenzauswahl:
+    """
+    Wie viel der Zusammenfassungen eine Frage im Prompt bekommt und wo sie
+    stehen. Mit top_k = 0 stehen wie bisher alle Zusammenfassungen
+    vollständig im Prompt.
+    """
+
+    top_k: int = 0
+    token_budget: int = 0  # 0 = ohne Grenze
+    abschnitt_max_tokens: int = 300
+    # Referenzen vor dem Intro: gleicher Prompt-Anfang für alle Personas,
+    # damit das Prompt-Caching der Provider greift
+    referenzen_zuerst: bool = False
+
+    @property
+    def aktiv(self) -> bool:
+        return self.top_k > 0
+
+    @classmethod
+    def from_dict(cls, data) -> Referenzauswahl:
+        return cls(
+            top_k=data.get("top_k", 0),
+            token_budget=data.get("token_budget", 0),
+            abschnitt_max_tokens=data.get("abschnitt_max_tokens", 300),
+            referenzen_zuerst=data.get("referenzen_zuerst", False),
+        )
+
+
+AUSFUEHRUNGSMODI = ("direkt", "batch", "schritt")
+
+
+@dataclass(frozen=True)
+class Ausfuehrung:
+    """
+    Wie die LLM-Aufrufe eines Laufs ausgeführt werden.
+
+    - direkt: jeder Befragte ruft das Modell selbst auf
+    - batch: die Befragten rücken in Runden vor, jede Runde ist ein Job der
+      Batch-API des Providers (günstiger, aber mit Wartezeit pro Runde)
+    - schritt: die Befragten rücken im Gleichschritt vor, jeder Schritt geht
+      sofort über `abatch` des Chat-Modells
+    """
+
+    modus: str = "direkt"
+    # Abstand der Statusabfragen eines Batch-Jobs
+    abfrage_sekunden: float = 30
+    # Gleichzeitige Anfragen eines Schritts
+    max_gleichzeitig: int = 16
+
+    def __post_init__(self):
+        if self.modus not in AUSFUEHRUNGSMODI:
+            raise ValueError(
+                f"Unbekannte Ausführung: {self.modus}. Verfügbar: {", ".join(AUSFUEHRUNGSMODI)}"
+            )
+
+    @classmethod
+    def from_dict(cls, data) -> Ausfuehrung:
+        return cls(
+            modus=data.get("modus", "direkt"),
+            abfrage_sekunden=data.get("abfrage_sekunden", 30),
+            max_gleichzeitig=data.get("max_gleichzeitig", 16),
+        )
+
+
+@dataclass(frozen=True)
+class Referenzabschnitt:
+    id: str  # Zusammenfassung-Art-Nummer-Abschnitt, z.B. "1-tabelle-2-0"
+    quelle: str  # Name des Referenzdokuments
+    art: str  # "text" | "tabelle"
+    inhalt: str
+    tokens: int
+
+
 class SiliconSampleState(MessagesState):
     frage: StrukturierteFrage  # gesamte Frage (für Optionen etc.)
     kontext: ThemenKontext  # genau EIN Kontext (pro Graph-Run)
@@ -110,6 +184,10 @@ class SiliconSampleState(MessagesState):
     aktueller_kontext_key: Optional[str]  # bisher verarbeiteter Kontext-Key
     letzter_kontext_key: Optional[str]  # bisher verarbeiteter Kontext-Key
     zusammenfassungen: list[Zusammenfassung]
+    # None: alle Zusammenfassungen vollständig in den Prompt
+    referenzabschnitte: Optional[list[Referenzabschnitt]]
+    # Referenzen im Kontext-Cache des Providers statt im Fragenintro
+    referenzkontext: Optional[str]
     antworten: dict[str, str]
 
 
@@ -120,6 +198,8 @@ class SiliconSamples:
     antworten: dict[str, Antwort]
     prompt: Prompt
     llm: Optional[LLM]
+    # IDs der Referenzabschnitte je Themenkontext, leer ohne Referenzauswahl
+    referenzabschnitte: dict[str, list[str]] = field(default_factory=dict)
 
     @classmethod
     def from_dict(cls, data) -> SiliconSamples:
@@ -151,4 +231,168 @@ class SiliconSamples:
             antworten=antworten,
             prompt=prompt,
             llm=llm,
+            referenzabschnitte=data.get("referenzabschnitte", {}),
+        )
+
+
+@dataclass(frozen=True)
+class Laufkonfiguration:
+    """Eingaben eines Laufs, damit er nach einem Abbruch fortgesetzt werden kann."""
+
+    lauf_id: str
+    studienkonfiguration_datei: str
+    zusammenfassungen: list[Zusammenfassung]
+    prompts: dict[str, str]
+    personas: Optional[list[dict]]
+    anzahl_siliconsamples: int
+    model: str
+    parallelitaet: int
+    # Ältere Läufe ohne Angabe behalten beim Fortsetzen ihre vollständigen Prompts
+    referenzauswahl: Referenzauswahl = field(default_factory=Referenzauswahl)
+    ausfuehrung: Ausfuehrung = field(default_factory=Ausfuehrung)
+
+    @classmethod
+    def from_dict(cls, data) -> Laufkonfiguration:
+        return cls(
+            lauf_id=data["lauf_id"],
+            studienkonfiguration_datei=data["studienkonfiguration_datei"],
+            zusammenfassungen=[
+                Zusammenfassung.from_dict(item)
+                for item in data.get("zusammenfassungen", [])
+            ],
+            prompts=data.get("prompts", {}),
+            personas=data.get("personas", None),
+            anzahl_siliconsamples=data["anzahl_siliconsamples"],
+            model=data["model"],
+            parallelitaet=data.get("parallelitaet", 1),
+            referenzauswahl=Referenzauswahl.from_dict(data.get("referenzauswahl", {})),
+            ausfuehrung=Ausfuehrung.from_dict(data.get("ausfuehrung", {})),
+        )
+
+
+SHARD_STRATEGIEN = ("modulo", "personas")
+
+
+@dataclass(frozen=True)
+class Shard:
+    """
+    Deterministischer Teil eines Laufs, damit ein Lauf auf mehrere Rechner
+    verteilt werden kann. Die Nummer zählt ab 1.
+
+    - modulo: Wiederholung modulo Anzahl der Shards
+    - personas: zusammenhängender Bereich der Personas (ohne Personas: der Wiederholungen)
+    """
+
+    nummer: int
+    anzahl: int
+    strategie: str = "modulo"
+
+    def __post_init__(self):
+        if not 1 <= self.nummer <= self.anzahl:
+            raise ValueError(f"Ungültiger Shard: {self.nummer}/{self.anzahl}")
+        if self.strategie not in SHARD_STRATEGIEN:
+            raise ValueError(
+                f"Unbekannte Shard-Strategie: {self.strategie}. Verfügbar: {", ".join(SHARD_STRATEGIEN)}"
+            )
+
+    @property
+    def name(self) -> str:
+        return f"shard-{self.nummer}-von-{self.anzahl}"
+
+    def enthaelt(
+        self, wiederholung: int, anzahl_siliconsamples: int, anzahl_personas: int
+    ) -> bool:
+        if self.strategie == "modulo":
+            return wiederholung % self.anzahl == self.nummer - 1
+
+        # Bereich über die Persona-Indizes, damit jede Persona auf genau einem Shard liegt
+        if anzahl_personas:
+            # Nur die tatsächlich genutzten Personas aufteilen
+            index = wiederholung % anzahl_personas
+            anzahl_gesamt = min(anzahl_personas, anzahl_siliconsamples)
+        else:
+            index, anzahl_gesamt = wiederholung, anzahl_siliconsamples
+        start = (self.nummer - 1) * anzahl_gesamt // self.anzahl
+        ende = self.nummer * anzahl_gesamt // self.anzahl
+        return start <= index < ende
+
+    @classmethod
+    def aus_text(cls, text: str, strategie: str = "modulo") -> Shard:
+        """Liest einen Shard im Format "Nummer/Anzahl", z.B. "2/4"."""
+        try:
+            nummer, anzahl = (int(teil) for teil in text.split("/"))
+        except ValueError as e:
+            raise ValueError(
+                f"Ungültiger Shard: {text}. Erwartet wird Nummer/Anzahl, z.B. 2/4"
+            ) from e
+        return cls(nummer=nummer, anzahl=anzahl, strategie=strategie)
+
+    @classmethod
+    def from_dict(cls, data) -> Shard:
+        return cls(
+            nummer=data["nummer"],
+            anzahl=data["anzahl"],
+            strategie=data.get("strategie", "modulo"),
+        )
+
+
+@dataclass(frozen=True)
+class Shardbericht:
+    """Welche Wiederholungen einem Shard zugeteilt waren und welche fertig sind."""
+
+    lauf_id: str
+    shard: Shard
+    zugeteilt: list[int]
+    fertig: list[int]
+
+    @classmethod
+    def from_dict(cls, data) -> Shardbericht:
+        return cls(
+            lauf_id=data["lauf_id"],
+            shard=Shard.from_dict(data["shard"]),
+            zugeteilt=list(data.get("zugeteilt", [])),
+            fertig=list(data.get("fertig", [])),
+        )
+
+
+@dataclass(frozen=True)
+class ManifestEintrag:
+    wiederholung: int
+    datei: str
+    sha256: str
+
+    @classmethod
+    def from_dict(cls, data) -> ManifestEintrag:
+        return cls(
+            wiederholung=data["wiederholung"],
+            datei=data["datei"],
+            sha256=data["sha256"],
+        )
+
+
+@dataclass(frozen=True)
+class Laufmanifest:
+    """Ergebnis des Zusammenführens aller Shards eines Laufs."""
+
+    lauf_id: str
+    anzahl_siliconsamples: int
+    vollstaendig: bool
+    shards: list[str]
+    siliconsamples: list[ManifestEintrag]
+    fehlend: list[int]
+    doppelt: list[int]
+
+    @classmethod
+    def from_dict(cls, data) -> Laufmanifest:
+        return cls(
+            lauf_id=data["lauf_id"],
+            anzahl_siliconsamples=data["anzahl_siliconsamples"],
+            vollstaendig=data.get("vollstaendig", False),
+            shards=list(data.get("shards", [])),
+            siliconsamples=[
+                ManifestEintrag.from_dict(item)
+                for item in data.get("siliconsamples", [])
+            ],
+            fehlend=list(data.get("fehlend", [])),
+            doppelt=list(data.get("doppelt", [])),
         )
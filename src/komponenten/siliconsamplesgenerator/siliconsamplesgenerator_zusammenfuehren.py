@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+from dataclasses import asdict
+import hashlib
+import json
+import os
+import shutil
+from collections import defaultdict
+from pathlib import Path
+
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_lauf import (
+    DATEIPRAEFIX,
+    LAUFDATEI,
+    MANIFESTDATEI,
+)
+from src.komponenten.siliconsamplesgenerator.siliconsamplesgenerator_models import (
+    Laufkonfiguration,
+    Laufmanifest,
+    ManifestEintrag,
+    Shardbericht,
+)
+from src.shared.dateien import datei_lesen, datei_speichern
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+class LaufkonfigurationKonflikt(Exception):
+    """Die Shards gehören nicht zum selben Lauf (unterschiedliche Eingaben)."""
+
+
+def datei_hash(dateipfad: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(dateipfad, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def laufeingaben_hash(laufdateien: list[Path]) -> dict[Path, str]:
+    """
+    Hash der Eingaben, die die Silicon Samples bestimmen. Parallelität,
+    Ausführung und der Pfad der Studienkonfiguration dürfen sich je Rechner
+    unterscheiden, verglichen wird der Inhalt der Studienkonfiguration. Fehlt
+    sie hier, lassen sich die Shards nicht vergleichen.
+    """
+    hashes: dict[Path, str] = {}
+    for laufdatei in laufdateien:
+        with open(laufdatei, encoding="utf-8") as f:
+            d = json.load(f)
+        laufkonfiguration = Laufkonfiguration.from_dict(d)
+        studienkonfiguration = Path(d["studienkonfiguration_datei"])
+        if not studienkonfiguration.is_file():
+            raise LaufkonfigurationKonflikt(
+                f"Studienkonfiguration {studienkonfiguration} aus {laufdatei} fehlt, die Shards lassen sich nicht vergleichen"
+            )
+        eingaben = {
+            "lauf_id": laufkonfiguration.lauf_id,
+            "studienkonfiguration": datei_hash(studienkonfiguration),
+            "zusammenfassungen": d.get("zusammenfassungen", []),
+            "prompts": laufkonfiguration.prompts,
+            "personas": laufkonfiguration.personas,
+            "anzahl_siliconsamples": laufkonfiguration.anzahl_siliconsamples,
+            "model": laufkonfiguration.model,
+            "referenzauswahl": asdict(laufkonfiguration.referenzauswahl),
+        }
+        hashes[laufdatei] = hashlib.sha256(
+            json.dumps(eingaben, sort_keys=True, ensure_ascii=False).encode()
+        ).hexdigest()
+    return hashes
+
+
+def wiederholung_aus_dateiname(dateipfad: Path) -> int:
+    # siliconsamplesgenerator-<lauf_id>-<wiederholung>.json, die Lauf-ID kann "-" enthalten
+    return int(dateipfad.stem.rsplit("-", 1)[1])
+
+
+def lauf_ordner_finden(quelle, lauf_id: str) -> Path:
+    """Eine Quelle ist ein Lauf-Ordner oder ein Silicon-Samples-Ordner mit dem Lauf darin."""
+    quelle = Path(quelle)
+    if (quelle / lauf_id).is_dir():
+        return quelle / lauf_id
+    return quelle
+
+
+def datei_kopieren(quelle: Path, ziel: Path):
+    # Erst temporär kopieren, damit ein abgebrochenes Zusammenführen keine halbe Datei hinterlässt
+    tmp_ziel = ziel.with_name(f".{ziel.name}.tmp")
+    shutil.copyfile(quelle, tmp_ziel)
+    os.replace(tmp_ziel, ziel)
+
+
+def shards_zusammenfuehren(
+    siliconsamples_ordner, lauf_id: str, quellen
+) -> Laufmanifest:
+    """
+    Führt die Ausgaben mehrerer Shards im Lauf-Ordner zusammen und schreibt das
+    Laufmanifest. Mehrfaches Zusammenführen liefert dasselbe Ergebnis; fehlende
+    und widersprüchlich doppelte Wiederholungen stehen im Manifest.
+    """
+    ziel_ordner = Path(siliconsamples_ordner) / lauf_id
+    ziel_ordner.mkdir(parents=True, exist_ok=True)
+
+    # Der Ziel-Ordner zählt selbst als Quelle, so bleibt ein erneuter Aufruf stabil
+    lauf_ordner: list[Path] = [ziel_ordner]
+    for quelle in quellen:
+        ordner = lauf_ordner_finden(quelle, lauf_id)
+        if ordner.resolve() not in {o.resolve() for o in lauf_ordner}:
+            lauf_ordner.append(ordner)
+
+    # Alle Shards müssen mit denselben Eingaben gelaufen sein
+    laufdateien = [o / LAUFDATEI for o in lauf_ordner if (o / LAUFDATEI).is_file()]
+    if not laufdateien:
+        raise FileNotFoundError(f"Keine {LAUFDATEI} für Lauf {lauf_id} gefunden")
+    if len(laufdateien) > 1 and len(set(laufeingaben_hash(laufdateien).values())) > 1:
+        raise LaufkonfigurationKonflikt(
+            f"Die Shards wurden mit unterschiedlichen Eingaben gestartet: {", ".join(str(d) for d in laufdateien)}"
+        )
+    if not (ziel_ordner / LAUFDATEI).is_file():
+        datei_kopieren(laufdateien[0], ziel_ordner / LAUFDATEI)
+    laufkonfiguration: Laufkonfiguration = datei_lesen(
+        ziel_ordner / LAUFDATEI, json_datei=True, cls=Laufkonfiguration
+    )
+
+    # Silicon Samples je Wiederholung einsammeln
+    kandidaten: dict[int, dict[str, Path]] = defaultdict(dict)
+    for ordner in lauf_ordner:
+        for dateipfad in sorted(ordner.glob(f"{DATEIPRAEFIX}-{lauf_id}-*.json")):
+            kandidaten[wiederholung_aus_dateiname(dateipfad)].setdefault(
+                datei_hash(dateipfad), dateipfad
+            )
+
+    # Shardberichte einsammeln, überlappende Zuteilungen deuten auf falsche Shard-Parameter
+    shardberichte: dict[str, Shardbericht] = {}
+    for ordner in lauf_ordner:
+        for dateipfad in sorted(ordner.glob("shard-*-von-*.json")):
+            shardbericht: Shardbericht = datei_lesen(
+                dateipfad, json_datei=True, cls=Shardbericht
+            )
+            shardberichte.setdefault(shardbericht.shard.name, shardbericht)
+            if not (ziel_ordner / dateipfad.name).is_file():
+                datei_kopieren(dateipfad, ziel_ordner / dateipfad.name)
+
+    zuteilungen: dict[int, set[str]] = defaultdict(set)
+    for name, shardbericht in shardberichte.items():
+        for wiederholung in shardbericht.zugeteilt:
+            zuteilungen[wiederholung].add(name)
+
+    doppelt = sorted(
+        {w for w, hashes in kandidaten.items() if len(hashes) > 1}
+        | {w for w, namen in zuteilungen.items() if len(namen) > 1}
+    )
+
+    eintraege: list[ManifestEintrag] = []
+    for wiederholung in sorted(kandidaten):
+        hashes = kandidaten[wiederholung]
+        if len(hashes) > 1:
+            log.warning(
+                f"Wiederholung {wiederholung} liegt in unterschiedlichen Fassungen vor: {", ".join(str(p) for p in hashes.values())}"
+            )
+            continue
+
+        sha256, dateipfad = next(iter(hashes.items()))
+        ziel = ziel_ordner / dateipfad.name
+        if not ziel.is_file():
+            datei_kopieren(dateipfad, ziel)
+        eintraege.append(
+            ManifestEintrag(wiederholung=wiederholung, datei=ziel.name, sha256=sha256)
+        )
+
+    fehlend = [
+        wiederholung
+        for wiederholung in range(0, laufkonfiguration.anzahl_siliconsamples)
+        if wiederholung not in kandidaten
+    ]
+    ausserhalb = sorted(
+        w for w in kandidaten if w >= laufkonfiguration.anzahl_siliconsamples
+    )
+    if ausserhalb:
+        log.warning(f"Wiederholungen außerhalb des Laufs: {ausserhalb}")
+
+    laufmanifest = Laufmanifest(
+        lauf_id=lauf_id,
+        anzahl_siliconsamples=laufkonfiguration.anzahl_siliconsamples,
+        vollstaendig=not fehlend and not doppelt,
+        shards=sorted(shardberichte),
+        siliconsamples=eintraege,
+        fehlend=fehlend,
+        doppelt=doppelt,
+    )
+    datei_speichern(dateipfad=ziel_ordner / MANIFESTDATEI, items=laufmanifest)
+
+    log.info(
+        f"Lauf {lauf_id} zusammengeführt: {len(eintraege)}/{laufkonfiguration.anzahl_siliconsamples} Silicon Samples, {len(fehlend)} fehlend, {len(doppelt)} doppelt"
+    )
+    return laufmanifest
@@ -1,17 +1,28 @@
+from functools import cache
 import json
 import os
 from pathlib import Path
 import platform
-import streamlit as st
+
+from dotenv import dotenv_values
 
 from src.shared.logger import get_logger
 
 log = get_logger(__name__)
 
 
+@cache
+def basepath_holen() -> str:
+    # Wie in der Oberfläche hat die .env des Projekts Vorrang, die Umgebung
+    # greift nur, wenn dort nichts steht (z.B. CLI ohne .env)
+    return dotenv_values(".env").get("BASEPATH_FILES") or os.getenv(
+        "BASEPATH_FILES", ""
+    )
+
+
 def erstelle_dateipfad(ordnerpfad, dateiname, mit_basepath=True) -> Path:
     if mit_basepath:
-        basepath = st.session_state["config"]["dotenv"]["BASEPATH_FILES"]
+        basepath = basepath_holen()
         basepath = os.path.join(basepath, "")
         ordnerpfad = basepath + ordnerpfad
     return Path(ordnerpfad) / dateiname
@@ -66,8 +77,11 @@ def datei_lesen(dateipfad: Path, json_datei=False, cls=None) -> str:
 
 def datei_speichern(dateipfad: Path, items: list) -> None:
     dateipfad.parent.mkdir(parents=True, exist_ok=True)
-    with open(dateipfad, "w", encoding="utf-8") as f:
+    # Erst temporär schreiben, damit nach einem Abbruch keine halbe Datei liegen bleibt
+    tmp_dateipfad = dateipfad.with_name(f".{dateipfad.name}.tmp")
+    with open(tmp_dateipfad, "w", encoding="utf-8") as f:
         json.dump(items, f, default=lambda o: o.__dict__, ensure_ascii=False, indent=4)
+    os.replace(tmp_dateipfad, dateipfad)
 
 
 def datei_erstellungsdatum(dateipfad):
@@ -1,13 +1,24 @@
 from __future__ import annotations
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
 from dataclasses import dataclass
+import queue
+import threading
 from datetime import datetime
 from typing import Any
+import uuid
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
 from langgraph.graph import StateGraph
 from langchain_core.callbacks import UsageMetadataCallbackHandler
 from langchain_core.messages import AIMessage
-from langchain_core.messages.ai import UsageMetadata
-import streamlit as st
+from langchain_core.messages.ai import UsageMetadata, add_usage
+from langchain_core.outputs import ChatGeneration, LLMResult
 
+from src.shared.llm_integrations.llm_antwort_cache import antwort_cache_holen
+from src.shared.llm_integrations.llm_batch import LLMRunden, anfrage_schluessel
+from src.shared.llm_integrations.llm_kontext_cache import kontext_einfuegen
 from src.shared.llm_integrations.llm_provider import LLMProvider
 from src.shared.logger import get_logger
 
@@ -21,23 +32,35 @@ class LLMGenerator:
         llm_provider: LLMProvider,
         state_class: Any,
         thread_prefix,
+        checkpointer: BaseCheckpointSaver | None = None,
     ):
         self.prompt = prompt
         self.llm_provider = llm_provider
         self.state_class = state_class
         self.thread_prefix = thread_prefix
 
+        # Ohne persistenten Checkpointer bleibt der Zustand nur im Speicher
+        self.checkpointer = checkpointer or InMemorySaver()
+
         self.graph = StateGraph(self.state_class)
 
         self.llm_callback = UsageMetadataCallbackHandler()
 
         self.startzeit = datetime.now()
 
+        # Sekundengenaue Startzeit reicht bei parallelen Läufen nicht zur Unterscheidung
+        self.thread_suffix = uuid.uuid4().hex[:8]
+
+        # Weitere Objekte für die Nodes, z.B. prozessweite Caches eines Laufs
+        self.graph_daten: dict[str, Any] = {}
+
     def startzeit_formatiert(self):
         return self.startzeit.strftime("%Y%m%d-%H%M%S")
 
     def thread_id(self):
-        return f"{self.thread_prefix}-{self.startzeit_formatiert()}"
+        return (
+            f"{self.thread_prefix}-{self.startzeit_formatiert()}-{self.thread_suffix}"
+        )
 
     def llm_config_holen(self) -> dict:
         """
@@ -83,32 +106,100 @@ class LLMGenerator:
         return clean
 
     def aufrufen(
-        self, state, streamlit_fortschritt, run_name: str, reset_tokenverbrauch=False
+        self,
+        state,
+        streamlit_fortschritt,
+        run_name: str,
+        reset_tokenverbrauch=False,
+        thread_id: str | None = None,
+    ):
+        return synchron_ausfuehren(
+            self.aufrufen_async(
+                state=state,
+                streamlit_fortschritt=streamlit_fortschritt,
+                run_name=run_name,
+                reset_tokenverbrauch=reset_tokenverbrauch,
+                thread_id=thread_id,
+            )
+        )
+
+    async def aufrufen_async(
+        self,
+        state,
+        streamlit_fortschritt,
+        run_name: str,
+        reset_tokenverbrauch=False,
+        thread_id: str | None = None,
+        llm_callback: UsageMetadataCallbackHandler | None = None,
     ):
+        """
+        Mit eigener thread_id wird der Graph-Lauf über den Checkpointer fortsetzbar:
+        Ein abgeschlossener Thread liefert sein gespeichertes Ergebnis, ein
+        unterbrochener Thread läuft ab dem letzten Checkpoint weiter.
+        Ein eigener `llm_callback` zählt den Verbrauch gleichzeitiger Läufe getrennt.
+        """
         log.info("LLM-Aufruf gestartet")
 
         if reset_tokenverbrauch:
             self.llm_callback = UsageMetadataCallbackHandler()
-
-        out = self.graph.invoke(
-            state,
-            config={
-                "run_name": run_name,
-                "configurable": {
-                    "llm_provider": self.llm_provider,
-                    "thread_id": self.thread_id(),
-                    "streamlit_fortschritt": streamlit_fortschritt,
-                    "prompt": self.prompt,
-                    "tokenverbrauch": self.llm_tokenverbrauch(),
-                },
-                "callbacks": [self.llm_callback],
+        llm_callback = llm_callback or self.llm_callback
+
+        config = {
+            "run_name": run_name,
+            "configurable": {
+                "llm_provider": self.llm_provider,
+                "thread_id": thread_id or self.thread_id(),
+                "streamlit_fortschritt": streamlit_fortschritt,
+                "prompt": self.prompt,
+                "tokenverbrauch": self.llm_tokenverbrauch(llm_callback),
+                **self.graph_daten,
             },
-        )
+            "callbacks": [llm_callback],
+        }
+
+        if thread_id is not None:
+            checkpoint = await self.graph.aget_state(config)
+            if checkpoint.values:
+                # Verbrauch aus früheren Prozessen gehört zum Ergebnis dazu
+                self.tokenverbrauch_uebernehmen(
+                    checkpoint.values.get("messages", []), llm_callback
+                )
+
+                if not checkpoint.next:
+                    log.info(f"Thread {thread_id} bereits abgeschlossen")
+                    return checkpoint.values
+
+                log.info(
+                    f"Thread {thread_id} wird bei {", ".join(checkpoint.next)} fortgesetzt"
+                )
+                state = None
+
+        out = await self.graph.ainvoke(state, config=config)
         log.info("LLM-Aufruf beendet")
         return out
 
-    def llm_tokenverbrauch(self) -> dict[str, LLMTokenverbrauch]:
+    def tokenverbrauch_uebernehmen(
+        self,
+        messages: list[Any],
+        llm_callback: UsageMetadataCallbackHandler | None = None,
+    ):
+        """Rechnet den Verbrauch gespeicherter AI-Nachrichten in den Tokenverbrauch ein."""
+        llm_callback = llm_callback or self.llm_callback
+        for message in messages:
+            if not isinstance(message, AIMessage) or not message.usage_metadata:
+                continue
+            model = message.response_metadata.get("model_name")
+            if not model:
+                continue
+            llm_callback.usage_metadata[model] = add_usage(
+                llm_callback.usage_metadata.get(model), message.usage_metadata
+            )
+
+    def llm_tokenverbrauch(
+        self, llm_callback: UsageMetadataCallbackHandler | None = None
+    ) -> dict[str, LLMTokenverbrauch]:
         # Summiert automatisch alle Verbrauche auf
+        llm_callback = llm_callback or self.llm_callback
         tokenverbraeuche: dict[str, LLMTokenverbrauch] = {
             key: LLMTokenverbrauch.from_dict(
                 {
@@ -119,14 +210,60 @@ class LLMGenerator:
                     "output_token_details": value.get("output_token_details", {}) or {},
                 }
             )
-            for key, value in self.llm_callback.usage_metadata.items()
+            for key, value in llm_callback.usage_metadata.items()
         }
         return tokenverbraeuche
 
 
-def schicke_update_an_user(text):
-    log.info(text)
-    st.toast(text, duration="infinite")
+def synchron_ausfuehren(coroutine):
+    """
+    Führt eine Coroutine aus synchronem Code aus (z.B. Streamlit-Seiten).
+    Läuft im aktuellen Thread bereits eine Event-Loop, wird ein eigener Thread genutzt.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def synchron_iterieren(async_iterator):
+    """
+    Macht einen async Iterator aus synchronem Code konsumierbar.
+    Die Event-Loop läuft in einem eigenen Thread, Elemente werden weitergereicht,
+    sobald sie fertig sind.
+    """
+    ende = object()
+    warteschlange: queue.Queue = queue.Queue()
+    abbruch = threading.Event()
+
+    async def konsumieren():
+        try:
+            async with contextlib.aclosing(async_iterator) as elemente:
+                async for element in elemente:
+                    warteschlange.put((element, None))
+                    if abbruch.is_set():
+                        break
+        except Exception as e:
+            warteschlange.put((ende, e))
+            return
+        warteschlange.put((ende, None))
+
+    thread = threading.Thread(target=asyncio.run, args=(konsumieren(),), daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            element, fehler = warteschlange.get()
+            if fehler is not None:
+                raise fehler
+            if element is ende:
+                return
+            yield element
+    finally:
+        abbruch.set()
 
 
 def hole_llm_provider_aus_graph(config) -> LLMProvider:
@@ -139,6 +276,60 @@ def hole_llm_instanz_aus_graph(config):
     return llm_provider.hole_instanz(model=llm_provider.aktives_model)
 
 
+async def llm_aufrufen_async(
+    config, messages: list[Any], kontext: str | None = None
+) -> AIMessage:
+    """
+    Zentraler LLM-Aufruf aus Graph-Knoten, inklusive Antwort-Cache und Ratenbegrenzung.
+    `kontext` ist der für alle Aufrufe gleiche Teil, den der Provider cachen darf.
+    Mit `llm_runden` in den Graph-Daten geht der Aufruf in die nächste Runde.
+    """
+    llm_provider: LLMProvider = hole_llm_provider_aus_graph(config)
+    llm_runden: LLMRunden | None = hole_graph_daten("llm_runden", config)
+
+    if llm_runden is not None:
+        # Runden gehen gesammelt an den Provider, der Kontext wird dort eingesetzt
+        schluessel = anfrage_schluessel(
+            thread_id=config.get("configurable", {}).get("thread_id", ""),
+            model=llm_provider.aktives_model,
+            parameter=llm_provider.parameter,
+            messages=(
+                messages if kontext is None else kontext_einfuegen(messages, kontext)
+            ),
+        )
+
+        async def aufrufen():
+            response = await llm_runden.aufrufen(schluessel, messages, kontext)
+            llm_verbrauch_melden(config, response)
+            return response
+
+    else:
+        aufrufen = lambda: llm_provider.aufrufen_async(messages, kontext=kontext)
+
+    antwort_cache = antwort_cache_holen()
+    if antwort_cache is None or not antwort_cache.cachebar(llm_provider.parameter):
+        return await aufrufen()
+
+    return await antwort_cache.antwort_holen(
+        model=llm_provider.aktives_model,
+        parameter=llm_provider.parameter,
+        # Die Antwort hängt nicht davon ab, ob der Kontext gecacht war
+        messages=messages if kontext is None else kontext_einfuegen(messages, kontext),
+        aufrufen=aufrufen,
+        uebernehmen=llm_runden is None,
+    )
+
+
+def llm_verbrauch_melden(config, response: AIMessage):
+    """Aufrufe außerhalb des Knotens (z.B. in Runden) zählen wie eigene LLM-Aufrufe."""
+    callbacks = config.get("callbacks")
+    for handler in getattr(callbacks, "handlers", callbacks) or []:
+        if isinstance(handler, UsageMetadataCallbackHandler):
+            handler.on_llm_end(
+                LLMResult(generations=[[ChatGeneration(message=response)]])
+            )
+
+
 def parse_llm_content(response: AIMessage, config):
     llm_provider: LLMProvider = hole_llm_provider_aus_graph(config)
     return llm_provider.parse_content(response=response)
@@ -160,6 +351,23 @@ def tokenverbrauch_summieren(tokenverbrauch: dict[str, LLMTokenverbrauch]) -> in
     return anzahl_token
 
 
+def cache_tokens_summieren(tokenverbrauch: dict[str, LLMTokenverbrauch]) -> int:
+    """Input-Tokens, die der Provider aus seinem Prompt-Cache gelesen hat."""
+    anzahl_token = 0
+
+    for key, value in tokenverbrauch.items():
+        anzahl_token += (value.get("input_token_details") or {}).get("cache_read", 0)
+
+    return anzahl_token
+
+
+def cache_anteil(tokenverbrauch: dict[str, LLMTokenverbrauch]) -> float:
+    input_tokens = sum(v.get("input_tokens", 0) for v in tokenverbrauch.values())
+    return (
+        cache_tokens_summieren(tokenverbrauch) / input_tokens if input_tokens else 0.0
+    )
+
+
 def format_number(n: int) -> str:
     return f"{n:,}".replace(",", ".")
 
@@ -175,6 +383,10 @@ def hole_prompt_aus_graph(prompt_name: str, config, prompt_data: dict[str, Any]
     return prompt_template.format_map(SafeDict(prompt_data))
 
 
+def hole_graph_daten(name: str, config):
+    return config.get("configurable", {}).get(name, None)
+
+
 def hole_prompt_data_aus_graph(prompt_data_name, config):
     prompt: Prompt = config.get("configurable", {}).get("prompt", {})
     prompt_data: dict[str, str] = prompt.prompt_data
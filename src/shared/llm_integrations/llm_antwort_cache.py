@@ -0,0 +1,280 @@
+from __future__ import annotations
+import asyncio
+import contextlib
+import hashlib
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable
+
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import (
+    AIMessage,
+    convert_to_messages,
+    message_to_dict,
+    messages_from_dict,
+)
+
+from src.shared.dateien import erstelle_dateipfad
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+# Schlüssel in input/output_token_details für Tokens, die der Cache eingespart hat
+ANTWORT_CACHE = "antwort_cache"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS antworten (
+    schluessel TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    antwort TEXT NOT NULL,
+    groesse INTEGER NOT NULL,
+    erstellt REAL NOT NULL,
+    genutzt REAL NOT NULL,
+    treffer INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS antworten_genutzt ON antworten(genutzt);
+"""
+
+
+def content_normalisieren(content: Any) -> Any:
+    # Content-Blöcke enthalten teils wechselnde Extras (z.B. Signaturen von Gemini)
+    if isinstance(content, list):
+        return [
+            block.get("text", block) if isinstance(block, dict) else block
+            for block in content
+        ]
+    return content
+
+
+def cache_schluessel(model: str, parameter: dict[str, Any], messages: list[Any]) -> str:
+    inhalt = {
+        "model": model,
+        "parameter": parameter,
+        "messages": [
+            {
+                "type": message.type,
+                "content": content_normalisieren(message.content),
+                "tool_calls": getattr(message, "tool_calls", None) or None,
+            }
+            for message in convert_to_messages(messages)
+        ],
+    }
+    return hashlib.sha256(
+        json.dumps(inhalt, sort_keys=True, default=str, ensure_ascii=False).encode()
+    ).hexdigest()
+
+
+def treffer_message(antwort: AIMessage) -> AIMessage:
+    """Kopie der Antwort, deren Verbrauch nur als eingespart verbucht wird."""
+    usage_metadata = antwort.usage_metadata or {}
+    return antwort.model_copy(
+        update={
+            "usage_metadata": {
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "total_tokens": 0,
+                "input_token_details": {
+                    ANTWORT_CACHE: usage_metadata.get("input_tokens", 0)
+                },
+                "output_token_details": {
+                    ANTWORT_CACHE: usage_metadata.get("output_tokens", 0)
+                },
+            },
+            "response_metadata": {
+                **antwort.response_metadata,
+                ANTWORT_CACHE: True,
+            },
+        }
+    )
+
+
+class LLMAntwortCache:
+    """
+    Persistenter Cache für Antworten deterministischer LLM-Aufrufe (SQLite).
+    Gleichzeitige identische Anfragen einer Event-Loop werden zu einem Aufruf
+    zusammengefasst. Treffer laufen als Aufruf eines Fake-Modells durch die
+    Callbacks, damit der Tokenverbrauch sie (ohne Kosten) sieht.
+    """
+
+    def __init__(
+        self,
+        dateipfad,
+        max_groesse_mb: float = 500,
+        max_alter_tage: float = 30,
+        nur_deterministisch: bool = True,
+    ):
+        self.dateipfad = Path(dateipfad)
+        self.dateipfad.parent.mkdir(parents=True, exist_ok=True)
+        self.max_groesse = int(max_groesse_mb * 1024 * 1024)
+        self.max_alter = max_alter_tage * 24 * 60 * 60
+        self.nur_deterministisch = nur_deterministisch
+        self.einstellungen = {
+            "dateipfad": dateipfad,
+            "max_groesse_mb": max_groesse_mb,
+            "max_alter_tage": max_alter_tage,
+            "nur_deterministisch": nur_deterministisch,
+        }
+
+        self._laufend: dict[tuple[asyncio.AbstractEventLoop, str], asyncio.Future] = {}
+        self._schreibvorgaenge = 0
+        self._lock = threading.Lock()
+        self._initialisiert = False
+
+    @contextlib.contextmanager
+    def verbinden(self):
+        verbindung = sqlite3.connect(self.dateipfad, timeout=30, isolation_level=None)
+        try:
+            if not self._initialisiert:
+                with self._lock:
+                    if not self._initialisiert:
+                        verbindung.execute("PRAGMA journal_mode=WAL")
+                        verbindung.executescript(SCHEMA)
+                        self._aufraeumen(verbindung)
+                        self._initialisiert = True
+            yield verbindung
+        finally:
+            verbindung.close()
+
+    def cachebar(self, parameter: dict[str, Any]) -> bool:
+        return not self.nur_deterministisch or parameter.get("temperature", None) == 0
+
+    def _lesen(self, schluessel: str) -> AIMessage | None:
+        with self.verbinden() as verbindung:
+            zeile = verbindung.execute(
+                "UPDATE antworten SET genutzt = ?, treffer = treffer + 1 WHERE schluessel = ? AND erstellt >= ? RETURNING antwort",
+                (time.time(), schluessel, time.time() - self.max_alter),
+            ).fetchone()
+        if zeile is None:
+            return None
+        return messages_from_dict([json.loads(zeile[0])])[0]
+
+    def _schreiben(self, schluessel: str, model: str, antwort: AIMessage):
+        inhalt = json.dumps(message_to_dict(antwort), ensure_ascii=False)
+        jetzt = time.time()
+        with self.verbinden() as verbindung:
+            verbindung.execute(
+                "INSERT OR REPLACE INTO antworten (schluessel, model, antwort, groesse, erstellt, genutzt) VALUES (?, ?, ?, ?, ?, ?)",
+                (schluessel, model, inhalt, len(inhalt), jetzt, jetzt),
+            )
+            with self._lock:
+                self._schreibvorgaenge += 1
+                aufraeumen = self._schreibvorgaenge % 100 == 0
+            if aufraeumen:
+                self._aufraeumen(verbindung)
+
+    def _aufraeumen(self, verbindung: sqlite3.Connection):
+        """Entfernt abgelaufene und, über der Maximalgröße, die am längsten ungenutzten Antworten."""
+        verbindung.execute(
+            "DELETE FROM antworten WHERE erstellt < ?", (time.time() - self.max_alter,)
+        )
+        groesse = verbindung.execute(
+            "SELECT COALESCE(SUM(groesse), 0) FROM antworten"
+        ).fetchone()[0]
+        if groesse <= self.max_groesse:
+            return
+
+        zu_loeschen = []
+        for schluessel, eintrag_groesse in verbindung.execute(
+            "SELECT schluessel, groesse FROM antworten ORDER BY genutzt"
+        ):
+            if groesse <= self.max_groesse:
+                break
+            zu_loeschen.append((schluessel,))
+            groesse -= eintrag_groesse
+        verbindung.executemany(
+            "DELETE FROM antworten WHERE schluessel = ?", zu_loeschen
+        )
+        log.info(f"Antwort-Cache: {len(zu_loeschen)} Antworten verdrängt")
+
+    async def treffer_melden(
+        self, antwort: AIMessage, messages: list[Any]
+    ) -> AIMessage:
+        fake_llm = FakeMessagesListChatModel(responses=[treffer_message(antwort)])
+        return await fake_llm.with_config(run_name=ANTWORT_CACHE).ainvoke(messages)
+
+    async def antwort_holen(
+        self,
+        model: str,
+        parameter: dict[str, Any],
+        messages: list[Any],
+        aufrufen: Callable[[], Awaitable[AIMessage]],
+        uebernehmen: bool = True,
+    ) -> AIMessage:
+        """
+        `uebernehmen`: gleichzeitige gleiche Anfragen warten auf den ersten Aufruf.
+        In Runden (LLMRunden) aus, dort muss jeder Befragte selbst einreichen.
+        """
+        schluessel = cache_schluessel(model, parameter, messages)
+
+        antwort = await asyncio.to_thread(self._lesen, schluessel)
+        if antwort is not None:
+            log.debug(f"Antwort-Cache: Treffer für {model}")
+            return await self.treffer_melden(antwort, messages)
+
+        loop = asyncio.get_running_loop()
+        while uebernehmen and (loop, schluessel) in self._laufend:
+            laufend = self._laufend[(loop, schluessel)]
+            try:
+                antwort = await asyncio.shield(laufend)
+            except asyncio.CancelledError:
+                # Der erste Aufrufer wurde abgebrochen, dann selbst aufrufen
+                if laufend.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+            log.debug(f"Antwort-Cache: gleichzeitige Anfrage für {model} übernommen")
+            return await self.treffer_melden(antwort, messages)
+
+        future = loop.create_future()
+        self._laufend[(loop, schluessel)] = future
+        try:
+            antwort = await aufrufen()
+            try:
+                await asyncio.to_thread(self._schreiben, schluessel, model, antwort)
+            except Exception as e:
+                # Die Antwort ist bezahlt, nur der nächste Lauf fragt erneut
+                log.warning(
+                    f"Antwort-Cache: Antwort für {model} nicht gespeichert ({e})"
+                )
+            future.set_result(antwort)
+            return antwort
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Wartende bekommen den Fehler, ohne Wartende nicht als unbehandelt melden
+            future.exception()
+            raise
+        finally:
+            self._laufend.pop((loop, schluessel), None)
+
+
+# Prozessweit, wie Ratenbegrenzung und Client-Cache
+_antwort_cache: LLMAntwortCache | None = None
+
+
+def antwort_cache_konfigurieren(config: dict[str, Any]):
+    global _antwort_cache
+    if not config.get("aktiv", False):
+        _antwort_cache = None
+        return
+
+    einstellungen = {
+        "dateipfad": erstelle_dateipfad(
+            config.get("datei", "Cache/llm-antworten.sqlite"), dateiname=""
+        ),
+        "max_groesse_mb": config.get("max_groesse_mb", 500),
+        "max_alter_tage": config.get("max_alter_tage", 30),
+        "nur_deterministisch": config.get("nur_deterministisch", True),
+    }
+    # Unveränderte Einstellungen behalten den Cache samt laufender Anfragen
+    if _antwort_cache is not None and _antwort_cache.einstellungen == einstellungen:
+        return
+    _antwort_cache = LLMAntwortCache(**einstellungen)
+
+
+def antwort_cache_holen() -> LLMAntwortCache | None:
+    return _antwort_cache
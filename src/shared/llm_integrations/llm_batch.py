@@ -0,0 +1,332 @@
+from __future__ import annotations
+import asyncio
+import contextlib
+import hashlib
+from pathlib import Path
+import sqlite3
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from langchain_core.messages import AIMessage
+
+from src.shared.llm_integrations.llm_antwort_cache import (
+    cache_schluessel,
+    content_normalisieren,
+    treffer_message,
+)
+from src.shared.llm_integrations.llm_kontext_cache import kontext_einfuegen
+from src.shared.llm_integrations.llm_provider import LLMProvider
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+# Nachrichten und der für alle Aufrufe gleiche Kontext (oder None)
+Anfrage = tuple[list[Any], str | None]
+
+
+def anfrage_schluessel(
+    thread_id: str, model: str, parameter: dict[str, Any], messages: list[Any]
+) -> str:
+    """Eindeutig je Befragtem und Schritt, auch wenn zwei Befragte dasselbe fragen."""
+    return hashlib.sha256(
+        f"{thread_id}\n{cache_schluessel(model, parameter, messages)}".encode()
+    ).hexdigest()
+
+
+class LLMRunden:
+    """
+    Sammelt die LLM-Aufrufe gleichzeitig laufender Befragter zu Runden. Eine
+    Runde startet, sobald jeder angemeldete Befragte auf seine Antwort wartet,
+    und geht als Ganzes an `ausfuehren` (Schlüssel -> Anfrage). Befragte
+    rücken so gemeinsam vor, Folgefragen und Wiederholungen landen in der
+    nächsten Runde.
+    """
+
+    def __init__(
+        self,
+        ausfuehren: Callable[
+            [dict[str, Anfrage]], Awaitable[dict[str, AIMessage | BaseException]]
+        ],
+    ):
+        self.ausfuehren = ausfuehren
+        self.teilnehmer = 0
+        self.wartend: dict[str, tuple[Anfrage, asyncio.Future]] = {}
+        self.anzahl_runden = 0
+        self._runde: asyncio.Task | None = None
+
+    @contextlib.asynccontextmanager
+    async def teilnehmen(self) -> AsyncIterator[None]:
+        """Solange ein Befragter angemeldet ist, wartet jede Runde auf ihn."""
+        self.teilnehmer += 1
+        try:
+            yield
+        finally:
+            self.teilnehmer -= 1
+            self._pruefen()
+
+    async def aufrufen(
+        self, schluessel: str, messages: list[Any], kontext: str | None = None
+    ) -> AIMessage:
+        future = asyncio.get_running_loop().create_future()
+        self.wartend[schluessel] = ((messages, kontext), future)
+        self._pruefen()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Noch nicht eingereicht: nicht in die nächste Runde mitnehmen
+            if self.wartend.get(schluessel, (None, None))[1] is future:
+                del self.wartend[schluessel]
+            raise
+
+    def _pruefen(self):
+        if (
+            self._runde is None
+            and self.wartend
+            and len(self.wartend) >= self.teilnehmer
+        ):
+            anfragen, self.wartend = self.wartend, {}
+            self._runde = asyncio.create_task(self._runde_ausfuehren(anfragen))
+
+    async def _runde_ausfuehren(
+        self, anfragen: dict[str, tuple[Anfrage, asyncio.Future]]
+    ):
+        self.anzahl_runden += 1
+        log.info(f"Runde {self.anzahl_runden}: {len(anfragen)} Anfragen")
+        try:
+            ergebnisse = await self.ausfuehren(
+                {schluessel: anfrage for schluessel, (anfrage, _) in anfragen.items()}
+            )
+        except Exception as e:
+            ergebnisse = {schluessel: e for schluessel in anfragen}
+        finally:
+            self._runde = None
+
+        for schluessel, (_, future) in anfragen.items():
+            if future.done():
+                continue
+            ergebnis = ergebnisse.get(schluessel)
+            if isinstance(ergebnis, AIMessage):
+                future.set_result(ergebnis)
+            elif isinstance(ergebnis, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(
+                    ergebnis
+                    if isinstance(ergebnis, Exception)
+                    else RuntimeError(f"Keine Antwort für Anfrage {schluessel}")
+                )
+        self._pruefen()
+
+    async def schliessen(self):
+        if self._runde is not None:
+            self._runde.cancel()
+            await asyncio.gather(self._runde, return_exceptions=True)
+
+
+def prompt_text(messages: list[Any]) -> str:
+    return "\n".join(str(content_normalisieren(m.content)) for m in messages)
+
+
+class LLMSchrittausfuehrung:
+    """
+    Führt eine Runde als einen Schritt aller Befragten aus: die offenen
+    Anfragen gehen zusammen an den Provider, höchstens `max_gleichzeitig`
+    davon auf einmal und jede mit Limits, adaptivem Limit und Kontext-Cache.
+    Anfragen mit gleichem Anfang werden nacheinander gesendet, damit der
+    Prompt-Cache des Providers greift. Identische Anfragen gehen bei
+    Temperatur 0 nur einmal raus.
+    """
+
+    def __init__(self, llm_provider: LLMProvider, max_gleichzeitig: int = 16):
+        self.llm_provider = llm_provider
+        self.max_gleichzeitig = max_gleichzeitig
+
+    async def __call__(
+        self, anfragen: dict[str, Anfrage]
+    ) -> dict[str, AIMessage | BaseException]:
+        llm_provider = self.llm_provider
+        deterministisch = llm_provider.parameter.get("temperature", None) == 0
+
+        gruppen: dict[str, list[str]] = {}
+        for schluessel, (messages, kontext) in anfragen.items():
+            inhalt = (
+                cache_schluessel(
+                    llm_provider.aktives_model,
+                    llm_provider.parameter,
+                    (
+                        messages
+                        if kontext is None
+                        else kontext_einfuegen(messages, kontext)
+                    ),
+                )
+                if deterministisch
+                else schluessel
+            )
+            gruppen.setdefault(inhalt, []).append(schluessel)
+        reihenfolge = sorted(
+            gruppen.values(), key=lambda gruppe: prompt_text(anfragen[gruppe[0]][0])
+        )
+
+        antworten = await llm_provider.mehrfach_aufrufen_async(
+            [anfragen[gruppe[0]] for gruppe in reihenfolge], self.max_gleichzeitig
+        )
+        log.debug(f"Schritt mit {len(anfragen)} Anfragen, {len(reihenfolge)} gesendet")
+
+        ergebnisse: dict[str, AIMessage | BaseException] = {}
+        for gruppe, antwort in zip(reihenfolge, antworten):
+            ergebnisse[gruppe[0]] = antwort
+            # Mitgenommene Duplikate haben nichts gekostet
+            for schluessel in gruppe[1:]:
+                ergebnisse[schluessel] = (
+                    treffer_message(antwort)
+                    if isinstance(antwort, AIMessage)
+                    else antwort
+                )
+        return ergebnisse
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batchanfragen (
+    schluessel TEXT PRIMARY KEY,
+    job TEXT NOT NULL,
+    model TEXT NOT NULL,
+    eingereicht REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS batchanfragen_job ON batchanfragen(job);
+"""
+
+
+class Batchspeicher:
+    """
+    Eingereichte, noch nicht ausgelieferte Anfragen auf der Platte (SQLite,
+    auch für mehrere Worker-Prozesse eines Laufs). Ein fortgesetzter Lauf
+    wartet so auf laufende Jobs, statt dieselben Anfragen erneut einzureichen.
+    """
+
+    def __init__(self, dateipfad):
+        self.dateipfad = Path(dateipfad)
+        self.dateipfad.parent.mkdir(parents=True, exist_ok=True)
+        with self.verbinden() as verbindung:
+            verbindung.execute("PRAGMA journal_mode=WAL")
+            verbindung.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def verbinden(self):
+        verbindung = sqlite3.connect(self.dateipfad, timeout=30, isolation_level=None)
+        try:
+            yield verbindung
+        finally:
+            verbindung.close()
+
+    def eingereicht(
+        self, model: str, schluessel: list[str]
+    ) -> dict[str, tuple[str, float]]:
+        """Bereits eingereichte Anfragen: Schlüssel -> (Job, Zeitpunkt)."""
+        # Die Tabelle hält nur nicht ausgelieferte Anfragen und bleibt klein
+        with self.verbinden() as verbindung:
+            zeilen = verbindung.execute(
+                "SELECT schluessel, job, eingereicht FROM batchanfragen WHERE model = ?",
+                (model,),
+            ).fetchall()
+        gesucht = set(schluessel)
+        return {s: (job, zeit) for s, job, zeit in zeilen if s in gesucht}
+
+    def hinzufuegen(self, job: str, model: str, schluessel: list[str]):
+        jetzt = time.time()
+        with self.verbinden() as verbindung:
+            verbindung.executemany(
+                "INSERT OR REPLACE INTO batchanfragen (schluessel, job, model, eingereicht) VALUES (?, ?, ?, ?)",
+                [(s, job, model, jetzt) for s in schluessel],
+            )
+
+    def abgeholt(self, schluessel: list[str]):
+        """Ausgelieferte Antworten stehen im Checkpoint und werden nicht mehr gebraucht."""
+        with self.verbinden() as verbindung:
+            verbindung.executemany(
+                "DELETE FROM batchanfragen WHERE schluessel = ?",
+                [(s,) for s in schluessel],
+            )
+
+    def entfernen(self, job: str):
+        with self.verbinden() as verbindung:
+            verbindung.execute("DELETE FROM batchanfragen WHERE job = ?", (job,))
+
+
+class LLMBatchausfuehrung:
+    """
+    Führt eine Runde über die Batch-API des Providers aus: einreichen, in
+    Abständen abfragen, Antworten verteilen. Günstiger und mit höherem
+    Kontingent als einzelne Aufrufe, dafür mit Wartezeiten pro Runde.
+    """
+
+    def __init__(
+        self,
+        llm_provider: LLMProvider,
+        batchspeicher: Batchspeicher,
+        abfrage_sekunden: float = 30,
+    ):
+        if not llm_provider.batch_unterstuetzt:
+            raise ValueError(
+                f"{type(llm_provider).__name__} unterstützt keine Batch-Ausführung"
+            )
+        self.llm_provider = llm_provider
+        self.batchspeicher = batchspeicher
+        self.abfrage_sekunden = abfrage_sekunden
+
+    async def __call__(
+        self, anfragen: dict[str, Anfrage]
+    ) -> dict[str, AIMessage | BaseException]:
+        model = self.llm_provider.aktives_model
+
+        # Nach einem Neustart gehören manche Anfragen zu bereits eingereichten Jobs
+        eingereicht = await asyncio.to_thread(
+            self.batchspeicher.eingereicht, model, list(anfragen)
+        )
+        jobs: dict[str, float] = dict(eingereicht.values())
+        job_schluessel: dict[str, list[str]] = {}
+        for s, (job, _) in eingereicht.items():
+            job_schluessel.setdefault(job, []).append(s)
+        for job in jobs:
+            log.info(f"Batch {job} wird weiter abgefragt")
+
+        # Ein Job läuft länger, als ein Kontext-Cache lebt: Kontext in den Prompt
+        offen = {
+            s: messages if kontext is None else kontext_einfuegen(messages, kontext)
+            for s, (messages, kontext) in anfragen.items()
+            if s not in eingereicht
+        }
+        if offen:
+            job = await asyncio.to_thread(
+                self.llm_provider.batch_einreichen, model, offen
+            )
+            await asyncio.to_thread(
+                self.batchspeicher.hinzufuegen, job, model, list(offen)
+            )
+            jobs[job] = time.time()
+            job_schluessel[job] = list(offen)
+            log.info(f"Batch {job} mit {len(offen)} Anfragen eingereicht")
+
+        ergebnisse: dict[str, AIMessage | BaseException] = {}
+        abgeholt: list[str] = []
+        for job, zeitpunkt in jobs.items():
+            try:
+                while (
+                    antworten := await asyncio.to_thread(
+                        self.llm_provider.batch_abfragen, model, job
+                    )
+                ) is None:
+                    await asyncio.sleep(self.abfrage_sekunden)
+            except Exception as e:
+                # Nur die Anfragen dieses Jobs scheitern, beim nächsten Versuch
+                # werden sie neu eingereicht
+                log.warning(f"Batch {job} fehlgeschlagen ({e})")
+                await asyncio.to_thread(self.batchspeicher.entfernen, job)
+                ergebnisse.update({s: e for s in job_schluessel[job]})
+                continue
+            log.info(f"Batch {job} fertig nach {time.time() - zeitpunkt:.0f}s")
+            geliefert = {s: a for s, a in antworten.items() if s in anfragen}
+            ergebnisse.update(geliefert)
+            abgeholt.extend(geliefert)
+
+        await asyncio.to_thread(self.batchspeicher.abgeholt, abgeholt)
+        return ergebnisse
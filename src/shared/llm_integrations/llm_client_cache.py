@@ -0,0 +1,79 @@
+from __future__ import annotations
+import asyncio
+from collections import OrderedDict
+import json
+import threading
+from typing import Any, Callable
+
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def aktuelle_event_loop() -> asyncio.AbstractEventLoop | None:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class LLMClientCache:
+    """
+    Begrenzter LRU-Cache für LLM-Instanzen samt ihrer HTTP-Verbindungspools.
+
+    Async-HTTP-Clients sind an die Event-Loop gebunden, in der ihre Verbindungen
+    entstanden sind. Streamlit und `synchron_iterieren` nutzen eigene Loops in
+    eigenen Threads, deshalb gehört die laufende Loop mit zum Schlüssel.
+    """
+
+    def __init__(self, maximale_anzahl: int = 32):
+        self.maximale_anzahl = maximale_anzahl
+        self._instanzen: OrderedDict[tuple, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def holen(
+        self,
+        provider: str,
+        model: str,
+        parameter: dict[str, Any],
+        erstellen: Callable[[], Any],
+    ):
+        schluessel = (
+            provider,
+            model,
+            json.dumps(parameter, sort_keys=True, default=str),
+            aktuelle_event_loop(),
+        )
+        with self._lock:
+            if schluessel in self._instanzen:
+                self._instanzen.move_to_end(schluessel)
+                return self._instanzen[schluessel]
+
+            # Unter dem Lock erstellen, damit parallele Aufrufe nicht mehrere Pools öffnen
+            instanz = erstellen()
+            self._instanzen[schluessel] = instanz
+            self._aufraeumen()
+            log.debug(f"LLM-Instanz für {provider}/{model} erstellt")
+            return instanz
+
+    def _aufraeumen(self):
+        for schluessel in [
+            s for s in self._instanzen if s[3] is not None and s[3].is_closed()
+        ]:
+            del self._instanzen[schluessel]
+        while len(self._instanzen) > self.maximale_anzahl:
+            self._instanzen.popitem(last=False)
+
+    def leeren(self):
+        with self._lock:
+            self._instanzen.clear()
+
+
+# Prozessweit, damit alle Provider-Objekte dieselben Verbindungen nutzen
+llm_client_cache = LLMClientCache()
+
+
+def client_cache_konfigurieren(config: dict[str, Any]):
+    with llm_client_cache._lock:
+        llm_client_cache.maximale_anzahl = config.get("maximale_anzahl", 32)
+        llm_client_cache._aufraeumen()
@@ -0,0 +1,380 @@
+from __future__ import annotations
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import threading
+import time
+from typing import Any, Callable
+import uuid
+
+from src.shared.llm_integrations.llm_ratenbegrenzung import ZEICHEN_PRO_TOKEN
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def standardantwort(prompt: str) -> str:
+    """Beantwortet jede Aussage der letzten Frage mit der ersten Antwortoption."""
+    aussagen: list[str] = []
+    optionen: list[str] = []
+    teil = None
+    for zeile in prompt.splitlines():
+        if zeile.startswith("Aussagen:"):
+            # Nur die zuletzt gestellte Frage zählt
+            aussagen.clear()
+            optionen.clear()
+            teil = aussagen
+        elif zeile.startswith("Antwortoptionen:"):
+            teil = optionen
+        elif teil is aussagen and ": " in zeile:
+            aussagen.append(zeile.rsplit(": ", 1)[0].strip())
+        elif teil is optionen and zeile.strip():
+            optionen.append(zeile.split(" (", 1)[0].strip())
+    if not aussagen:
+        return "Zusammenfassung."
+    return "\n".join(
+        f"{aussage}: {optionen[0] if optionen else 1}" for aussage in aussagen
+    )
+
+
+def texte(contents: list[dict[str, Any]]) -> list[str]:
+    return [
+        part.get("text", "")
+        for content in contents
+        for part in content.get("parts", [])
+    ]
+
+
+def tokens(contents: list[dict[str, Any]]) -> int:
+    return sum(len(text) for text in texte(contents)) // ZEICHEN_PRO_TOKEN
+
+
+def zeitpunkt(sekunden: float) -> str:
+    return (
+        datetime.fromtimestamp(sekunden, timezone.utc)
+        .isoformat()
+        .replace("+00:00", "Z")
+    )
+
+
+def ttl_lesen(ttl: str | None, standard: float = 3600) -> float:
+    return float(ttl.rstrip("s")) if ttl else standard
+
+
+class GeminiTestserver:
+    """
+    Lokaler Ersatz für die Gemini-API (generateContent, cachedContents und
+    Batches), um Kontext-Cache und Batch-Ausführung ohne Schlüssel und Kosten
+    zu testen. Im Modell als `base_url = "http://127.0.0.1:<port>"` eintragen,
+    `verdraengen()` löscht alle Caches wie eine Verdrängung beim Provider.
+    Batches sind nach `batch_dauer_sekunden` fertig, `batch_scheitern_lassen()`
+    beendet einen Batch als fehlgeschlagen.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        antworten: Callable[[str], str] = standardantwort,
+        batch_dauer_sekunden: float = 0,
+    ):
+        self.antworten = antworten
+        self.batch_dauer_sekunden = batch_dauer_sekunden
+        self.caches: dict[str, dict[str, Any]] = {}
+        self.batches: dict[str, dict[str, Any]] = {}
+        self.statistik = {
+            "caches_erstellt": 0,
+            "caches_verlaengert": 0,
+            "caches_geloescht": 0,
+            "aufrufe": 0,
+            "aufrufe_mit_cache": 0,
+            "cache_fehler": 0,
+            "batches": 0,
+            "batch_anfragen": 0,
+        }
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler_klasse())
+        self.server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def starten(self) -> GeminiTestserver:
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        log.info(f"Gemini-Testserver läuft auf {self.url}")
+        return self
+
+    def beenden(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> GeminiTestserver:
+        return self.starten()
+
+    def __exit__(self, *args):
+        self.beenden()
+
+    def verdraengen(self):
+        with self._lock:
+            self.caches.clear()
+
+    def cache_lesen(self, name: str) -> dict[str, Any] | None:
+        cache = self.caches.get(name)
+        if cache is not None and cache["ablauf"] <= time.time():
+            del self.caches[name]
+            return None
+        return cache
+
+    def cache_antwort(self, cache: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "name": cache["name"],
+            "model": cache["model"],
+            "displayName": cache["displayName"],
+            "createTime": zeitpunkt(cache["erstellt"]),
+            "updateTime": zeitpunkt(cache["erstellt"]),
+            "expireTime": zeitpunkt(cache["ablauf"]),
+            "usageMetadata": {"totalTokenCount": cache["tokens"]},
+        }
+
+    def cache_erstellen(self, daten: dict[str, Any]) -> tuple[int, dict[str, Any]]:
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        contents = daten.get("contents", [])
+        if daten.get("systemInstruction"):
+            contents = [daten["systemInstruction"], *contents]
+        cache = {
+            "name": name,
+            "model": daten.get("model", ""),
+            "displayName": daten.get("displayName", ""),
+            "contents": contents,
+            "tokens": tokens(contents),
+            "erstellt": time.time(),
+            "ablauf": time.time() + ttl_lesen(daten.get("ttl")),
+        }
+        with self._lock:
+            self.caches[name] = cache
+            self.statistik["caches_erstellt"] += 1
+        return 200, self.cache_antwort(cache)
+
+    def cache_verlaengern(
+        self, name: str, daten: dict[str, Any]
+    ) -> tuple[int, dict[str, Any]]:
+        with self._lock:
+            cache = self.cache_lesen(name)
+            if cache is None:
+                return nicht_gefunden(name)
+            cache["ablauf"] = time.time() + ttl_lesen(daten.get("ttl"))
+            self.statistik["caches_verlaengert"] += 1
+            return 200, self.cache_antwort(cache)
+
+    def cache_loeschen(self, name: str) -> tuple[int, dict[str, Any]]:
+        with self._lock:
+            if self.cache_lesen(name) is None:
+                return nicht_gefunden(name)
+            del self.caches[name]
+            self.statistik["caches_geloescht"] += 1
+        return 200, {}
+
+    def generieren(
+        self, model: str, daten: dict[str, Any]
+    ) -> tuple[int, dict[str, Any]]:
+        contents = daten.get("contents", [])
+        cache_name = daten.get("cachedContent")
+        gecacht: list[dict[str, Any]] = []
+        with self._lock:
+            self.statistik["aufrufe"] += 1
+            if cache_name:
+                if daten.get("systemInstruction"):
+                    return fehler(
+                        400,
+                        "INVALID_ARGUMENT",
+                        "CachedContent can not be used with GenerateContent request setting system_instruction, tools or tool_config.",
+                    )
+                cache = self.cache_lesen(cache_name)
+                if cache is None:
+                    self.statistik["cache_fehler"] += 1
+                    return nicht_gefunden(cache_name)
+                gecacht = cache["contents"]
+                self.statistik["aufrufe_mit_cache"] += 1
+
+        prompt = "\n".join(texte(contents))
+        text = self.antworten(prompt)
+        eingabe = (
+            tokens(gecacht)
+            + tokens(contents)
+            + tokens([daten.get("systemInstruction") or {}])
+        )
+        ausgabe = max(1, len(text) // ZEICHEN_PRO_TOKEN)
+        usage = {
+            "promptTokenCount": eingabe,
+            "candidatesTokenCount": ausgabe,
+            "totalTokenCount": eingabe + ausgabe,
+        }
+        if gecacht:
+            usage["cachedContentTokenCount"] = tokens(gecacht)
+        return 200, {
+            "candidates": [
+                {
+                    "content": {"role": "model", "parts": [{"text": text}]},
+                    "finishReason": "STOP",
+                    "index": 0,
+                }
+            ],
+            "usageMetadata": usage,
+            "modelVersion": model,
+        }
+
+    def batch_erstellen(
+        self, model: str, daten: dict[str, Any]
+    ) -> tuple[int, dict[str, Any]]:
+        batch = daten.get("batch", {})
+        requests = batch.get("inputConfig", {}).get("requests", {}).get("requests", [])
+        jetzt = time.time()
+        eintrag = {
+            "name": f"batches/{uuid.uuid4().hex[:12]}",
+            "model": model,
+            "displayName": batch.get("displayName", ""),
+            "requests": requests,
+            "erstellt": jetzt,
+            "fertig_ab": jetzt + self.batch_dauer_sekunden,
+            "antworten": None,
+            "fehlgeschlagen": False,
+        }
+        with self._lock:
+            self.batches[eintrag["name"]] = eintrag
+            self.statistik["batches"] += 1
+            self.statistik["batch_anfragen"] += len(requests)
+        return 200, self.batch_antwort(eintrag)
+
+    def batch_lesen(self, name: str) -> tuple[int, dict[str, Any]]:
+        with self._lock:
+            eintrag = self.batches.get(name)
+        if eintrag is None:
+            return fehler(404, "NOT_FOUND", f"Batch nicht gefunden: {name}")
+        if (
+            eintrag["antworten"] is None
+            and not eintrag["fehlgeschlagen"]
+            and time.time() >= eintrag["fertig_ab"]
+        ):
+            antworten = []
+            for request in eintrag["requests"]:
+                status, antwort = self.generieren(
+                    eintrag["model"], request.get("request", {})
+                )
+                antworten.append(
+                    {
+                        "metadata": request.get("metadata"),
+                        **(
+                            {"response": antwort}
+                            if status == 200
+                            else {"error": antwort["error"]}
+                        ),
+                    }
+                )
+            eintrag["antworten"] = antworten
+        return 200, self.batch_antwort(eintrag)
+
+    def batch_scheitern_lassen(self, name: str):
+        with self._lock:
+            self.batches[name]["fehlgeschlagen"] = True
+
+    def batch_antwort(self, eintrag: dict[str, Any]) -> dict[str, Any]:
+        if eintrag["fehlgeschlagen"]:
+            return {
+                "name": eintrag["name"],
+                "metadata": {
+                    "model": f"models/{eintrag['model']}",
+                    "displayName": eintrag["displayName"],
+                    "state": "BATCH_STATE_FAILED",
+                    "createTime": zeitpunkt(eintrag["erstellt"]),
+                    "updateTime": zeitpunkt(time.time()),
+                },
+                "done": True,
+                "error": {"code": 13, "message": "Batch fehlgeschlagen"},
+            }
+        fertig = eintrag["antworten"] is not None
+        metadata = {
+            "model": f"models/{eintrag['model']}",
+            "displayName": eintrag["displayName"],
+            "state": "BATCH_STATE_SUCCEEDED" if fertig else "BATCH_STATE_RUNNING",
+            "createTime": zeitpunkt(eintrag["erstellt"]),
+            "updateTime": zeitpunkt(time.time()),
+        }
+        if fertig:
+            metadata["endTime"] = zeitpunkt(eintrag["fertig_ab"])
+            metadata["output"] = {
+                "inlinedResponses": {"inlinedResponses": eintrag["antworten"]}
+            }
+        return {"name": eintrag["name"], "metadata": metadata, "done": fertig}
+
+    def bearbeiten(
+        self, methode: str, pfad: str, daten: dict[str, Any]
+    ) -> tuple[int, dict[str, Any]]:
+        pfad = pfad.split("?", 1)[0]
+        if methode == "POST" and (
+            treffer := re.fullmatch(
+                r"/v1beta/models/([^/:]+):batchGenerateContent", pfad
+            )
+        ):
+            return self.batch_erstellen(treffer.group(1), daten)
+        if methode == "GET" and (
+            treffer := re.fullmatch(r"/v1beta/(batches/[^/:]+)", pfad)
+        ):
+            return self.batch_lesen(treffer.group(1))
+        if methode == "POST" and (
+            treffer := re.fullmatch(r"/v1beta/models/([^/:]+):generateContent", pfad)
+        ):
+            return self.generieren(treffer.group(1), daten)
+        if methode == "POST" and pfad == "/v1beta/cachedContents":
+            return self.cache_erstellen(daten)
+        if treffer := re.fullmatch(r"/v1beta/(cachedContents/[^/]+)", pfad):
+            name = treffer.group(1)
+            if methode == "PATCH":
+                return self.cache_verlaengern(name, daten)
+            if methode == "DELETE":
+                return self.cache_loeschen(name)
+            if methode == "GET":
+                with self._lock:
+                    cache = self.cache_lesen(name)
+                return (
+                    (200, self.cache_antwort(cache))
+                    if cache is not None
+                    else nicht_gefunden(name)
+                )
+        return fehler(404, "NOT_FOUND", f"Unbekannter Pfad {methode} {pfad}")
+
+    def handler_klasse(self) -> type[BaseHTTPRequestHandler]:
+        testserver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def anfrage(self):
+                laenge = int(self.headers.get("Content-Length") or 0)
+                daten = json.loads(self.rfile.read(laenge)) if laenge else {}
+                status, antwort = testserver.bearbeiten(self.command, self.path, daten)
+                inhalt = json.dumps(antwort).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(inhalt)))
+                self.end_headers()
+                self.wfile.write(inhalt)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = anfrage
+
+            def log_message(self, format, *args):
+                log.debug(f"Gemini-Testserver: {format % args}")
+
+        return Handler
+
+
+def fehler(status: int, code: str, nachricht: str) -> tuple[int, dict[str, Any]]:
+    return status, {"error": {"code": status, "message": nachricht, "status": code}}
+
+
+def nicht_gefunden(name: str) -> tuple[int, dict[str, Any]]:
+    return fehler(
+        404, "NOT_FOUND", f"CachedContent not found (or permission denied): {name}"
+    )
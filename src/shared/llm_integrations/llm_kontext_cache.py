@@ -0,0 +1,199 @@
+from __future__ import annotations
+import atexit
+from dataclasses import dataclass
+import hashlib
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+from langchain_core.messages import SystemMessage
+
+from src.shared.llm_integrations.llm_ratenbegrenzung import ZEICHEN_PRO_TOKEN
+from src.shared.logger import get_logger
+
+if TYPE_CHECKING:
+    from src.shared.llm_integrations.llm_provider import LLMProvider
+
+log = get_logger(__name__)
+
+# Nach einem gescheiterten Anlegen erst später wieder versuchen, die Pause
+# verdoppelt sich bis zum Maximum
+FEHLER_PAUSE_SEKUNDEN = 30
+FEHLER_PAUSE_MAX_SEKUNDEN = 1800
+
+
+def kontext_einfuegen(messages: list[Any], kontext: str) -> list[Any]:
+    """Ohne Kontext-Cache steht der Kontext vorne in der ersten System-Nachricht."""
+    if messages and isinstance(messages[0], SystemMessage):
+        return [
+            SystemMessage(content=f"{kontext}\n\n{messages[0].content}"),
+            *messages[1:],
+        ]
+    return [SystemMessage(content=kontext), *messages]
+
+
+@dataclass
+class Kontextcacheeintrag:
+    provider: LLMProvider
+    model: str
+    handle: str
+    ablauf: float
+
+
+class LLMKontextCache:
+    """
+    Gemeinsamer Kontext (z.B. die Referenzen aller Befragten) liegt einmal beim
+    Provider und wird per Handle referenziert. Kurz vor Ablauf der TTL wird
+    verlängert, ein verdrängter Cache beim nächsten Aufruf neu angelegt.
+    """
+
+    def __init__(
+        self,
+        ttl_sekunden: float = 3600,
+        verlaengern_vor_sekunden: float = 600,
+        min_tokens: int = 4096,
+    ):
+        self.ttl_sekunden = ttl_sekunden
+        self.verlaengern_vor_sekunden = verlaengern_vor_sekunden
+        self.min_tokens = min_tokens
+        self.einstellungen = {
+            "ttl_sekunden": ttl_sekunden,
+            "verlaengern_vor_sekunden": verlaengern_vor_sekunden,
+            "min_tokens": min_tokens,
+        }
+
+        self.eintraege: dict[tuple[str, str, str], Kontextcacheeintrag] = {}
+        # Kontexte, für die der Provider keinen Cache anlegen konnte:
+        # (Fehler in Folge, nächster Versuch ab)
+        self.fehlgeschlagen: dict[tuple[str, str, str], tuple[int, float]] = {}
+        self._locks: dict[tuple[str, str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def schluessel(
+        self, provider: LLMProvider, model: str, kontext: str
+    ) -> tuple[str, str, str]:
+        return (
+            type(provider).__name__,
+            model,
+            hashlib.sha256(kontext.encode()).hexdigest(),
+        )
+
+    def handle_holen(
+        self, provider: LLMProvider, model: str, kontext: str
+    ) -> str | None:
+        """Blockiert beim Anlegen, daher aus asyncio über asyncio.to_thread aufrufen."""
+        if len(kontext) / ZEICHEN_PRO_TOKEN < self.min_tokens:
+            return None
+
+        schluessel = self.schluessel(provider, model, kontext)
+        fehler, erneut_ab = self.fehlgeschlagen.get(schluessel, (0, 0))
+        if time.time() < erneut_ab:
+            return None
+        with self._lock:
+            lock = self._locks.setdefault(schluessel, threading.Lock())
+
+        # Gleichzeitige Befragte warten auf denselben Cache statt eigene anzulegen
+        with lock:
+            eintrag = self.eintraege.get(schluessel)
+            jetzt = time.time()
+            if (
+                eintrag is not None
+                and eintrag.ablauf - jetzt > self.verlaengern_vor_sekunden
+            ):
+                return eintrag.handle
+
+            if eintrag is not None and eintrag.ablauf > jetzt:
+                try:
+                    provider.kontext_cache_verlaengern(
+                        model, eintrag.handle, self.ttl_sekunden
+                    )
+                    eintrag.ablauf = jetzt + self.ttl_sekunden
+                    log.debug(f"Kontext-Cache {eintrag.handle} verlängert")
+                    return eintrag.handle
+                except Exception as e:
+                    log.warning(
+                        f"Kontext-Cache {eintrag.handle} nicht verlängert, lege neu an ({e})"
+                    )
+
+            try:
+                handle = provider.kontext_cache_erstellen(
+                    model, kontext, self.ttl_sekunden
+                )
+            except Exception as e:
+                pause = min(
+                    FEHLER_PAUSE_SEKUNDEN * 2**fehler, FEHLER_PAUSE_MAX_SEKUNDEN
+                )
+                log.warning(
+                    f"Kontext-Cache für {model} nicht angelegt, Kontext wird {pause}s mitgesendet ({e})"
+                )
+                self.eintraege.pop(schluessel, None)
+                self.fehlgeschlagen[schluessel] = (fehler + 1, time.time() + pause)
+                return None
+
+            self.fehlgeschlagen.pop(schluessel, None)
+
+            self.eintraege[schluessel] = Kontextcacheeintrag(
+                provider=provider,
+                model=model,
+                handle=handle,
+                ablauf=time.time() + self.ttl_sekunden,
+            )
+            log.info(
+                f"Kontext-Cache {handle} für {model} angelegt (~{len(kontext) // ZEICHEN_PRO_TOKEN} Tokens)"
+            )
+            return handle
+
+    def verwerfen(self, provider: LLMProvider, model: str, kontext: str):
+        """Der Provider kennt den Cache nicht mehr, beim nächsten Aufruf neu anlegen."""
+        eintrag = self.eintraege.pop(self.schluessel(provider, model, kontext), None)
+        if eintrag is not None:
+            log.warning(f"Kontext-Cache {eintrag.handle} wurde verdrängt")
+
+    def aufraeumen(self):
+        """Löscht alle angelegten Caches beim Provider, statt die TTL abzuwarten."""
+        with self._lock:
+            eintraege = list(self.eintraege.values())
+            self.eintraege.clear()
+        for eintrag in eintraege:
+            try:
+                eintrag.provider.kontext_cache_loeschen(eintrag.model, eintrag.handle)
+                log.info(f"Kontext-Cache {eintrag.handle} gelöscht")
+            except Exception as e:
+                log.warning(f"Kontext-Cache {eintrag.handle} nicht gelöscht ({e})")
+
+
+# Prozessweit, wie Antwort-Cache und Ratenbegrenzung
+_kontext_cache: LLMKontextCache | None = None
+
+
+def kontext_cache_konfigurieren(config: dict[str, Any]):
+    global _kontext_cache
+    if not config.get("aktiv", False):
+        if _kontext_cache is not None:
+            _kontext_cache.aufraeumen()
+        _kontext_cache = None
+        return
+
+    einstellungen = {
+        "ttl_sekunden": config.get("ttl_sekunden", 3600),
+        "verlaengern_vor_sekunden": config.get("verlaengern_vor_sekunden", 600),
+        "min_tokens": config.get("min_tokens", 4096),
+    }
+    if _kontext_cache is not None and _kontext_cache.einstellungen == einstellungen:
+        return
+    if _kontext_cache is not None:
+        _kontext_cache.aufraeumen()
+    _kontext_cache = LLMKontextCache(**einstellungen)
+
+
+def kontext_cache_holen() -> LLMKontextCache | None:
+    return _kontext_cache
+
+
+def kontext_cache_aufraeumen():
+    if _kontext_cache is not None:
+        _kontext_cache.aufraeumen()
+
+
+# Bei Prozessende nicht auf die TTL der Provider warten
+atexit.register(kontext_cache_aufraeumen)
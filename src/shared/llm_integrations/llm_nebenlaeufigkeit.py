@@ -0,0 +1,261 @@
+from __future__ import annotations
+import asyncio
+from collections import deque
+from dataclasses import dataclass, replace
+import threading
+import time
+from typing import Any
+
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class Nebenlaeufigkeit:
+    start: int
+    minimum: int
+    maximum: int
+    latenz_toleranz: float
+    reduktionsfaktor: float
+    fenster: int
+    adaptiv: bool = True
+
+    @classmethod
+    def fest(cls, anzahl: int) -> Nebenlaeufigkeit:
+        """Festes Limit ohne Regelung."""
+        return cls(
+            start=anzahl,
+            minimum=anzahl,
+            maximum=anzahl,
+            latenz_toleranz=0,
+            reduktionsfaktor=1,
+            fenster=50,
+            adaptiv=False,
+        )
+
+    @classmethod
+    def from_dict(cls, data) -> Nebenlaeufigkeit:
+        return cls(
+            start=data.get("start", 4),
+            minimum=data.get("minimum", 1),
+            maximum=data.get("maximum", 64),
+            latenz_toleranz=data.get("latenz_toleranz", 2.0),
+            reduktionsfaktor=data.get("reduktionsfaktor", 0.5),
+            fenster=data.get("fenster", 50),
+        )
+
+
+@dataclass(frozen=True)
+class Nebenlaeufigkeitskennzahlen:
+    model: str
+    limit: int
+    laufend: int
+    wartend: int
+    latenz_p50: float | None
+    latenz_p95: float | None
+    fehlerquote: float
+    aufrufe: int
+
+    def beschreibung(self) -> str:
+        latenzen = (
+            f"p50 {self.latenz_p50:.1f}s, p95 {self.latenz_p95:.1f}s"
+            if self.latenz_p50 is not None
+            else "noch keine Latenzen"
+        )
+        return f"{self.model}: {self.laufend}/{self.limit} laufend, {self.wartend} wartend, {latenzen}, Fehlerquote {self.fehlerquote:.0%}"
+
+
+def quantil(werte: list[float], anteil: float) -> float | None:
+    if not werte:
+        return None
+    sortiert = sorted(werte)
+    return sortiert[min(len(sortiert) - 1, int(anteil * len(sortiert)))]
+
+
+class Nebenlaeufigkeitsregler:
+    """
+    AIMD-Regelung der gleichzeitigen Aufrufe eines Modells: Solange die Latenz
+    nahe der Basislatenz bleibt, wächst das Limit um etwa einen Aufruf pro
+    Fenster voller Antworten. Ratenfehler oder Latenzspitzen halbieren es.
+    """
+
+    def __init__(self, model: str, einstellungen: Nebenlaeufigkeit):
+        self.model = model
+        self.einstellungen = einstellungen
+        self.limit = float(einstellungen.start)
+        self.laufend = 0
+        self.aufrufe = 0
+
+        self.latenzen: deque[float] = deque(maxlen=einstellungen.fenster)
+        self.erfolge: deque[bool] = deque(maxlen=einstellungen.fenster)
+        self.basislatenz: float | None = None
+        self.letzte_reduktion = 0.0
+
+        # Event-Loops in mehreren Threads teilen sich den Regler
+        self._lock = threading.Lock()
+        self._wartende: deque[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = (
+            deque()
+        )
+
+    def _freie_plaetze(self) -> bool:
+        return self.laufend < max(1, int(self.limit))
+
+    async def erwerben(self):
+        with self._lock:
+            if self._freie_plaetze() and not self._wartende:
+                self.laufend += 1
+                return
+            loop = asyncio.get_running_loop()
+            wartender = (loop, loop.create_future())
+            self._wartende.append(wartender)
+
+        try:
+            await wartender[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if wartender in self._wartende:
+                    self._wartende.remove(wartender)
+                    raise
+            # Platz wurde schon zugeteilt, aber nicht mehr genutzt
+            self.freigeben(latenz=None, erfolg=None)
+            raise
+
+    def _wecken(self):
+        while self._wartende and self._freie_plaetze():
+            loop, future = self._wartende.popleft()
+            try:
+                loop.call_soon_threadsafe(
+                    lambda f=future: f.done() or f.set_result(None)
+                )
+            except RuntimeError:
+                # Event-Loop des Wartenden ist bereits beendet
+                continue
+            self.laufend += 1
+
+    def freigeben(
+        self, latenz: float | None, erfolg: bool | None, ratenfehler: bool = False
+    ):
+        """`erfolg=None` gibt den Platz frei, ohne in die Statistik einzugehen."""
+        with self._lock:
+            self.laufend -= 1
+            if erfolg is not None:
+                self.aufrufe += 1
+                self.erfolge.append(erfolg)
+                if latenz is not None:
+                    self.latenzen.append(latenz)
+                self._anpassen(latenz=latenz, erfolg=erfolg, ratenfehler=ratenfehler)
+            self._wecken()
+
+    def _anpassen(self, latenz: float | None, erfolg: bool, ratenfehler: bool):
+        einstellungen = self.einstellungen
+        if not einstellungen.adaptiv:
+            return
+        p50 = quantil(list(self.latenzen), 0.5)
+
+        latenzspitze = False
+        if erfolg and p50 is not None and len(self.latenzen) >= 10:
+            if self.basislatenz is None:
+                self.basislatenz = p50
+            # Basis folgt langsam, damit ein dauerhaft langsamerer Provider nicht
+            # für immer als Spitze gilt
+            self.basislatenz = min(p50, 0.99 * self.basislatenz + 0.01 * p50)
+            latenzspitze = p50 > self.basislatenz * einstellungen.latenz_toleranz
+
+        if ratenfehler or latenzspitze:
+            # Nur einmal pro Latenzdauer reduzieren, sonst halbiert jede Antwort
+            # aus demselben Engpass das Limit erneut
+            jetzt = time.monotonic()
+            if jetzt - self.letzte_reduktion < (p50 or 1.0):
+                return
+            self.letzte_reduktion = jetzt
+            vorher = self.limit
+            self.limit = max(
+                float(einstellungen.minimum),
+                self.limit * einstellungen.reduktionsfaktor,
+            )
+            log.info(
+                f"Nebenläufigkeit {self.model}: {int(vorher)} -> {int(self.limit)} ({"Ratenlimit" if ratenfehler else "Latenzspitze"})"
+            )
+            if latenzspitze:
+                self.latenzen.clear()
+            return
+
+        # Nur erhöhen, wenn das Limit auch ausgeschöpft wird
+        if erfolg and self.laufend + 1 >= int(self.limit):
+            self.limit = min(
+                float(einstellungen.maximum), self.limit + 1 / max(1.0, self.limit)
+            )
+
+    def kennzahlen(self) -> Nebenlaeufigkeitskennzahlen:
+        with self._lock:
+            latenzen = list(self.latenzen)
+            erfolge = list(self.erfolge)
+            return Nebenlaeufigkeitskennzahlen(
+                model=self.model,
+                limit=max(1, int(self.limit)),
+                laufend=self.laufend,
+                wartend=len(self._wartende),
+                latenz_p50=quantil(latenzen, 0.5),
+                latenz_p95=quantil(latenzen, 0.95),
+                fehlerquote=(erfolge.count(False) / len(erfolge) if erfolge else 0.0),
+                aufrufe=self.aufrufe,
+            )
+
+
+# Prozessweit pro Modell, wie die Ratenbegrenzung
+_einstellungen: Nebenlaeufigkeit | None = None
+_maxima: dict[str, int] = {}
+_nebenlaeufigkeitsregler: dict[str, Nebenlaeufigkeitsregler] = {}
+_nebenlaeufigkeitsregler_lock = threading.Lock()
+
+
+def nebenlaeufigkeit_konfigurieren(
+    config: dict[str, Any], maxima: dict[str, int] | None = None
+):
+    """
+    Übernimmt `[llm.nebenlaeufigkeit]`; ohne `aktiv = true` bleibt die Regelung aus.
+    `maxima` begrenzt einzelne Modelle, auch wenn die Regelung aus ist.
+    """
+    global _einstellungen, _maxima
+    einstellungen = (
+        Nebenlaeufigkeit.from_dict(config) if config.get("aktiv", False) else None
+    )
+    maxima = maxima or {}
+    with _nebenlaeufigkeitsregler_lock:
+        if einstellungen != _einstellungen or maxima != _maxima:
+            _nebenlaeufigkeitsregler.clear()
+        _einstellungen = einstellungen
+        _maxima = maxima
+
+
+def einstellungen_fuer_model(model: str) -> Nebenlaeufigkeit | None:
+    maximum = _maxima.get(model)
+    if maximum is None:
+        return _einstellungen
+    if _einstellungen is None:
+        return Nebenlaeufigkeit.fest(maximum)
+    return replace(
+        _einstellungen,
+        start=min(_einstellungen.start, maximum),
+        minimum=min(_einstellungen.minimum, maximum),
+        maximum=min(_einstellungen.maximum, maximum),
+    )
+
+
+def nebenlaeufigkeitsregler_holen(model: str) -> Nebenlaeufigkeitsregler | None:
+    with _nebenlaeufigkeitsregler_lock:
+        if model not in _nebenlaeufigkeitsregler:
+            einstellungen = einstellungen_fuer_model(model)
+            if einstellungen is None:
+                return None
+            _nebenlaeufigkeitsregler[model] = Nebenlaeufigkeitsregler(
+                model=model, einstellungen=einstellungen
+            )
+        return _nebenlaeufigkeitsregler[model]
+
+
+def nebenlaeufigkeitskennzahlen() -> list[Nebenlaeufigkeitskennzahlen]:
+    with _nebenlaeufigkeitsregler_lock:
+        regler = list(_nebenlaeufigkeitsregler.values())
+    return [r.kennzahlen() for r in regler]
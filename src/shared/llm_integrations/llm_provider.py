@@ -1,11 +1,49 @@
 from __future__ import annotations
 from abc import abstractmethod
+import asyncio
+from dataclasses import dataclass
+import importlib
+import threading
+import time
+from typing import Any
 from langchain_core.messages import AIMessage
 
+from src.shared.llm_integrations.llm_antwort_cache import antwort_cache_konfigurieren
+from src.shared.llm_integrations.llm_client_cache import (
+    client_cache_konfigurieren,
+    llm_client_cache,
+)
+from src.shared.llm_integrations.llm_kontext_cache import (
+    kontext_cache_holen,
+    kontext_cache_konfigurieren,
+    kontext_einfuegen,
+)
+from src.shared.llm_integrations.llm_nebenlaeufigkeit import (
+    Nebenlaeufigkeitskennzahlen,
+    nebenlaeufigkeit_konfigurieren,
+    nebenlaeufigkeitskennzahlen,
+    nebenlaeufigkeitsregler_holen,
+)
+from src.shared.llm_integrations.llm_ratenbegrenzung import (
+    ist_ratenfehler,
+    ist_wiederholbar,
+    ratenbegrenzer_holen,
+    ratenbegrenzung_konfigurieren,
+)
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
 
 class LLMProvider:
-    def __init__(self, models: list[str]):
+    # Provider mit expliziten Kontext-Caches überschreiben die kontext_cache_* Methoden
+    kontext_cache_unterstuetzt = False
+    # Provider mit Batch-API überschreiben batch_einreichen und batch_abfragen
+    batch_unterstuetzt = False
+
+    def __init__(self, models: list[str], parameter: dict[str, Any] | None = None):
         self.models: list[str] = models
+        self.parameter: dict[str, Any] = parameter or {}
 
     def hole_models(self) -> list[str]:
         return self.models
@@ -13,36 +51,279 @@ class LLMProvider:
     def aktiviere_model(self, model: str):
         self.aktives_model = model
 
-    @abstractmethod
     def hole_instanz(self, model: str):
+        """Liefert eine wiederverwendete Instanz samt offenem Verbindungspool."""
+        return llm_client_cache.holen(
+            provider=type(self).__name__,
+            model=model,
+            parameter=self.instanz_parameter(model),
+            erstellen=lambda: self.instanz_erstellen(model=model),
+        )
+
+    def instanz_parameter(self, model: str) -> dict[str, Any]:
+        """
+        Parameter der LangChain-Instanz. Mit Ratenbegrenzung wiederholt das SDK
+        nicht selbst, sonst liefen die Wiederholungen an den Buckets vorbei,
+        `_aufrufen_async` wiederholt dann über die Buckets.
+        """
+        if ratenbegrenzer_holen(model) is None:
+            return self.parameter
+        return {**self.parameter, "max_retries": 0}
+
+    def wiederholungen(self, model: str) -> int:
+        if ratenbegrenzer_holen(model) is None:
+            return 0
+        return self.parameter.get("max_retries", 2)
+
+    @abstractmethod
+    def instanz_erstellen(self, model: str):
         """Muss vom Kind implementiert werden."""
         raise NotImplementedError
 
+    def kontext_cache_aktiv(self) -> bool:
+        return self.kontext_cache_unterstuetzt and kontext_cache_holen() is not None
+
+    def kontext_cache_erstellen(self, model: str, kontext: str, ttl: float) -> str:
+        """Lädt den Kontext hoch und liefert das Handle des Caches."""
+        raise NotImplementedError
+
+    def kontext_cache_verlaengern(self, model: str, handle: str, ttl: float):
+        raise NotImplementedError
+
+    def kontext_cache_loeschen(self, model: str, handle: str):
+        raise NotImplementedError
+
+    def mit_kontext_cache(
+        self, messages: list[Any], handle: str
+    ) -> tuple[list[Any], dict[str, Any]]:
+        """Nachrichten und Aufrufparameter, die den Cache statt des Kontexts nutzen."""
+        raise NotImplementedError
+
+    def ist_kontext_cache_fehler(self, e: Exception) -> bool:
+        """Der Provider kennt das Handle nicht (mehr), z.B. nach Verdrängung."""
+        return False
+
+    def batch_einreichen(self, model: str, anfragen: dict[str, list[Any]]) -> str:
+        """Reicht die Anfragen (Schlüssel -> Nachrichten) als einen Job ein."""
+        raise NotImplementedError
+
+    def batch_abfragen(
+        self, model: str, name: str
+    ) -> dict[str, AIMessage | Exception] | None:
+        """None, solange der Job läuft, danach die Antwort oder den Fehler je Schlüssel."""
+        raise NotImplementedError
+
+    async def aufrufen_async(
+        self, messages: list[Any], kontext: str | None = None
+    ) -> AIMessage:
+        """
+        Ruft das aktive Modell auf. Dabei gelten dessen RPM/TPM-Limits und das
+        adaptive Limit gleichzeitiger Aufrufe.
+
+        `kontext` ist für alle Aufrufe eines Laufs gleich (z.B. die Referenzen).
+        Mit aktivem Kontext-Cache liegt er beim Provider und wird per Handle
+        referenziert, sonst steht er vorne im System-Prompt.
+        """
+        if kontext is None:
+            return await self._aufrufen_async(messages)
+
+        kontext_cache = kontext_cache_holen() if self.kontext_cache_aktiv() else None
+        handle = None
+        if kontext_cache is not None:
+            handle = await asyncio.to_thread(
+                kontext_cache.handle_holen, self, self.aktives_model, kontext
+            )
+        if handle is not None:
+            cache_messages, parameter = self.mit_kontext_cache(messages, handle)
+            try:
+                return await self._aufrufen_async(cache_messages, **parameter)
+            except Exception as e:
+                if not self.ist_kontext_cache_fehler(e):
+                    raise
+                # Verdrängt: diesmal mit Kontext, der nächste Aufruf legt neu an
+                kontext_cache.verwerfen(self, self.aktives_model, kontext)
+
+        return await self._aufrufen_async(kontext_einfuegen(messages, kontext))
+
+    async def _aufrufen_async(self, messages: list[Any], **parameter) -> AIMessage:
+        model = self.aktives_model
+        llm_instanz = self.hole_instanz(model=model)
+
+        wiederholungen = self.wiederholungen(model)
+        for versuch in range(wiederholungen + 1):
+            try:
+                return await self._einmal_aufrufen_async(
+                    llm_instanz, model, messages, **parameter
+                )
+            except Exception as e:
+                if versuch >= wiederholungen or not ist_wiederholbar(e):
+                    raise
+                log.debug(
+                    f"{model}: Versuch {versuch + 1} fehlgeschlagen, wiederhole ({e})"
+                )
+                # Nach einem 429 wartet schon der gedrosselte Bucket
+                if not ist_ratenfehler(e):
+                    await asyncio.sleep(2**versuch)
+
+    async def _einmal_aufrufen_async(
+        self, llm_instanz, model: str, messages: list[Any], **parameter
+    ) -> AIMessage:
+        ratenbegrenzer = ratenbegrenzer_holen(model)
+        geschaetzte_tokens = 0
+        if ratenbegrenzer is not None:
+            geschaetzte_tokens = ratenbegrenzer.tokens_schaetzen(messages)
+            await ratenbegrenzer.erwerben(geschaetzte_tokens)
+
+        nebenlaeufigkeitsregler = nebenlaeufigkeitsregler_holen(model)
+        if nebenlaeufigkeitsregler is not None:
+            await nebenlaeufigkeitsregler.erwerben()
+
+        start = time.monotonic()
+        try:
+            response: AIMessage = await llm_instanz.ainvoke(messages, **parameter)
+        except Exception as e:
+            ratenfehler = ist_ratenfehler(e)
+            if ratenbegrenzer is not None and ratenfehler:
+                ratenbegrenzer.drosseln()
+            if nebenlaeufigkeitsregler is not None:
+                nebenlaeufigkeitsregler.freigeben(
+                    latenz=None, erfolg=False, ratenfehler=ratenfehler
+                )
+            raise
+        except asyncio.CancelledError:
+            if nebenlaeufigkeitsregler is not None:
+                nebenlaeufigkeitsregler.freigeben(latenz=None, erfolg=None)
+            raise
+
+        if nebenlaeufigkeitsregler is not None:
+            nebenlaeufigkeitsregler.freigeben(
+                latenz=time.monotonic() - start, erfolg=True
+            )
+        if ratenbegrenzer is not None:
+            usage_metadata = response.usage_metadata or {}
+            ratenbegrenzer.abrechnen(
+                geschaetzte_tokens,
+                usage_metadata.get("total_tokens", geschaetzte_tokens),
+            )
+        return response
+
+    async def mehrfach_aufrufen_async(
+        self, anfragen: list[tuple[list[Any], str | None]], max_gleichzeitig: int
+    ) -> list[AIMessage | BaseException]:
+        """
+        Ruft das aktive Modell für viele (Nachrichten, Kontext) auf einmal auf,
+        höchstens `max_gleichzeitig` davon gleichzeitig. Jede Anfrage läuft wie
+        ein einzelner Aufruf durch Limits, adaptives Limit und Kontext-Cache,
+        Fehler stehen an der Stelle der Antwort.
+        """
+        semaphore = asyncio.Semaphore(max_gleichzeitig)
+
+        async def aufrufen(messages: list[Any], kontext: str | None) -> AIMessage:
+            async with semaphore:
+                return await self.aufrufen_async(messages, kontext=kontext)
+
+        return await asyncio.gather(
+            *(aufrufen(messages, kontext) for messages, kontext in anfragen),
+            return_exceptions=True,
+        )
+
     @abstractmethod
     def parse_content(self, response: AIMessage) -> str:
         """Muss vom Kind implementiert werden."""
         raise NotImplementedError
 
 
+@dataclass(frozen=True)
+class Modellkonfiguration:
+    model: str
+    klasse: str
+    parameter: dict[str, Any]
+    max_gleichzeitig: int | None
+
+    @classmethod
+    def from_dict(cls, data) -> Modellkonfiguration:
+        return cls(
+            model=data["model"],
+            klasse=data["klasse"],
+            parameter=data.get("parameter", {}),
+            max_gleichzeitig=data.get("max_gleichzeitig", None),
+        )
+
+
+def provider_erstellen(modellkonfiguration: Modellkonfiguration) -> LLMProvider:
+    """Importiert das Provider-Modul ("paket.modul:Klasse") erst bei Bedarf."""
+    modul_name, klasse_name = modellkonfiguration.klasse.split(":")
+    klasse = getattr(importlib.import_module(modul_name), klasse_name)
+    return klasse(
+        models=[modellkonfiguration.model], parameter=modellkonfiguration.parameter
+    )
+
+
 class LLMProviderHandler:
+    """
+    Verwaltet die auswählbaren Modelle. Provider aus `modellkonfigurationen`
+    werden erst beim ersten Zugriff auf eines ihrer Modelle importiert und
+    erstellt, und zwar je Modell eine eigene Instanz mit eigenem aktiven Modell.
+    """
+
+    def __init__(
+        self,
+        llm_provider: list[LLMProvider] | None = None,
+        ratenbegrenzung: dict[str, Any] | None = None,
+        nebenlaeufigkeit: dict[str, Any] | None = None,
+        client_cache: dict[str, Any] | None = None,
+        antwort_cache: dict[str, Any] | None = None,
+        kontext_cache: dict[str, Any] | None = None,
+        modellkonfigurationen: list[Modellkonfiguration] | None = None,
+    ):
+        self.modellkonfigurationen: dict[str, Modellkonfiguration] = {
+            modellkonfiguration.model: modellkonfiguration
+            for modellkonfiguration in modellkonfigurationen or []
+        }
 
-    provider_models: dict[str, LLMProvider] = {}
+        if client_cache is not None:
+            client_cache_konfigurieren(client_cache)
+        if antwort_cache is not None:
+            antwort_cache_konfigurieren(antwort_cache)
+        if kontext_cache is not None:
+            kontext_cache_konfigurieren(kontext_cache)
+        if ratenbegrenzung is not None:
+            ratenbegrenzung_konfigurieren(ratenbegrenzung)
+        if nebenlaeufigkeit is not None:
+            nebenlaeufigkeit_konfigurieren(
+                nebenlaeufigkeit,
+                maxima={
+                    model: modellkonfiguration.max_gleichzeitig
+                    for model, modellkonfiguration in self.modellkonfigurationen.items()
+                    if modellkonfiguration.max_gleichzeitig
+                },
+            )
 
-    def __init__(self, llm_provider: list[LLMProvider]):
-        for provider in llm_provider:
+        self.provider_models: dict[str, LLMProvider] = {}
+        self._lock = threading.Lock()
+        for provider in llm_provider or []:
             models = provider.hole_models()
             for model in models:
                 self.provider_models[model] = provider
 
     def hole_provider(self, model: str) -> LLMProvider:
-        try:
-            provider: LLMProvider = self.provider_models[model]
-            provider.aktiviere_model(model=model)
-            return provider
-        except KeyError as e:
-            raise KeyError(
-                f"Unbekanntes Modell: {model}. Verfügbar: {list(self.provider_models)}"
-            ) from e
+        with self._lock:
+            if model not in self.provider_models:
+                try:
+                    modellkonfiguration = self.modellkonfigurationen[model]
+                except KeyError as e:
+                    raise KeyError(
+                        f"Unbekanntes Modell: {model}. Verfügbar: {self.hole_models()}"
+                    ) from e
+                self.provider_models[model] = provider_erstellen(modellkonfiguration)
+
+        provider: LLMProvider = self.provider_models[model]
+        provider.aktiviere_model(model=model)
+        return provider
 
     def hole_models(self) -> list[str]:
-        return list(self.provider_models)
+        return list(dict.fromkeys([*self.provider_models, *self.modellkonfigurationen]))
+
+    def kennzahlen(self) -> list[Nebenlaeufigkeitskennzahlen]:
+        """Aktuelle Nebenläufigkeit, Latenzen und Fehlerquote je Modell."""
+        return nebenlaeufigkeitskennzahlen()
@@ -1,25 +1,172 @@
+from typing import Any
+
+from google.genai import types
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from src.shared.llm_integrations.llm_provider import LLMProvider
 
+BATCH_FEHLER = (
+    types.JobState.JOB_STATE_FAILED,
+    types.JobState.JOB_STATE_CANCELLED,
+    types.JobState.JOB_STATE_EXPIRED,
+)
 
-class LLMProviderGoogle(LLMProvider):
-    def __init__(self, models: list[str]):
-        super().__init__(models=models)
+# Generierungsparameter des Chat-Modells, die auch Batch-Anfragen bekommen
+BATCH_PARAMETER = (
+    "temperature",
+    "top_p",
+    "top_k",
+    "max_output_tokens",
+    "presence_penalty",
+    "frequency_penalty",
+    "seed",
+)
 
-    def hole_instanz(self, model):
-        self.llm_instanz = ChatGoogleGenerativeAI(
-            model=model,
-            temperature=0,  # Gemini 3.0+ defaults to 1.0
-            max_tokens=None,
-            timeout=None,
-            max_retries=2,
-            # other params...
+
+def batch_anfrage(
+    llm_instanz: ChatGoogleGenerativeAI, schluessel: str, messages: list[Any]
+) -> types.InlinedRequest:
+    """Baut die Anfrage mit den öffentlichen Typen von google-genai."""
+    system = [m.text for m in messages if isinstance(m, SystemMessage)]
+    contents = [
+        types.Content(
+            role="model" if isinstance(m, AIMessage) else "user",
+            parts=[types.Part(text=m.text)],
+        )
+        for m in messages
+        if not isinstance(m, SystemMessage)
+    ]
+    parameter = {
+        name: getattr(llm_instanz, name)
+        for name in BATCH_PARAMETER
+        if getattr(llm_instanz, name, None) is not None
+    }
+    if llm_instanz.stop:
+        parameter["stop_sequences"] = llm_instanz.stop
+    if llm_instanz.safety_settings:
+        parameter["safety_settings"] = [
+            types.SafetySetting(category=kategorie, threshold=schwelle)
+            for kategorie, schwelle in llm_instanz.safety_settings.items()
+        ]
+    if llm_instanz.thinking_budget is not None:
+        parameter["thinking_config"] = types.ThinkingConfig(
+            thinking_budget=llm_instanz.thinking_budget
         )
-        return self.llm_instanz
+    return types.InlinedRequest(
+        contents=contents,
+        config=types.GenerateContentConfig(
+            system_instruction="\n\n".join(system) or None, **parameter
+        ),
+        metadata={"schluessel": schluessel},
+    )
+
+
+def batch_antwort(response: types.GenerateContentResponse) -> AIMessage:
+    """Antwort mit Tokenverbrauch wie bei einem einzelnen Aufruf."""
+    usage = response.usage_metadata or types.GenerateContentResponseUsageMetadata()
+    input_tokens = usage.prompt_token_count or 0
+    reasoning_tokens = usage.thoughts_token_count or 0
+    output_tokens = (usage.candidates_token_count or 0) + reasoning_tokens
+    finish_reason = (
+        response.candidates[0].finish_reason if response.candidates else None
+    )
+    return AIMessage(
+        content=response.text or "",
+        response_metadata={
+            "model_name": response.model_version,
+            "finish_reason": finish_reason.name if finish_reason else None,
+        },
+        usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": usage.total_token_count or input_tokens + output_tokens,
+            "input_token_details": {
+                "cache_read": usage.cached_content_token_count or 0
+            },
+            "output_token_details": (
+                {"reasoning": reasoning_tokens} if reasoning_tokens else {}
+            ),
+        },
+    )
+
+
+class LLMProviderGoogle(LLMProvider):
+    kontext_cache_unterstuetzt = True
+    batch_unterstuetzt = True
+
+    def instanz_erstellen(self, model):
+        return ChatGoogleGenerativeAI(model=model, **self.instanz_parameter(model))
 
     def parse_content(self, response: AIMessage):
         # https://docs.langchain.com/oss/python/integrations/chat/google_generative_ai
         # response.content  # -> [{"type": "text", "text": "Hello!", "extras": {"signature": "EpQFCp...lKx64r"}}]
         # response.text     # -> "Hello!"
         return response.text
+
+    # https://ai.google.dev/gemini-api/docs/caching
+    def kontext_cache_erstellen(self, model: str, kontext: str, ttl: float) -> str:
+        cache = self.hole_instanz(model).client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                contents=[types.Content(role="user", parts=[types.Part(text=kontext)])],
+                ttl=f"{int(ttl)}s",
+                display_name="silicon-samples-referenzen",
+            ),
+        )
+        return cache.name
+
+    def kontext_cache_verlaengern(self, model: str, handle: str, ttl: float):
+        self.hole_instanz(model).client.caches.update(
+            name=handle, config=types.UpdateCachedContentConfig(ttl=f"{int(ttl)}s")
+        )
+
+    def kontext_cache_loeschen(self, model: str, handle: str):
+        self.hole_instanz(model).client.caches.delete(name=handle)
+
+    def mit_kontext_cache(
+        self, messages: list[Any], handle: str
+    ) -> tuple[list[Any], dict[str, Any]]:
+        # Gemini lehnt eine System-Instruction zusammen mit cached_content ab
+        messages = [
+            HumanMessage(content=m.content) if isinstance(m, SystemMessage) else m
+            for m in messages
+        ]
+        return messages, {"cached_content": handle}
+
+    def ist_kontext_cache_fehler(self, e: Exception) -> bool:
+        text = str(e).lower()
+        return "cachedcontent" in text or "cached content" in text
+
+    # https://ai.google.dev/gemini-api/docs/batch-mode
+    def batch_einreichen(self, model: str, anfragen: dict[str, list[Any]]) -> str:
+        llm_instanz: ChatGoogleGenerativeAI = self.hole_instanz(model)
+        requests = [
+            batch_anfrage(llm_instanz, schluessel, messages)
+            for schluessel, messages in anfragen.items()
+        ]
+        job = llm_instanz.client.batches.create(
+            model=model,
+            src=requests,
+            config=types.CreateBatchJobConfig(display_name="silicon-samples"),
+        )
+        return job.name
+
+    def batch_abfragen(
+        self, model: str, name: str
+    ) -> dict[str, AIMessage | Exception] | None:
+        job = self.hole_instanz(model).client.batches.get(name=name)
+        if job.state in BATCH_FEHLER:
+            raise RuntimeError(f"Batch {name} beendet mit {job.state}: {job.error}")
+        if job.state != types.JobState.JOB_STATE_SUCCEEDED:
+            return None
+
+        ergebnisse: dict[str, AIMessage | Exception] = {}
+        for antwort in job.dest.inlined_responses or []:
+            schluessel = (antwort.metadata or {}).get("schluessel")
+            if antwort.error is not None or antwort.response is None:
+                ergebnisse[schluessel] = RuntimeError(
+                    f"Anfrage in Batch {name} fehlgeschlagen: {antwort.error}"
+                )
+            else:
+                ergebnisse[schluessel] = batch_antwort(antwort.response)
+        return ergebnisse
@@ -4,17 +4,8 @@ from src.shared.llm_integrations.llm_provider import LLMProvider
 
 
 class LLMProviderMistral(LLMProvider):
-    def __init__(self, models: list[str]):
-        super().__init__(models=models)
-
-    def hole_instanz(self, model):
-        self.llm_instanz = ChatMistralAI(
-            model=model,
-            temperature=0,
-            max_retries=2,
-            # other params...
-        )
-        return self.llm_instanz
+    def instanz_erstellen(self, model):
+        return ChatMistralAI(model=model, **self.instanz_parameter(model))
 
     def parse_content(self, response: AIMessage):
         # https://docs.langchain.com/oss/python/integrations/chat/deepseek
@@ -0,0 +1,55 @@
+from typing import Any
+
+from src.shared.llm_integrations.llm_provider import (
+    LLMProviderHandler,
+    Modellkonfiguration,
+)
+from src.shared.toml_config import TOMLConfig
+
+
+def modellkonfigurationen_aus_config(
+    llm_config: dict[str, Any],
+) -> list[Modellkonfiguration]:
+    """Modelle aus `[llm.models]`, Parameter des Modells ergänzen die des Providers."""
+    provider_config: dict[str, Any] = llm_config.get("provider", {})
+
+    modellkonfigurationen: list[Modellkonfiguration] = []
+    for model, model_config in llm_config.get("models", {}).items():
+        provider_name = model_config["provider"]
+        try:
+            provider = provider_config[provider_name]
+        except KeyError as e:
+            raise KeyError(
+                f"Unbekannter Provider {provider_name} für Modell {model}"
+            ) from e
+
+        modellkonfigurationen.append(
+            Modellkonfiguration.from_dict(
+                {
+                    "model": model,
+                    "klasse": provider["klasse"],
+                    "parameter": {
+                        **provider.get("parameter", {}),
+                        **model_config.get("parameter", {}),
+                    },
+                    "max_gleichzeitig": model_config.get("max_gleichzeitig"),
+                }
+            )
+        )
+    return modellkonfigurationen
+
+
+def llm_provider_handler_aus_config(llm_config: dict[str, Any]) -> LLMProviderHandler:
+    return LLMProviderHandler(
+        modellkonfigurationen=modellkonfigurationen_aus_config(llm_config),
+        ratenbegrenzung=llm_config.get("ratenbegrenzung", {}),
+        nebenlaeufigkeit=llm_config.get("nebenlaeufigkeit", {}),
+        client_cache=llm_config.get("client_cache", {}),
+        antwort_cache=llm_config.get("antwort_cache", {}),
+        kontext_cache=llm_config.get("kontext_cache", {}),
+    )
+
+
+def standard_llm_provider_handler(config_datei: str = "ssg.toml") -> LLMProviderHandler:
+    """Provider und Modelle, die in der Oberfläche und im CLI zur Auswahl stehen."""
+    return llm_provider_handler_aus_config(TOMLConfig(config_datei).get("llm", {}))
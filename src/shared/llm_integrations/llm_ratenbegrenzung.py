@@ -0,0 +1,159 @@
+from __future__ import annotations
+import asyncio
+from dataclasses import dataclass
+import threading
+import time
+from typing import Any
+
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+# Grobe Schätzung, reicht für die Reservierung; abgerechnet wird mit usage_metadata
+ZEICHEN_PRO_TOKEN = 4
+
+
+@dataclass(frozen=True)
+class Ratenlimit:
+    rpm: int | None
+    tpm: int | None
+
+    @classmethod
+    def from_dict(cls, data) -> Ratenlimit:
+        return cls(
+            rpm=data.get("rpm", None),
+            tpm=data.get("tpm", None),
+        )
+
+
+class Tokenbucket:
+    """
+    Bucket, der sich gleichmäßig auf `pro_minute` auffüllt. Reservierungen dürfen
+    den Bestand ins Minus ziehen, der Aufrufer wartet dann entsprechend lange.
+    So kommen wartende Aufrufe in der Reihenfolge ihrer Reservierung dran.
+    """
+
+    def __init__(self, pro_minute: int):
+        self.kapazitaet = float(pro_minute)
+        self.rate = pro_minute / 60
+        self.bestand = self.kapazitaet
+        self.zeitpunkt = time.monotonic()
+
+        # Threading-Lock, weil Event-Loops in mehreren Threads denselben Bucket nutzen
+        self._lock = threading.Lock()
+
+    def _auffuellen(self):
+        jetzt = time.monotonic()
+        self.bestand = min(
+            self.kapazitaet, self.bestand + (jetzt - self.zeitpunkt) * self.rate
+        )
+        self.zeitpunkt = jetzt
+
+    def reservieren(self, menge: float) -> float:
+        """Bucht `menge` ab und liefert die Wartezeit in Sekunden."""
+        with self._lock:
+            self._auffuellen()
+            self.bestand -= menge
+            return max(0.0, -self.bestand / self.rate)
+
+    def korrigieren(self, differenz: float):
+        with self._lock:
+            self._auffuellen()
+            self.bestand = min(self.kapazitaet, self.bestand + differenz)
+
+    def leeren(self):
+        with self._lock:
+            self._auffuellen()
+            self.bestand = min(self.bestand, 0.0)
+
+
+class Ratenbegrenzer:
+    def __init__(self, model: str, ratenlimit: Ratenlimit, ausgabe_tokens: int):
+        self.model = model
+        self.ratenlimit = ratenlimit
+        self.ausgabe_tokens = ausgabe_tokens
+        self.anfragen = Tokenbucket(ratenlimit.rpm) if ratenlimit.rpm else None
+        self.tokens = Tokenbucket(ratenlimit.tpm) if ratenlimit.tpm else None
+
+    def tokens_schaetzen(self, messages: list[Any]) -> int:
+        zeichen = sum(len(str(getattr(m, "content", m))) for m in messages)
+        return zeichen // ZEICHEN_PRO_TOKEN + self.ausgabe_tokens
+
+    async def erwerben(self, geschaetzte_tokens: int):
+        wartezeit = 0.0
+        if self.anfragen is not None:
+            wartezeit = max(wartezeit, self.anfragen.reservieren(1))
+        if self.tokens is not None:
+            wartezeit = max(wartezeit, self.tokens.reservieren(geschaetzte_tokens))
+
+        if wartezeit > 0:
+            log.debug(f"Ratenbegrenzung {self.model}: warte {wartezeit:.1f}s")
+            await asyncio.sleep(wartezeit)
+
+    def abrechnen(self, geschaetzte_tokens: int, tatsaechliche_tokens: int):
+        if self.tokens is not None:
+            self.tokens.korrigieren(geschaetzte_tokens - tatsaechliche_tokens)
+
+    def drosseln(self):
+        """Nach einem 429 des Providers warten alle folgenden Aufrufe auf Nachschub."""
+        log.warning(f"Ratenlimit von {self.model} erreicht, Aufrufe werden gedrosselt")
+        for bucket in (self.anfragen, self.tokens):
+            if bucket is not None:
+                bucket.leeren()
+
+
+def status_code(fehler: Exception) -> int | None:
+    return getattr(fehler, "status_code", None) or getattr(
+        getattr(fehler, "response", None), "status_code", None
+    )
+
+
+def ist_ratenfehler(fehler: Exception) -> bool:
+    return status_code(fehler) == 429 or "RESOURCE_EXHAUSTED" in str(fehler)
+
+
+def ist_wiederholbar(fehler: Exception) -> bool:
+    """Was die SDKs selbst wiederholen würden: 429, Serverfehler und Timeouts."""
+    return (
+        ist_ratenfehler(fehler)
+        or (status_code(fehler) or 0) >= 500
+        or "timeout" in type(fehler).__name__.lower()
+    )
+
+
+# Prozessweit geteilt, damit alle Fragesteller und Zusammenfassungsgeneratoren
+# eines Prozesses dieselben Buckets nutzen
+_ratenbegrenzer: dict[str, Ratenbegrenzer] = {}
+_ratenbegrenzer_lock = threading.Lock()
+
+
+def ratenbegrenzung_konfigurieren(config: dict[str, Any]):
+    """
+    Übernimmt die Limits aus `[llm.ratenbegrenzung]`. Buckets von Modellen mit
+    unverändertem Limit bleiben erhalten, damit erneutes Konfigurieren (z.B. pro
+    Streamlit-Session) die bisherige Auslastung nicht vergisst.
+    """
+    ausgabe_tokens = config.get("ausgabe_tokens_schaetzung", 1000)
+    models: dict[str, Any] = config.get("models", {})
+
+    with _ratenbegrenzer_lock:
+        for model in list(_ratenbegrenzer):
+            if model not in models:
+                del _ratenbegrenzer[model]
+
+        for model, limit in models.items():
+            ratenlimit = Ratenlimit.from_dict(limit)
+            vorhanden = _ratenbegrenzer.get(model)
+            if (
+                vorhanden is not None
+                and vorhanden.ratenlimit == ratenlimit
+                and vorhanden.ausgabe_tokens == ausgabe_tokens
+            ):
+                continue
+            _ratenbegrenzer[model] = Ratenbegrenzer(
+                model=model, ratenlimit=ratenlimit, ausgabe_tokens=ausgabe_tokens
+            )
+
+
+def ratenbegrenzer_holen(model: str) -> Ratenbegrenzer | None:
+    return _ratenbegrenzer.get(model)
@@ -1,5 +1,14 @@
 import streamlit as st
 
+from src.shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def schicke_update_an_user(text):
+    log.info(text)
+    st.toast(text, duration="infinite")
+
 
 class Status:
 
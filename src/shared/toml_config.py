@@ -56,6 +56,35 @@ class TOMLConfig:
         current[parts[-1]] = data
         self.config = target
 
+    def lade_komponenten(self) -> list[Dict[str, Any]]:
+        """
+        Lädt die TOML-Dateien aller aktiven Komponenten aus 'komponenten'
+        unter den Namespace 'komponente.<name>' und gibt diese Komponenten zurück.
+        """
+        komponenten: list[Dict[str, Any]] = []
+
+        for komponente in self.config.get("komponenten", []):
+            if not komponente.get("active", False):
+                continue
+
+            komponente_path = komponente.get("path")
+            if not komponente_path:
+                continue
+
+            komponente_configfile = komponente.get("config")
+            if not komponente_configfile:
+                continue
+
+            komponente_name = Path(komponente_path).name.split(".")[0]
+
+            self.load_config(
+                config_file=komponente_configfile,
+                namespace=f"komponente.{komponente_name}",
+            )
+            komponenten.append(komponente)
+
+        return komponenten
+
     def get(self, key, default=None):
         return self.config.get(key, default)
 
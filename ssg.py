@@ -1,50 +1,42 @@
+import sys
+
+if __name__ == "__main__" and "streamlit" not in sys.modules:
+    # Headless-Betrieb ohne Streamlit, z.B. python -m ssg run ...
+    from src.cli import main
+
+    sys.exit(main())
+
 import streamlit as st
 
 from dotenv import load_dotenv, dotenv_values
 from src.shared.komponenten import komponentenname_von_datei
-from src.shared.llm_integrations.llm_provider import LLMProviderHandler
-from src.shared.llm_integrations.llm_provider_deepseek import LLMProviderDeepSeek
-from src.shared.llm_integrations.llm_provider_google import LLMProviderGoogle
-from src.shared.llm_integrations.llm_provider_mistral import LLMProviderMistral
-from src.shared.llm_integrations.llm_provider_openai import LLMProviderOpenAI
+from src.shared.llm_integrations.llm_provider_standard import (
+    llm_provider_handler_aus_config,
+)
 from src.shared.logger import setup_logging
 from src.shared.toml_config import TOMLConfig
 
-load_dotenv()
-setup_logging()
-
-setup_logging()
-app_config = TOMLConfig("ssg.toml")
-
-pages: dict = {}
-
-for komponente in app_config.get_section("komponenten"):
-    if not komponente.get("active", False):
-        continue
 
-    komponente_path = komponente.get("path")
-    if not komponente_path:
-        continue
+def oberflaeche_starten():
+    load_dotenv()
+    setup_logging()
 
-    komponente_configfile = komponente.get("config")
-    if not komponente_configfile:
-        continue
+    setup_logging()
+    app_config = TOMLConfig("ssg.toml")
 
-    komponente_name = komponentenname_von_datei(komponente_path)
+    pages: dict = {}
 
-    app_config.load_config(
-        config_file=komponente_configfile,
-        namespace=f"komponente.{komponente_name}",
-    )
+    for komponente in app_config.lade_komponenten():
 
-    komponente_page_title = (
-        app_config.config.get("komponente", {})
-        .get(komponente_name, {})
-        .get("page", {})
-        .get("title", "")
-    )
+        komponente_path = komponente.get("path")
+        komponente_name = komponentenname_von_datei(komponente_path)
 
-    if komponente.get("active", False):
+        komponente_page_title = (
+            app_config.config.get("komponente", {})
+            .get(komponente_name, {})
+            .get("page", {})
+            .get("title", "")
+        )
 
         group: str = ""
         if komponente.get("grouped", False):
@@ -54,33 +46,22 @@ for komponente in app_config.get_section("komponenten"):
             st.Page(komponente_path, title=komponente_page_title)
         )
 
-st.session_state["config"] = app_config.config
-st.session_state["config"]["dotenv"] = dotenv_values(".env")
-
-st.session_state["llm_provider_handler"] = LLMProviderHandler(
-    [
-        LLMProviderGoogle(
-            models=[
-                "gemini-3-pro-preview",
-                "gemini-2.0-flash",
-                "gemini-2.5-pro",
-                "gemini-2.5-flash",
-            ]
-        ),
-        LLMProviderOpenAI(models=["gpt-5-mini", "gpt-5.2"]),
-        LLMProviderDeepSeek(models=["deepseek-chat"]),
-        LLMProviderMistral(
-            models=[
-                "mistral-large-latest",
-                "mistral-small-2506",
-                "ministral-3b-2512",
-                "ministral-8b-2512",
-            ]
-        ),
-    ]
-)
+    st.session_state["config"] = app_config.config
+    st.session_state["config"]["dotenv"] = dotenv_values(".env")
+
+    # Provider-Module werden erst bei der ersten Modellauswahl importiert
+    if "llm_provider_handler" not in st.session_state:
+        st.session_state["llm_provider_handler"] = llm_provider_handler_aus_config(
+            app_config.get("llm", {})
+        )
+
+    st.set_page_config(layout="wide")
+    app = st.navigation(pages, position="sidebar")
+
+    app.run()
 
-st.set_page_config(layout="wide")
-app = st.navigation(pages, position="sidebar")
 
-app.run()
+# Kindprozesse von multiprocessing (spawn) laden dieses Modul als __mp_main__
+# erneut, dort darf weder die Oberfläche noch die CLI starten
+if __name__ != "__mp_main__":
+    oberflaeche_starten()
@@ -0,0 +1,130 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.shared.llm_integrations.llm_batch import (
+    Batchspeicher,
+    LLMBatchausfuehrung,
+    LLMRunden,
+)
+from src.shared.llm_integrations.llm_gemini_testserver import GeminiTestserver
+from src.shared.llm_integrations.llm_provider_google import LLMProviderGoogle
+
+MODEL = "gemini-test"
+
+
+def frage(text: str) -> list:
+    return [HumanMessage(content=text)]
+
+
+class BatchausfuehrungTest(unittest.IsolatedAsyncioTestCase):
+    """Runden über die Batch-API gegen den lokalen Gemini-Testserver."""
+
+    def setUp(self):
+        self.server = GeminiTestserver(
+            antworten=lambda prompt: f"Antwort auf {prompt.splitlines()[-1]}"
+        ).starten()
+        self.addCleanup(self.server.beenden)
+        ordner = tempfile.TemporaryDirectory()
+        self.addCleanup(ordner.cleanup)
+
+        self.provider = LLMProviderGoogle(
+            models=[MODEL],
+            parameter={
+                "base_url": self.server.url,
+                "google_api_key": "test",
+                "temperature": 0,
+                "max_retries": 0,
+            },
+        )
+        self.provider.aktiviere_model(MODEL)
+        self.batchspeicher = Batchspeicher(Path(ordner.name) / "batch.sqlite")
+        self.ausfuehrung = LLMBatchausfuehrung(
+            self.provider, self.batchspeicher, abfrage_sekunden=0.01
+        )
+
+    def einreichen(self, anfragen: dict[str, list]) -> str:
+        """Wie ein abgebrochener Lauf: eingereicht, aber nie abgeholt."""
+        job = self.provider.batch_einreichen(MODEL, anfragen)
+        self.batchspeicher.hinzufuegen(job, MODEL, list(anfragen))
+        return job
+
+    async def test_runde(self):
+        runden = LLMRunden(self.ausfuehrung)
+
+        async def befragter(schluessel: str) -> AIMessage:
+            async with runden.teilnehmen():
+                # Erst sind alle angemeldet, dann wird gefragt
+                await asyncio.sleep(0)
+                return await runden.aufrufen(schluessel, frage(f"Frage {schluessel}"))
+
+        antworten = await asyncio.gather(befragter("a"), befragter("b"))
+
+        self.assertEqual(
+            [self.provider.parse_content(a) for a in antworten],
+            ["Antwort auf Frage a", "Antwort auf Frage b"],
+        )
+        self.assertEqual(runden.anzahl_runden, 1)
+        self.assertEqual(self.server.statistik["batches"], 1)
+        self.assertEqual(self.batchspeicher.eingereicht(MODEL, ["a", "b"]), {})
+
+    async def test_fortgesetzter_job(self):
+        await asyncio.to_thread(self.einreichen, {"a": frage("Frage a")})
+
+        ergebnisse = await self.ausfuehrung(
+            {"a": (frage("Frage a"), None), "b": (frage("Frage b"), None)}
+        )
+
+        # Nur die neue Anfrage geht in einen zweiten Job
+        self.assertEqual(self.server.statistik["batches"], 2)
+        self.assertEqual(self.server.statistik["batch_anfragen"], 2)
+        self.assertEqual(
+            self.provider.parse_content(ergebnisse["a"]), "Antwort auf Frage a"
+        )
+        self.assertEqual(
+            self.provider.parse_content(ergebnisse["b"]), "Antwort auf Frage b"
+        )
+        self.assertEqual(self.batchspeicher.eingereicht(MODEL, ["a", "b"]), {})
+
+    async def test_fehlgeschlagener_job(self):
+        job = await asyncio.to_thread(self.einreichen, {"a": frage("Frage a")})
+        self.server.batch_scheitern_lassen(job)
+
+        ergebnisse = await self.ausfuehrung(
+            {"a": (frage("Frage a"), None), "b": (frage("Frage b"), None)}
+        )
+
+        # Der Fehler trifft nur die Anfragen des gescheiterten Jobs
+        self.assertIsInstance(ergebnisse["a"], Exception)
+        self.assertIsInstance(ergebnisse["b"], AIMessage)
+        self.assertEqual(self.batchspeicher.eingereicht(MODEL, ["a", "b"]), {})
+
+        # Beim nächsten Versuch wird die Anfrage neu eingereicht
+        ergebnisse = await self.ausfuehrung({"a": (frage("Frage a"), None)})
+        self.assertIsInstance(ergebnisse["a"], AIMessage)
+        self.assertEqual(self.server.statistik["batches"], 3)
+
+    async def test_kontext_im_prompt(self):
+        ergebnisse = await self.ausfuehrung({"a": (frage("Frage a"), "Referenzen")})
+
+        self.assertIsInstance(ergebnisse["a"], AIMessage)
+        self.assertEqual(self.server.statistik["caches_erstellt"], 0)
+
+
+class RundenTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_abbruch_bleibt_abbruch(self):
+        async def ausfuehren(anfragen):
+            return {schluessel: asyncio.CancelledError() for schluessel in anfragen}
+
+        runden = LLMRunden(ausfuehren)
+        async with runden.teilnehmen():
+            with self.assertRaises(asyncio.CancelledError):
+                await runden.aufrufen("a", frage("Frage a"))
+
+
+if __name__ == "__main__":
+    unittest.main()